@@ -0,0 +1,6 @@
+"""pyfire benchmarks
+
+Run them from the package root, e.g:
+
+    $ python -m benchmarks.e2e
+"""
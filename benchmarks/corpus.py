@@ -0,0 +1,124 @@
+""" Synthetic, deterministic Campfire data of realistic shape and size, shared by the benchmarks """
+import json
+import random
+import time
+
+WORDS = (
+    "deploy build release merge branch review ticket staging production server "
+    "database query cache latency timeout error fixed broken tests passing failing "
+    "lunch meeting standup tomorrow today please thanks ok sure yes no maybe "
+    "customer report invoice design mockup feedback ship it looks good to me"
+).split()
+
+TYPES = (
+    ("TextMessage", 70),
+    ("PasteMessage", 8),
+    ("TweetMessage", 4),
+    ("UploadMessage", 3),
+    ("EnterMessage", 5),
+    ("LeaveMessage", 5),
+    ("TimestampMessage", 4),
+    ("TopicChangeMessage", 1)
+)
+
+def timestamp(value):
+    """ Format a time the way Campfire does.
+
+    Args:
+        value (float): Seconds since the epoch
+
+    Returns:
+        str. Date (e.g: 2011/05/01 12:00:00 +0000)
+    """
+    return time.strftime("%Y/%m/%d %H:%M:%S +0000", time.gmtime(value))
+
+def messages(count, rooms=5, users=50, seed=1):
+    """ Build a list of messages, as Campfire returns them.
+
+    Args:
+        count (int): Number of messages
+
+    Kwargs:
+        rooms (int): Number of distinct rooms
+        users (int): Number of distinct users
+        seed (int): Random seed, so every run gets the same corpus
+
+    Returns:
+        array. Messages (each message is a dict)
+    """
+    generator = random.Random(seed)
+    types = [name for name, weight in TYPES for i in range(weight)]
+    started = 1300000000
+
+    result = []
+    for id in range(1, count + 1):
+        type = generator.choice(types)
+        message = {
+            "id": id,
+            "room_id": generator.randint(1, rooms),
+            "user_id": generator.randint(1, users),
+            "body": None,
+            "type": type,
+            "starred": generator.random() < 0.02,
+            "created_at": timestamp(started + id * 7)
+        }
+
+        if type in ("TextMessage", "TopicChangeMessage"):
+            message["body"] = " ".join([generator.choice(WORDS) for i in range(generator.randint(3, 25))])
+        elif type == "PasteMessage":
+            message["body"] = "\n".join([" ".join([generator.choice(WORDS) for i in range(8)]) for line in range(generator.randint(2, 40))])
+        elif type == "TweetMessage":
+            author = generator.choice(WORDS)
+            if generator.random() < 0.5:
+                message["body"] = "%s -- @%s, http://twitter.com/%s/status/%d" % (
+                    " ".join([generator.choice(WORDS) for i in range(12)]), author, author, 10 ** 10 + id
+                )
+            else:
+                message["body"] = "---\n:message: \"%s\"\n:author_username: %s\n:id: %d\n:author_avatar_url: http://example.com/%s.png" % (
+                    " ".join([generator.choice(WORDS) for i in range(12)]), author, 10 ** 10 + id, author
+                )
+        elif type == "UploadMessage":
+            message["body"] = "%s.png" % generator.choice(WORDS)
+
+        result.append(message)
+    return result
+
+def document(count, key="messages", **kwargs):
+    """ Build the JSON document of a response holding messages.
+
+    Args:
+        count (int): Number of messages
+
+    Kwargs:
+        key (str): Key holding the messages
+
+    Returns:
+        str. JSON
+    """
+    return json.dumps({key: messages(count, **kwargs)})
+
+def live_stream(count, chunk_size=None, **kwargs):
+    """ Build what a live stream sends for a number of messages: HTTP headers
+    followed by one chunk per message, and a few keep alive chunks.
+
+    Args:
+        count (int): Number of messages
+
+    Kwargs:
+        chunk_size (int): If specified, split the data in reads of this size (as the network would),
+                          otherwise return one read per chunk
+
+    Returns:
+        array. Data reads
+    """
+    reads = ["HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n"]
+    for index, message in enumerate(messages(count, **kwargs)):
+        if index % 50 == 0:
+            reads.append("1\r\n \r\n")
+        line = json.dumps(message) + "\r"
+        reads.append("%x\r\n%s\r\n" % (len(line), line))
+
+    if chunk_size:
+        data = "".join(reads[1:])
+        reads = reads[:1] + [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+    return reads
@@ -0,0 +1,291 @@
+""" End to end benchmarks, run against a local :class:`FakeCampfireServer`:
+
+    $ python -m benchmarks.e2e
+    $ python -m benchmarks.e2e --latency 0.02 --messages 5000 --json results.json
+    $ python -m benchmarks.e2e --messages 20000 --transport --upload-size 0
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from pyfire import Campfire
+
+from .fakeserver import FakeCampfireServer
+
+def percentile(values, percent):
+    """ Get a percentile of a list of values (nearest rank).
+
+    Args:
+        values (list): Values
+        percent (float): Percentile (0 - 100)
+
+    Returns:
+        float. Value, or None if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+def summarize(values):
+    """ Summarize a list of durations.
+
+    Args:
+        values (list): Durations in seconds
+
+    Returns:
+        dict. Summary, with keys: count, mean, p50, p90, p99, max
+    """
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None
+    }
+
+def timed(func, iterations):
+    """ Call a function several times, timing each call.
+
+    Args:
+        func (func): Function to call
+        iterations (int): Number of calls
+
+    Returns:
+        dict. Summary of the durations (see :func:`summarize`)
+    """
+    durations = []
+    for i in range(iterations):
+        started = time.time()
+        func()
+        durations.append(time.time() - started)
+    return summarize(durations)
+
+def bench_rest(campfire, room, iterations):
+    """ Measure the latency of the REST calls.
+
+    Args:
+        campfire (:class:`Campfire`): Campfire
+        room (:class:`Room`): Room
+        iterations (int): Calls per endpoint
+
+    Returns:
+        dict. Latency summary, indexed by operation
+    """
+    return {
+        "rooms": timed(lambda: campfire.get_rooms(), iterations),
+        "room": timed(lambda: room._load(), iterations),
+        "recent": timed(lambda: room.recent(limit=50), iterations),
+        "speak": timed(lambda: room.speak("Benchmark message"), iterations),
+        "transcript": timed(lambda: room.transcript(), iterations),
+        "search": timed(lambda: campfire.search("message"), iterations)
+    }
+
+def bench_stream(campfire, room, messages, timeout=60, transport=False):
+    """ Measure live stream throughput, and how long it takes for a message
+    sent by the server to reach an observer.
+
+    Args:
+        campfire (:class:`Campfire`): Campfire
+        room (:class:`Room`): Room
+        messages (int): Number of messages the server sends to the stream
+
+    Kwargs:
+        timeout (float): Maximum seconds to wait for all messages
+        transport (bool or dict): Stream transport (see :class:`Stream`)
+
+    Returns:
+        dict. Results, with keys: messages (received), seconds, messages_per_second, delivery (latency
+        summary, from the server), process_delivery_median and process_delivery_p99 (seconds from the
+        streaming process to the observer, as measured by the stream), dropped (by the transport)
+    """
+    received = []
+    done = threading.Event()
+
+    def incoming(message):
+        received.append((time.time(), message.sent_at))
+        if len(received) >= messages:
+            done.set()
+
+    errors = []
+    stream = room.get_stream(error_callback=lambda error, room: errors.append(error), transport=transport)
+    stream.attach(incoming).start()
+    done.wait(timeout)
+    stream.stop().join()
+
+    stats = stream.get_stats()
+    if not received:
+        return {"messages": 0, "seconds": None, "messages_per_second": None, "delivery": summarize([]),
+            "process_delivery_median": None, "process_delivery_p99": None, "dropped": stats["dropped"], "errors": len(errors)}
+
+    seconds = received[-1][0] - received[0][1]
+    return {
+        "messages": len(received),
+        "seconds": seconds,
+        "messages_per_second": len(received) / seconds if seconds else None,
+        "delivery": summarize([arrived - sent for arrived, sent in received]),
+        "process_delivery_median": stats["delivery_median"],
+        "process_delivery_p99": stats["delivery_p99"],
+        "dropped": stats["dropped"],
+        "errors": len(errors)
+    }
+
+def bench_upload(room, size, timeout=120):
+    """ Measure upload throughput.
+
+    Args:
+        room (:class:`Room`): Room
+        size (int): Bytes to upload
+
+    Kwargs:
+        timeout (float): Maximum seconds to wait for the upload
+
+    Returns:
+        dict. Results, with keys: bytes, seconds, mb_per_second, finished
+    """
+    handle, path = tempfile.mkstemp(suffix=".bin")
+    try:
+        block = os.urandom(2 ** 16)
+        written = 0
+        while written < size:
+            os.write(handle, block[:size - written])
+            written += min(len(block), size - written)
+        os.close(handle)
+
+        finished = threading.Event()
+        started = time.time()
+        upload = room.upload(path, finished_callback=finished.set)
+        upload.start()
+        upload.join(timeout)
+        seconds = time.time() - started
+        if upload.is_alive():
+            upload.stop().join()
+    finally:
+        os.remove(path)
+
+    return {
+        "bytes": size,
+        "seconds": seconds,
+        "mb_per_second": (size / float(2 ** 20)) / seconds if finished.is_set() else None,
+        "finished": finished.is_set()
+    }
+
+def run(latency=0, iterations=50, messages=1000, message_rate=0, upload_size=8 * 2 ** 20, history=100, transport=False):
+    """ Run every benchmark against a new fake server.
+
+    Kwargs:
+        latency (float): Seconds the server waits before answering each REST request
+        iterations (int): Calls per REST endpoint
+        messages (int): Messages sent to the live stream (0 to skip)
+        message_rate (float): Messages per second sent to the live stream (0 sends them as fast as possible)
+        upload_size (int): Bytes to upload (0 to skip)
+        history (int): Messages already posted in each room
+        transport (bool or dict): Live stream transport (see :class:`Stream`)
+
+    Returns:
+        dict. Results, with keys: settings, rest, stream, upload, server
+    """
+    server = FakeCampfireServer(
+        latency=latency,
+        history=history,
+        stream_messages=messages,
+        message_rate=message_rate
+    ).start()
+    try:
+        campfire = Campfire("benchmark", "user", "password", base_url=server.url, stream_url=server.url)
+        room = campfire.get_room_by_name("Room 1")
+
+        results = {
+            "settings": {
+                "latency": latency,
+                "iterations": iterations,
+                "messages": messages,
+                "message_rate": message_rate,
+                "upload_size": upload_size,
+                "history": history,
+                "transport": transport
+            },
+            "rest": bench_rest(campfire, room, iterations)
+        }
+        if messages:
+            results["stream"] = bench_stream(campfire, room, messages, transport=transport)
+        if upload_size:
+            results["upload"] = bench_upload(room, upload_size)
+        results["server"] = server.get_stats()
+        return results
+    finally:
+        server.stop()
+
+def report(results, out=sys.stdout):
+    """ Print results in a human readable way.
+
+    Args:
+        results (dict): Results, as returned by :func:`run`
+
+    Kwargs:
+        out (file): Where to print
+    """
+    ms = lambda value: "%9.2f" % (value * 1000) if value is not None else "%9s" % "-"
+
+    out.write("REST latency (ms)\n")
+    out.write("%-12s %9s %9s %9s %9s %9s\n" % ("operation", "mean", "p50", "p90", "p99", "max"))
+    for name in sorted(results["rest"]):
+        summary = results["rest"][name]
+        out.write("%-12s %s %s %s %s %s\n" % (name, ms(summary["mean"]), ms(summary["p50"]), ms(summary["p90"]), ms(summary["p99"]), ms(summary["max"])))
+
+    if "stream" in results:
+        stream = results["stream"]
+        out.write("\nLive stream\n")
+        out.write("messages received: %d\n" % stream["messages"])
+        if stream["messages_per_second"]:
+            out.write("messages/sec:      %.1f\n" % stream["messages_per_second"])
+        delivery = stream["delivery"]
+        if delivery["count"]:
+            out.write("delivery (ms):     p50 %s  p90 %s  p99 %s  max %s\n" % tuple([ms(delivery[key]).strip() for key in ("p50", "p90", "p99", "max")]))
+        if stream["process_delivery_median"] is not None:
+            out.write("process to observer (ms): p50 %s  p99 %s\n" % (ms(stream["process_delivery_median"]).strip(), ms(stream["process_delivery_p99"]).strip()))
+        if stream["dropped"]:
+            out.write("dropped:           %d\n" % stream["dropped"])
+
+    if "upload" in results:
+        upload = results["upload"]
+        out.write("\nUpload\n")
+        if upload["finished"]:
+            out.write("%.1f MB in %.2f s: %.2f MB/s\n" % (upload["bytes"] / float(2 ** 20), upload["seconds"], upload["mb_per_second"]))
+        else:
+            out.write("upload did not finish\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run pyfire end to end benchmarks against a local fake Campfire server")
+    parser.add_argument("--latency", type=float, default=0, help="seconds the server waits before answering each REST request")
+    parser.add_argument("--iterations", type=int, default=50, help="calls per REST endpoint")
+    parser.add_argument("--messages", type=int, default=1000, help="messages sent to the live stream (0 to skip)")
+    parser.add_argument("--rate", type=float, default=0, help="live stream messages per second (0 for as fast as possible)")
+    parser.add_argument("--upload-size", type=int, default=8 * 2 ** 20, help="bytes to upload (0 to skip)")
+    parser.add_argument("--history", type=int, default=100, help="messages already posted in each room")
+    parser.add_argument("--transport", action="store_true", help="send live stream messages through a pipe transport, as raw JSON")
+    parser.add_argument("--json", metavar="PATH", help="also save results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = run(
+        latency=args.latency,
+        iterations=args.iterations,
+        messages=args.messages,
+        message_rate=args.rate,
+        upload_size=args.upload_size,
+        history=args.history,
+        transport=args.transport
+    )
+    report(results)
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=4, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
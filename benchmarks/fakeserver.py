@@ -0,0 +1,602 @@
+import BaseHTTPServer
+import gzip
+import json
+import Queue
+import re
+import socket
+import SocketServer
+import StringIO
+import threading
+import time
+import urllib
+import urlparse
+
+def timestamp(value=None):
+    """ Format a time the way Campfire does.
+
+    Kwargs:
+        value (float): Seconds since the epoch (defaults to now)
+
+    Returns:
+        str. Date (e.g: 2011/05/01 12:00:00 +0000)
+    """
+    return time.strftime("%Y/%m/%d %H:%M:%S +0000", time.gmtime(value))
+
+class FakeCampfireServer(object):
+    """ A local stand-in for Campfire, implementing the REST endpoints and the
+    live stream used by pyfire, so it can be tested and benchmarked without
+    reaching the real service.
+
+    Usage:
+
+        server = FakeCampfireServer(latency=0.01).start()
+        campfire = pyfire.Campfire("test", "user", "password", base_url=server.url, stream_url=server.url)
+        ...
+        server.stop()
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, rooms=3, users=10, history=100,
+        stream_messages=0, message_rate=0, keepalive=3, compress=False):
+        """ Initialize.
+
+        Kwargs:
+            host (str): Address to listen on
+            port (int): Port to listen on (0 picks a free port)
+            latency (float): Seconds to wait before answering each REST request
+            rooms (int): Number of rooms
+            users (int): Number of users
+            history (int): Number of messages already posted in each room
+            stream_messages (int): Number of messages sent to each live stream right after it connects
+            message_rate (float): Messages per second sent to live streams (0 sends them as fast as possible)
+            keepalive (float): Seconds between keep alive chunks on idle live streams
+            compress (bool): If True, gzip responses for clients that accept it
+        """
+        self.latency = latency
+        self.stream_messages = stream_messages
+        self.message_rate = message_rate
+        self.keepalive = keepalive
+        self.compress = compress
+
+        self._lock = threading.Lock()
+        self._listeners = {}
+        self._connections = {}
+        self._stats = {"requests": 0, "streams": 0, "streamed": 0, "uploaded": 0}
+        self._running = False
+        self._thread = None
+        self._next_message_id = 1
+
+        self._users = {}
+        for id in range(1, users + 1):
+            self._users[id] = {
+                "id": id,
+                "name": "User %d" % id,
+                "email_address": "user%d@example.com" % id,
+                "admin": id == 1,
+                "type": "Member",
+                "avatar_url": "http://example.com/avatar/%d.png" % id,
+                "created_at": timestamp(0)
+            }
+        self._users[1]["api_auth_token"] = "token"
+
+        self._rooms = {}
+        self._messages = {}
+        self._uploads = {}
+        for id in range(1, rooms + 1):
+            self._rooms[id] = {
+                "id": id,
+                "name": "Room %d" % id,
+                "topic": "Topic for room %d" % id,
+                "membership_limit": 60,
+                "full": False,
+                "open_to_guests": False,
+                "locked": False,
+                "created_at": timestamp(0),
+                "updated_at": timestamp(0)
+            }
+            self._messages[id] = []
+            self._uploads[id] = []
+            for index in range(history):
+                self._add_message(id, 1 + index % users, "Message %d in room %d" % (index, id))
+
+        self._server = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._server.campfire = self
+
+    @property
+    def url(self):
+        """ Base URL of this server, to be used as base_url / stream_url """
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        """ Start serving requests in a background thread.
+
+        Returns:
+            :class:`FakeCampfireServer`. Current instance to allow chaining
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving, closing any live stream. """
+        self._running = False
+        self._lock.acquire()
+        try:
+            for listeners in self._listeners.values():
+                for listener in listeners:
+                    listener.put(None)
+        finally:
+            self._lock.release()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+        self._lock.acquire()
+        try:
+            connections = self._connections.items()
+        finally:
+            self._lock.release()
+        for connection, thread in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            thread.join(1)
+
+    def is_running(self):
+        """ Tell if the server is running.
+
+        Returns:
+            bool. Success
+        """
+        return self._running
+
+    def get_stats(self):
+        """ Get what the server has seen so far.
+
+        Returns:
+            dict. Stats, with keys: requests (REST requests), streams (live streams opened),
+            streamed (messages sent to live streams), uploaded (upload bytes received)
+        """
+        self._lock.acquire()
+        try:
+            return dict(self._stats)
+        finally:
+            self._lock.release()
+
+    def count(self, name, value=1):
+        """ Increase a stat.
+
+        Args:
+            name (str): Stat name
+
+        Kwargs:
+            value (int): Increment
+        """
+        self._lock.acquire()
+        try:
+            self._stats[name] += value
+        finally:
+            self._lock.release()
+
+    def connected(self, connection):
+        """ Track an open client connection, so it can be closed when stopping.
+
+        Args:
+            connection (socket): Client socket
+        """
+        self._lock.acquire()
+        try:
+            self._connections[connection] = threading.current_thread()
+        finally:
+            self._lock.release()
+
+    def disconnected(self, connection):
+        self._lock.acquire()
+        try:
+            self._connections.pop(connection, None)
+        finally:
+            self._lock.release()
+
+    def get_user(self, id):
+        return self._users.get(id)
+
+    def get_room(self, id, users=False):
+        room = self._rooms.get(id)
+        if room and users:
+            room = dict(room)
+            room["users"] = self._users.values()[:5]
+        return room
+
+    def get_rooms(self):
+        return [self._rooms[id] for id in sorted(self._rooms)]
+
+    def update_room(self, id, data):
+        self._lock.acquire()
+        try:
+            for field in ("name", "topic"):
+                if field in data:
+                    self._rooms[id][field] = data[field]
+            self._rooms[id]["updated_at"] = timestamp()
+        finally:
+            self._lock.release()
+
+    def get_messages(self, id, since_message_id=None, limit=None):
+        self._lock.acquire()
+        try:
+            messages = self._messages.get(id, [])
+            if since_message_id:
+                messages = [message for message in messages if message["id"] > since_message_id]
+            if limit:
+                messages = messages[-limit:]
+            return list(messages)
+        finally:
+            self._lock.release()
+
+    def search(self, terms):
+        terms = terms.lower()
+        self._lock.acquire()
+        try:
+            return [message for id in sorted(self._messages) for message in self._messages[id] if terms in (message["body"] or "").lower()]
+        finally:
+            self._lock.release()
+
+    def speak(self, id, user_id, data):
+        """ Post a message to a room, sending it to every live stream of that room.
+
+        Args:
+            id (int): Room ID
+            user_id (int): User ID
+            data (dict): Message data
+
+        Returns:
+            dict. Message
+        """
+        self._lock.acquire()
+        try:
+            message = self._add_message(id, user_id, data.get("body"), data.get("type") or "TextMessage")
+            for listener in self._listeners.get(id, []):
+                listener.put(message)
+            return message
+        finally:
+            self._lock.release()
+
+    def add_upload(self, id, user_id, name, size):
+        self._lock.acquire()
+        try:
+            message = self._add_message(id, user_id, name, "UploadMessage")
+            upload = {
+                "id": len(self._uploads[id]) + 1,
+                "name": name,
+                "byte_size": size,
+                "content_type": "application/octet-stream",
+                "room_id": id,
+                "user_id": user_id,
+                "created_at": timestamp(),
+                "full_url": "http://example.com/uploads/%d/%s" % (message["id"], name)
+            }
+            message["upload"] = upload
+            self._uploads[id].append(upload)
+            self._stats["uploaded"] += size
+            return upload
+        finally:
+            self._lock.release()
+
+    def get_uploads(self, id):
+        return list(self._uploads.get(id, []))
+
+    def get_message_upload(self, id, message_id):
+        for message in self._messages.get(id, []):
+            if message["id"] == message_id:
+                return message.get("upload")
+
+    def listen(self, id):
+        """ Register a live stream listener for a room.
+
+        Args:
+            id (int): Room ID
+
+        Returns:
+            :class:`Queue.Queue`. Queue where messages posted to the room are put (None when the server stops)
+        """
+        listener = Queue.Queue()
+        self._lock.acquire()
+        try:
+            self._listeners.setdefault(id, []).append(listener)
+            self._stats["streams"] += 1
+        finally:
+            self._lock.release()
+        return listener
+
+    def unlisten(self, id, listener):
+        self._lock.acquire()
+        try:
+            self._listeners[id].remove(listener)
+        finally:
+            self._lock.release()
+
+    def generate(self, id, index):
+        """ Build a message sent to live streams without being stored.
+
+        Args:
+            id (int): Room ID
+            index (int): Message number for this stream
+
+        Returns:
+            dict. Message
+        """
+        self._lock.acquire()
+        try:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        finally:
+            self._lock.release()
+        return {
+            "id": message_id,
+            "room_id": id,
+            "user_id": 1 + index % len(self._users),
+            "body": "Streamed message %d" % index,
+            "type": "TextMessage",
+            "starred": False,
+            "created_at": timestamp()
+        }
+
+    def _add_message(self, id, user_id, body, type="TextMessage"):
+        message = {
+            "id": self._next_message_id,
+            "room_id": id,
+            "user_id": user_id,
+            "body": body,
+            "type": type,
+            "starred": False,
+            "created_at": timestamp()
+        }
+        self._next_message_id += 1
+        self._messages[id].append(message)
+        return message
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffer responses so each one is sent at once, instead of one packet per header
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    ROUTES = (
+        ("GET", r"^users/me$", "_get_me"),
+        ("GET", r"^users/(\d+)$", "_get_user"),
+        ("GET", r"^rooms$", "_get_rooms"),
+        ("GET", r"^room/(\d+)$", "_get_room"),
+        ("PUT", r"^room/(\d+)$", "_put_room"),
+        ("POST", r"^room/(\d+)/(join|leave|lock|unlock)$", "_post_room_action"),
+        ("GET", r"^room/(\d+)/recent$", "_get_recent"),
+        ("POST", r"^room/(\d+)/speak$", "_post_speak"),
+        ("GET", r"^room/(\d+)/transcript(?:/\d+/\d+/\d+)?$", "_get_transcript"),
+        ("GET", r"^room/(\d+)/uploads$", "_get_uploads"),
+        ("POST", r"^room/(\d+)/uploads$", "_post_upload"),
+        ("GET", r"^room/(\d+)/messages/(\d+)/upload$", "_get_message_upload"),
+        ("GET", r"^room/(\d+)/live$", "_get_live"),
+        ("GET", r"^search/(.+)$", "_get_search"),
+        ("POST", r"^messages/(\d+)/star$", "_post_room_action"),
+        ("DELETE", r"^messages/(\d+)/star$", "_post_room_action")
+    )
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.campfire.connected(self.connection)
+
+    def finish(self):
+        self.server.campfire.disconnected(self.connection)
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        campfire = self.server.campfire
+        url = urlparse.urlsplit(self.path)
+        path = url.path.strip("/")
+        if path.endswith(".json"):
+            path = path[:-5]
+        self._query = dict(urlparse.parse_qsl(url.query))
+
+        for route_method, pattern, handler in self.ROUTES:
+            matches = re.match(pattern, path)
+            if matches and route_method == method:
+                break
+        else:
+            self._discard_body()
+            return self._send(404)
+
+        if not self.headers.getheader("authorization", "").startswith("Basic "):
+            self._discard_body()
+            return self._send(401, headers={"WWW-Authenticate": 'Basic realm="Application"'})
+
+        if handler != "_get_live":
+            campfire.count("requests")
+            if campfire.latency:
+                time.sleep(campfire.latency)
+
+        getattr(self, handler)(*matches.groups())
+
+    def _get_me(self):
+        self._send(200, {"user": self.server.campfire.get_user(1)})
+
+    def _get_user(self, id):
+        user = self.server.campfire.get_user(int(id))
+        self._send(200, {"user": user}) if user else self._send(404)
+
+    def _get_rooms(self):
+        self._send(200, {"rooms": self.server.campfire.get_rooms()})
+
+    def _get_room(self, id):
+        room = self.server.campfire.get_room(int(id), users=True)
+        self._send(200, {"room": room}) if room else self._send(404)
+
+    def _put_room(self, id):
+        data = self._read_json()
+        if not self.server.campfire.get_room(int(id)):
+            return self._send(404)
+        self.server.campfire.update_room(int(id), data.get("room") or {})
+        self._send(200)
+
+    def _post_room_action(self, id, action=None):
+        self._discard_body()
+        self._send(200)
+
+    def _get_recent(self, id):
+        if not self.server.campfire.get_room(int(id)):
+            return self._send(404)
+        messages = self.server.campfire.get_messages(
+            int(id),
+            since_message_id=int(self._query.get("since_message_id", 0)),
+            limit=int(self._query.get("limit", 100))
+        )
+        self._send(200, {"messages": messages})
+
+    def _post_speak(self, id):
+        data = self._read_json()
+        if not self.server.campfire.get_room(int(id)):
+            return self._send(404)
+        message = self.server.campfire.speak(int(id), 1, data.get("message") or {})
+        self._send(201, {"message": message})
+
+    def _get_transcript(self, id):
+        if not self.server.campfire.get_room(int(id)):
+            return self._send(404)
+        self._send(200, {"messages": self.server.campfire.get_messages(int(id))})
+
+    def _get_search(self, terms):
+        self._send(200, {"messages": self.server.campfire.search(urllib.unquote_plus(terms))})
+
+    def _get_uploads(self, id):
+        self._send(200, {"uploads": self.server.campfire.get_uploads(int(id))})
+
+    def _post_upload(self, id):
+        size = 0
+        name = "upload"
+        remaining = int(self.headers.getheader("content-length", 0))
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, 2 ** 16))
+            if not data:
+                break
+            if not size:
+                matches = re.search(r'filename="([^"]+)"', data)
+                if matches:
+                    name = matches.group(1)
+            size += len(data)
+            remaining -= len(data)
+
+        if not self.server.campfire.get_room(int(id)):
+            return self._send(404)
+        self._send(201, {"upload": self.server.campfire.add_upload(int(id), 1, name, size)})
+
+    def _get_message_upload(self, id, message_id):
+        upload = self.server.campfire.get_message_upload(int(id), int(message_id))
+        self._send(200, {"upload": upload}) if upload else self._send(404)
+
+    def _get_live(self, id):
+        """ Live stream: a chunked response where each chunk is a JSON message
+        followed by a carriage return, and a single space is sent as keep alive. """
+        campfire = self.server.campfire
+        id = int(id)
+        if not campfire.get_room(id):
+            return self._send(404)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        listener = campfire.listen(id)
+        sent = 0
+        relayed = 0
+        interval = 1.0 / campfire.message_rate if campfire.message_rate else 0
+        next_message = time.time()
+        try:
+            while campfire.is_running():
+                if sent < campfire.stream_messages:
+                    wait = next_message - time.time()
+                    if wait <= 0:
+                        message = campfire.generate(id, sent)
+                        message["sent_at"] = time.time()
+                        self._write_chunk(json.dumps(message) + "\r")
+                        sent += 1
+                        next_message += interval
+                        continue
+                else:
+                    wait = campfire.keepalive
+
+                try:
+                    message = listener.get(timeout=wait)
+                except Queue.Empty:
+                    if sent >= campfire.stream_messages:
+                        self._write_chunk(" ")
+                    continue
+
+                if message is None:
+                    break
+                message = dict(message, sent_at=time.time())
+                self._write_chunk(json.dumps(message) + "\r")
+                relayed += 1
+        except IOError:
+            pass
+        finally:
+            campfire.unlisten(id, listener)
+            campfire.count("streamed", sent + relayed)
+            self.close_connection = 1
+
+    def _write_chunk(self, data):
+        self.wfile.write("%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _read_json(self):
+        length = int(self.headers.getheader("content-length", 0))
+        body = self.rfile.read(length) if length else ""
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+    def _discard_body(self):
+        length = int(self.headers.getheader("content-length", 0))
+        if length:
+            self.rfile.read(length)
+
+    def _send(self, status, data=None, headers=None):
+        body = json.dumps(data) if data is not None else ""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if body and self.server.campfire.compress and "gzip" in self.headers.getheader("accept-encoding", ""):
+            buffer = StringIO.StringIO()
+            compressed = gzip.GzipFile(fileobj=buffer, mode="wb")
+            compressed.write(body)
+            compressed.close()
+            body = buffer.getvalue()
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,368 @@
+""" Micro benchmarks of pyfire's CPU bound hot paths, compared against a stored baseline:
+
+    $ python -m benchmarks.micro
+    $ python -m benchmarks.micro --update-baseline
+
+Each benchmark reports the best time per item (message, timestamp, MB) out of
+several runs. When a baseline exists, benchmarks slower than the baseline by
+more than the threshold are flagged, and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+
+from twisted.test import proto_helpers
+
+from pyfire import chunked
+from pyfire.connection import Connection
+from pyfire.entity import CampfireEntity
+from pyfire.message import CompactMessage, Message
+from pyfire.stream import LiveStreamProtocol
+from pyfire.twistedx.producer import MultiPartProducer
+
+from . import corpus
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+THRESHOLD = 0.25
+
+class StubEntity(object):
+    def __init__(self, id):
+        self.id = id
+
+class StubConnection(object):
+    def get(self, url=None, parse_data=True, key=None, parameters=None):
+        return {"name": "upload.png", "full_url": "http://example.com/upload.png"}
+
+class StubCampfire(object):
+    """ Campfire that never reaches the network, so only message handling is measured """
+
+    def __init__(self):
+        self._connection = StubConnection()
+        self._users = {}
+        self._rooms = {}
+
+    def get_connection(self):
+        return self._connection
+
+    def get_user(self, id=None):
+        if id not in self._users:
+            self._users[id] = StubEntity(id)
+        return self._users[id]
+
+    def get_room(self, id):
+        if id not in self._rooms:
+            self._rooms[id] = StubEntity(id)
+        return self._rooms[id]
+
+class StubStream(object):
+    """ Live stream process receiving what :class:`LiveStreamProtocol` parses """
+
+    def __init__(self):
+        self.received_count = 0
+        self._connection = Connection(base_url="http://localhost", user="x", password="x", compress=False)
+
+    def get_room_id(self):
+        return 1
+
+    def get_connection(self):
+        return self._connection
+
+    def set_protocol(self, protocol):
+        pass
+
+    def connected(self):
+        pass
+
+    def received(self, messages, received_bytes=0):
+        self.received_count += len(messages)
+
+class StubFactory(object):
+    def __init__(self, stream):
+        self._stream = stream
+
+    def get_stream(self):
+        return self._stream
+
+class NullConsumer(object):
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+def bench_message_init(size):
+    """ :class:`Message` construction (datetime parsing, tweet detection, related entities) """
+    campfire = StubCampfire()
+    messages = corpus.messages(size)
+    def setup():
+        copies = [dict(message) for message in messages]
+        return lambda: [Message(campfire, message) for message in copies]
+    return setup, size, "message"
+
+def bench_compact_message_init(size):
+    """ :class:`CompactMessage` construction """
+    campfire = StubCampfire()
+    messages = corpus.messages(size)
+    def setup():
+        return lambda: [CompactMessage(campfire, message) for message in messages]
+    return setup, size, "message"
+
+def bench_parse_datetime(size):
+    """ :meth:`CampfireEntity._parse_datetime` """
+    entity = CampfireEntity(None)
+    values = [message["created_at"] for message in corpus.messages(size)]
+    def setup():
+        return lambda: [entity._parse_datetime(value) for value in values]
+    return setup, size, "timestamp"
+
+def bench_connection_parse(size):
+    """ :meth:`Connection.parse` of a messages response """
+    connection = Connection(base_url="http://localhost", user="x", password="x")
+    text = corpus.document(size)
+    def setup():
+        return lambda: connection.parse(text, "messages")
+    return setup, size, "message"
+
+def bench_raw_data_received(size):
+    """ :class:`LiveStreamProtocol` parsing of a chunked live stream, one chunk per read """
+    reads = corpus.live_stream(size)
+    def setup():
+        stream = StubStream()
+        protocol = LiveStreamProtocol()
+        protocol.factory = StubFactory(stream)
+        protocol.makeConnection(proto_helpers.StringTransport())
+        def run():
+            for data in reads:
+                protocol.dataReceived(data)
+            assert stream.received_count == size, "Expected %d messages, got %d" % (size, stream.received_count)
+        return run
+    return setup, size, "message"
+
+def bench_raw_data_received_split(size):
+    """ :class:`LiveStreamProtocol` parsing of a chunked live stream, read in network sized pieces """
+    reads = corpus.live_stream(size, chunk_size=1400)
+    def setup():
+        stream = StubStream()
+        protocol = LiveStreamProtocol()
+        protocol.factory = StubFactory(stream)
+        protocol.makeConnection(proto_helpers.StringTransport())
+        def run():
+            for data in reads:
+                protocol.dataReceived(data)
+            assert stream.received_count == size, "Expected %d messages, got %d" % (size, stream.received_count)
+        return run
+    return setup, size, "message"
+
+def bench_chunked_decode(size):
+    """ :class:`ChunkedDecoder` and :class:`LineBuffer` splitting a live stream into messages """
+    reads = corpus.live_stream(size * 10, chunk_size=1400)[1:]
+    megabytes = sum([len(data) for data in reads]) / float(2 ** 20)
+    def setup():
+        def run():
+            decoder = chunked.ChunkedDecoder()
+            lines = chunked.LineBuffer()
+            count = 0
+            for data in reads:
+                count += len(lines.feed(decoder.feed(data)))
+            assert count == size * 10, "Expected %d lines, got %d" % (size * 10, count)
+        return run
+    return setup, megabytes, "MB"
+
+def bench_multipart_produce(size):
+    """ :meth:`MultiPartProducer._produce` streaming a file to a consumer """
+    megabytes = max(1, size // 100)
+    handle, path = tempfile.mkstemp(suffix=".bin")
+    os.write(handle, os.urandom(2 ** 20) * megabytes)
+    os.close(handle)
+    def setup():
+        def run():
+            producer = MultiPartProducer({"upload": path}, {"name": "value"})
+            consumer = NullConsumer()
+            producer.startProducing(consumer)
+            assert consumer.written == producer.length
+        return run
+    return setup, megabytes, "MB", lambda: os.remove(path)
+
+BENCHMARKS = (
+    ("message_init", bench_message_init),
+    ("compact_message_init", bench_compact_message_init),
+    ("parse_datetime", bench_parse_datetime),
+    ("connection_parse", bench_connection_parse),
+    ("raw_data_received", bench_raw_data_received),
+    ("raw_data_received_split", bench_raw_data_received_split),
+    ("chunked_decode", bench_chunked_decode),
+    ("multipart_produce", bench_multipart_produce)
+)
+
+def measure(setup, repeat):
+    """ Time a benchmark several times.
+
+    Args:
+        setup (func): Returns the function to time, called before each run (so its work is not timed)
+        repeat (int): Number of runs
+
+    Returns:
+        float. Best time, in seconds
+    """
+    best = None
+    for i in range(repeat):
+        func = setup()
+        started = timeit.default_timer()
+        func()
+        elapsed = timeit.default_timer() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run(size=2000, repeat=7, names=None):
+    """ Run the micro benchmarks.
+
+    Kwargs:
+        size (int): Corpus size (number of messages)
+        repeat (int): Runs per benchmark (the best one is kept)
+        names (list): If specified, only run these benchmarks
+
+    Returns:
+        dict. Results indexed by benchmark name, each a dict with keys: seconds, items, unit, per_item_us
+    """
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        prepared = benchmark(size)
+        setup, items, unit = prepared[:3]
+        try:
+            seconds = measure(setup, repeat)
+        finally:
+            if len(prepared) > 3:
+                prepared[3]()
+        results[name] = {
+            "seconds": seconds,
+            "items": items,
+            "unit": unit,
+            "per_item_us": seconds * 1000000 / items
+        }
+    return results
+
+def load_baseline(path=BASELINE, size=None):
+    """ Load a stored baseline.
+
+    Kwargs:
+        path (str): Baseline file
+        size (int): If specified, only load the baseline if it was measured with this corpus size
+
+    Returns:
+        dict. Baseline (per_item_us indexed by benchmark name), or None if there is none
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        data = json.load(handle)
+    if size is not None and data.get("size") != size:
+        return None
+    return data["benchmarks"]
+
+def save_baseline(results, size, path=BASELINE):
+    """ Store results as the new baseline. Benchmarks that were not run keep their stored baseline.
+
+    Args:
+        results (dict): Results, as returned by :func:`run`
+        size (int): Corpus size the results were measured with
+
+    Kwargs:
+        path (str): Baseline file
+    """
+    benchmarks = load_baseline(path, size) or {}
+    for name, result in results.items():
+        benchmarks[name] = round(result["per_item_us"], 3)
+
+    data = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "size": size,
+        "benchmarks": benchmarks
+    }
+    with open(path, "w") as handle:
+        json.dump(data, handle, indent=4, sort_keys=True, separators=(",", ": "))
+        handle.write("\n")
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """ Compare results against a baseline.
+
+    Args:
+        results (dict): Results, as returned by :func:`run`
+        baseline (dict): Baseline, as returned by :func:`load_baseline`
+
+    Kwargs:
+        threshold (float): Allowed slowdown (0.25 allows benchmarks to be up to 25% slower)
+
+    Returns:
+        dict. Ratio to the baseline (above 1 means slower) indexed by benchmark name, for those
+        slower than the threshold allows
+    """
+    regressions = {}
+    for name, result in results.items():
+        if baseline and baseline.get(name):
+            ratio = result["per_item_us"] / baseline[name]
+            if ratio > 1 + threshold:
+                regressions[name] = ratio
+    return regressions
+
+def report(results, baseline=None, regressions=None, out=sys.stdout):
+    """ Print results in a human readable way.
+
+    Args:
+        results (dict): Results, as returned by :func:`run`
+
+    Kwargs:
+        baseline (dict): Baseline to compare with
+        regressions (dict): Regressions, as returned by :func:`compare`
+        out (file): Where to print
+    """
+    out.write("%-20s %12s %-10s %12s %8s\n" % ("benchmark", "us/item", "item", "baseline", "ratio"))
+    for name, benchmark in BENCHMARKS:
+        if name not in results:
+            continue
+        result = results[name]
+        reference = (baseline or {}).get(name)
+        out.write("%-20s %12.3f %-10s %12s %8s%s\n" % (
+            name,
+            result["per_item_us"],
+            result["unit"],
+            "%.3f" % reference if reference else "-",
+            "%.2f" % (result["per_item_us"] / reference) if reference else "-",
+            "  SLOWER" if name in (regressions or {}) else ""
+        ))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run pyfire micro benchmarks")
+    parser.add_argument("names", nargs="*", help="only run these benchmarks (%s)" % ", ".join([name for name, benchmark in BENCHMARKS]))
+    parser.add_argument("--size", type=int, default=2000, help="corpus size, in messages")
+    parser.add_argument("--repeat", type=int, default=7, help="runs per benchmark (the best one is kept)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = run(size=args.size, repeat=args.repeat, names=args.names)
+    if args.update_baseline:
+        save_baseline(results, args.size, args.baseline)
+        report(results)
+        return 0
+
+    baseline = load_baseline(args.baseline, args.size)
+    if not baseline:
+        sys.stdout.write("No baseline for a corpus of %d messages, run with --update-baseline to store one\n\n" % args.size)
+    regressions = compare(results, baseline, args.threshold)
+    report(results, baseline, regressions)
+    if regressions:
+        sys.stdout.write("\n%d benchmark(s) slower than the baseline by more than %d%%\n" % (len(regressions), args.threshold * 100))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+""" Cold start benchmark: how long it takes a new interpreter to import pyfire,
+and which heavy dependencies get loaded by doing so:
+
+    $ python -m benchmarks.startup
+    $ python -m benchmarks.startup --target 0.1
+
+REST only clients (e.g: cron notifier scripts) should never load twisted or
+multiprocessing, which are only needed for streaming and uploads, nor NumPy,
+which is only used by message batches. The exit status is 1 if any of them is
+loaded, or if the median import time exceeds the target.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ("twisted", "multiprocessing", "zope.interface", "OpenSSL", "numpy")
+TARGET = 0.1
+
+SCRIPT = """
+import json, sys, time
+started = time.time()
+%s
+elapsed = time.time() - started
+json.dump({"seconds": elapsed, "modules": sorted(sys.modules.keys())}, sys.stdout)
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure(statement="import pyfire", python=sys.executable):
+    """ Run a statement in a new interpreter.
+
+    Kwargs:
+        statement (str): Python code to time
+        python (str): Interpreter
+
+    Returns:
+        dict. Result, with keys: seconds (time the statement took), modules (loaded module names)
+    """
+    output = subprocess.check_output([python, "-W", "ignore", "-c", SCRIPT % statement], cwd=ROOT)
+    return json.loads(output)
+
+def heavy_modules(modules):
+    """ Filter the heavy dependencies out of a list of modules.
+
+    Args:
+        modules (list): Module names
+
+    Returns:
+        array. Heavy modules that were loaded (top level name only)
+    """
+    return [name for name in HEAVY_MODULES if name in modules]
+
+def run(statement="import pyfire", runs=10):
+    """ Time a statement in several new interpreters.
+
+    Kwargs:
+        statement (str): Python code to time
+        runs (int): Number of interpreters to start
+
+    Returns:
+        dict. Results, with keys: min, median, max (seconds) and heavy (heavy modules loaded)
+    """
+    seconds = []
+    heavy = set()
+    for i in range(runs):
+        result = measure(statement)
+        seconds.append(result["seconds"])
+        heavy.update(heavy_modules(result["modules"]))
+    seconds.sort()
+    return {
+        "min": seconds[0],
+        "median": seconds[len(seconds) // 2],
+        "max": seconds[-1],
+        "heavy": sorted(heavy)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long it takes to import pyfire")
+    parser.add_argument("--runs", type=int, default=10, help="number of interpreters to start")
+    parser.add_argument("--target", type=float, default=TARGET, help="maximum median import time, in seconds")
+    parser.add_argument("--statement", default="import pyfire", help="statement to time")
+    args = parser.parse_args(argv)
+
+    results = run(args.statement, args.runs)
+    sys.stdout.write("%s: median %.1f ms (min %.1f ms, max %.1f ms, target %.1f ms)\n" % (
+        args.statement,
+        results["median"] * 1000,
+        results["min"] * 1000,
+        results["max"] * 1000,
+        args.target * 1000
+    ))
+
+    failed = False
+    if results["heavy"]:
+        sys.stdout.write("Heavy modules loaded: %s\n" % ", ".join(results["heavy"]))
+        failed = True
+    if results["median"] > args.target:
+        sys.stdout.write("Median import time is over the target\n")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+import array
+import calendar
+import collections
+import datetime
+import itertools
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .message import BaseMessage, _parse_epoch
+
+TYPES = [
+    BaseMessage._TYPE_ENTER,
+    BaseMessage._TYPE_LEAVE,
+    BaseMessage._TYPE_KICK,
+    BaseMessage._TYPE_PASTE,
+    BaseMessage._TYPE_SOUND,
+    BaseMessage._TYPE_TEXT,
+    BaseMessage._TYPE_TIMESTAMP,
+    BaseMessage._TYPE_TOPIC_CHANGE,
+    BaseMessage._TYPE_TWEET,
+    BaseMessage._TYPE_UPLOAD
+]
+
+_CODES = dict([(name, code) for code, name in enumerate(TYPES)])
+_CODES_LOCK = threading.Lock()
+
+class MessageBatch(object):
+    """ Column based container of messages, for analysis of large amounts of messages
+    (e.g: a year of transcripts) without creating an object per message.
+
+    IDs, user IDs, room IDs, type codes and creation times (seconds since the
+    epoch) are stored in typed arrays. If NumPy is installed, filters and
+    aggregations run on NumPy views of those arrays. Slicing a batch returns a
+    batch sharing the same arrays (no data is copied.)
+    """
+
+    COLUMNS = (
+        ("id", "l"),
+        ("user_id", "l"),
+        ("room_id", "l"),
+        ("type", "H"),
+        ("created_at", "l")
+    )
+
+    def __init__(self, messages=None, bodies=False):
+        """ Initialize.
+
+        Kwargs:
+            messages (iterable): Messages to add (each message is a dict)
+            bodies (bool): If True, also keep message bodies
+        """
+        self._columns = dict([(name, array.array(typecode)) for name, typecode in self.COLUMNS])
+        self._bodies = [] if bodies else None
+        self._start = 0
+        self._stop = 0
+        if messages:
+            self.extend(messages)
+
+    @classmethod
+    def concatenate(cls, batches):
+        """ Join batches into a new one.
+
+        Args:
+            batches (iterable): Batches
+
+        Returns:
+            :class:`MessageBatch`. Batch
+        """
+        batches = list(batches)
+        result = cls(bodies=bool(batches) and all([batch.has_bodies() for batch in batches]))
+        for batch in batches:
+            for name, typecode in cls.COLUMNS:
+                result._columns[name].extend(batch._get_array(name))
+            if result._bodies is not None:
+                result._bodies.extend(batch._bodies[batch._start:batch._stop])
+        result._stop = len(result._columns["id"])
+        return result
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        """ Get a message, or a slice of the batch (sharing its data).
+
+        Args:
+            index (int or slice): Position, or slice
+
+        Returns:
+            dict (message, with keys: id, user_id, room_id, type, created_at, and body
+            if bodies are kept), or :class:`MessageBatch` if a slice was given
+
+        Raises:
+            IndexError
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("Batches can only be sliced with a step of 1")
+            return self._view(self._start + start, self._start + max(start, stop))
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("Message index out of range")
+        position = self._start + index
+        message = {
+            "id": self._columns["id"][position],
+            "user_id": self._columns["user_id"][position] or None,
+            "room_id": self._columns["room_id"][position] or None,
+            "type": TYPES[self._columns["type"][position]],
+            "created_at": datetime.datetime.utcfromtimestamp(self._columns["created_at"][position])
+        }
+        if self._bodies is not None:
+            message["body"] = self._bodies[position]
+        return message
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def has_bodies(self):
+        """ Tell if message bodies are kept.
+
+        Returns:
+            bool. Success
+        """
+        return self._bodies is not None
+
+    def append(self, message):
+        """ Add a message.
+
+        Args:
+            message (dict): Message
+
+        Raises:
+            ValueError
+        """
+        if self._stop != len(self._columns["id"]):
+            raise ValueError("Can't add messages to a slice of a batch")
+
+        columns = self._columns
+        columns["id"].append(message.get("id") or 0)
+        columns["user_id"].append(message.get("user_id") or 0)
+        columns["room_id"].append(message.get("room_id") or 0)
+        columns["type"].append(get_type_code(message.get("type")))
+        columns["created_at"].append(_parse_epoch(message.get("created_at")) or 0)
+        if self._bodies is not None:
+            self._bodies.append(message.get("body"))
+        self._stop += 1
+
+    def extend(self, messages):
+        """ Add messages.
+
+        Args:
+            messages (iterable): Messages (each message is a dict)
+        """
+        for message in messages:
+            self.append(message)
+
+    def get_column(self, name):
+        """ Get the values of a column.
+
+        Args:
+            name (str): Column (one of: id, user_id, room_id, type, created_at)
+
+        Returns:
+            numpy.ndarray if NumPy is installed, otherwise array.array (a copy, changing it
+            doesn't change the batch)
+        """
+        if numpy is not None:
+            return self._get_ndarray(name).copy()
+        column = self._columns[name]
+        return array.array(column.typecode, column[self._start:self._stop])
+
+    def get_bodies(self):
+        """ Get message bodies.
+
+        Returns:
+            list. Bodies, or None if bodies are not kept
+        """
+        if self._bodies is None:
+            return None
+        return self._bodies[self._start:self._stop]
+
+    def filter(self, types=None, user_ids=None, room_ids=None, since=None, until=None):
+        """ Get the messages matching all given conditions.
+
+        Kwargs:
+            types (list): Message types (e.g: TextMessage)
+            user_ids (list): User IDs
+            room_ids (list): Room IDs
+            since (datetime or int): Only messages created at or after this time (UTC, or seconds since the epoch)
+            until (datetime or int): Only messages created before this time (UTC, or seconds since the epoch)
+
+        Returns:
+            :class:`MessageBatch`. Batch with the matching messages
+        """
+        conditions = []
+        if types is not None:
+            conditions.append(("type", "in", set([_CODES[name] for name in types if name in _CODES])))
+        if user_ids is not None:
+            conditions.append(("user_id", "in", set(user_ids)))
+        if room_ids is not None:
+            conditions.append(("room_id", "in", set(room_ids)))
+        if since is not None:
+            conditions.append(("created_at", ">=", _to_epoch(since)))
+        if until is not None:
+            conditions.append(("created_at", "<", _to_epoch(until)))
+
+        if not conditions:
+            return self._view(self._start, self._stop)
+        if numpy is not None:
+            return self._select(self._mask_ndarray(conditions))
+        return self._select(self._mask_array(conditions))
+
+    def count_by(self, name):
+        """ Count messages by the values of a column.
+
+        Args:
+            name (str): Column (one of: id, user_id, room_id, type, created_at)
+
+        Returns:
+            dict. Number of messages indexed by value (types are given by name)
+        """
+        if numpy is not None:
+            values, counts = numpy.unique(self._get_ndarray(name), return_counts=True)
+            result = dict(zip(values.tolist(), counts.tolist()))
+        else:
+            result = dict(collections.Counter(self._get_array(name)))
+
+        if name == "type":
+            result = dict([(TYPES[code], count) for code, count in result.items()])
+        return result
+
+    def _view(self, start, stop):
+        """ Get a batch sharing this batch's data.
+
+        Args:
+            start (int): First position, in the underlying arrays
+            stop (int): Position after the last one, in the underlying arrays
+
+        Returns:
+            :class:`MessageBatch`. Batch
+        """
+        view = MessageBatch.__new__(MessageBatch)
+        view._columns = self._columns
+        view._bodies = self._bodies
+        view._start = start
+        view._stop = stop
+        return view
+
+    def _get_array(self, name):
+        column = self._columns[name]
+        if self._start == 0 and self._stop == len(column):
+            return column
+        return column[self._start:self._stop]
+
+    def _get_ndarray(self, name):
+        column = self._columns[name]
+        if not column:
+            return numpy.zeros(0, dtype=numpy.dtype(column.typecode))
+        return numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))[self._start:self._stop]
+
+    def _mask_ndarray(self, conditions):
+        mask = numpy.ones(len(self), dtype=bool)
+        for name, operation, value in conditions:
+            values = self._get_ndarray(name)
+            if operation == "in":
+                mask &= numpy.in1d(values, numpy.array(sorted(value), dtype=values.dtype))
+            elif operation == ">=":
+                mask &= values >= value
+            else:
+                mask &= values < value
+        return mask
+
+    def _mask_array(self, conditions):
+        mask = None
+        for name, operation, value in conditions:
+            values = self._get_array(name)
+            if operation == "in":
+                matches = [item in value for item in values]
+            elif operation == ">=":
+                matches = [item >= value for item in values]
+            else:
+                matches = [item < value for item in values]
+            mask = matches if mask is None else [a and b for a, b in itertools.izip(mask, matches)]
+        return mask
+
+    def _select(self, mask):
+        """ Build a batch with the messages selected by a mask.
+
+        Args:
+            mask (list or numpy.ndarray): One boolean per message
+
+        Returns:
+            :class:`MessageBatch`. Batch
+        """
+        batch = MessageBatch(bodies=self._bodies is not None)
+        for name, typecode in self.COLUMNS:
+            if numpy is not None:
+                batch._columns[name].fromstring(self._get_ndarray(name)[mask].tostring())
+            else:
+                batch._columns[name].extend(itertools.compress(self._get_array(name), mask))
+        if self._bodies is not None:
+            batch._bodies.extend(itertools.compress(self._bodies[self._start:self._stop], mask))
+        batch._stop = len(batch._columns["id"])
+        return batch
+
+def get_type_code(name):
+    """ Get the code used to store a message type in batches.
+
+    Args:
+        name (str): Message type
+
+    Returns:
+        int. Code
+    """
+    code = _CODES.get(name)
+    if code is None:
+        _CODES_LOCK.acquire()
+        try:
+            code = _CODES.get(name)
+            if code is None:
+                code = len(TYPES)
+                TYPES.append(name)
+                _CODES[name] = code
+        finally:
+            _CODES_LOCK.release()
+    return code
+
+def _to_epoch(value):
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return value
@@ -0,0 +1,216 @@
+import collections
+import re
+import threading
+import time
+
+class ResponseCache(object):
+    """ LRU cache of GET responses, with per endpoint expiration.
+
+    Responses are stored as received (not parsed), so every hit is parsed
+    again and callers are free to modify what they get. Expired responses
+    that came with an ETag or Last-Modified header are kept around to
+    revalidate them with a conditional request.
+    """
+
+    # (pattern, seconds) for each cacheable endpoint. First match wins
+    DEFAULT_TTLS = [
+        (r"^rooms$", 60),
+        (r"^room/\d+$", 30),
+        (r"^room/\d+/uploads$", 30),
+        (r"^users/", 300)
+    ]
+
+    def __init__(self, ttls=None, max_size=2 ** 20):
+        """ Initialize.
+
+        Kwargs:
+            ttls (array): List of (pattern, seconds) tuples, where pattern is a regular
+                          expression matched against the relative URL. Endpoints that don't
+                          match any pattern are not cached
+            max_size (int): Maximum size (in bytes) of all cached responses
+        """
+        self._ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls if ttls is not None else self.DEFAULT_TTLS)]
+        self._max_size = max_size
+        self._size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "evictions": 0,
+            "invalidations": 0
+        }
+
+    def get_stats(self):
+        """ Get cache statistics.
+
+        Returns:
+            dict. Statistics (hits, misses, revalidations, evictions, invalidations, entries, size)
+        """
+        self._lock.acquire()
+        try:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["size"] = self._size
+            return stats
+        finally:
+            self._lock.release()
+
+    def get_ttl(self, url):
+        """ Get the expiration for an endpoint.
+
+        Args:
+            url (str): Relative URL
+
+        Returns:
+            int. Seconds, or None if the endpoint should not be cached
+        """
+        for pattern, ttl in self._ttls:
+            if pattern.search(url or ""):
+                return ttl
+        return None
+
+    def key(self, url, parameters=None):
+        """ Build the cache key for a request.
+
+        Args:
+            url (str): Relative URL
+
+        Kwargs:
+            parameters (dict): GET parameters
+
+        Returns:
+            tuple. Key
+        """
+        return (url, tuple(sorted((parameters or {}).items())))
+
+    def get(self, key):
+        """ Get a cached response, fresh or not.
+
+        Args:
+            key (tuple): Key, as built by key()
+
+        Returns:
+            dict. Entry (with keys: body, info, etag, last_modified, expires), or None
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._entries[key] = entry
+            if self.is_fresh(entry):
+                self._stats["hits"] += 1
+            return entry
+        finally:
+            self._lock.release()
+
+    def is_fresh(self, entry):
+        """ Tell if a cached response can be used without revalidating it.
+
+        Args:
+            entry (dict): Entry
+
+        Returns:
+            bool. Success
+        """
+        return entry["expires"] > time.time()
+
+    def set(self, key, body, info=None, etag=None, last_modified=None):
+        """ Cache a response.
+
+        Args:
+            key (tuple): Key, as built by key()
+            body (str): Response body
+
+        Kwargs:
+            info: Response headers
+            etag (str): ETag header
+            last_modified (str): Last-Modified header
+        """
+        ttl = self.get_ttl(key[0])
+        if ttl is None:
+            return
+
+        entry = {
+            "body": body,
+            "info": info,
+            "etag": etag,
+            "last_modified": last_modified,
+            "expires": time.time() + ttl,
+            "size": len(body) + len(key[0])
+        }
+
+        self._lock.acquire()
+        try:
+            self._remove(key)
+            if entry["size"] > self._max_size:
+                return
+
+            self._entries[key] = entry
+            self._size += entry["size"]
+            while self._size > self._max_size:
+                self._remove(self._entries.iterkeys().next())
+                self._stats["evictions"] += 1
+        finally:
+            self._lock.release()
+
+    def revalidated(self, key):
+        """ Mark a cached response as fresh again, after the server told us it was not modified.
+
+        Args:
+            key (tuple): Key, as built by key()
+        """
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                self._entries[key]["expires"] = time.time() + (self.get_ttl(key[0]) or 0)
+                self._stats["revalidations"] += 1
+        finally:
+            self._lock.release()
+
+    def invalidate(self, url):
+        """ Remove cached responses affected by a change to the given URL.
+
+        A change to "room/1/join" invalidates every cached response under
+        "room/1", and the "rooms" collection.
+
+        Args:
+            url (str): Relative URL that was modified
+        """
+        segments = (url or "").split("/")
+        collection = segments[0] if segments[0].endswith("s") else segments[0] + "s"
+        prefixes = ["/".join(segments[:2]), collection]
+
+        self._lock.acquire()
+        try:
+            for key in self._entries.keys():
+                for prefix in prefixes:
+                    if key[0] == prefix or key[0].startswith(prefix + "/"):
+                        self._remove(key)
+                        self._stats["invalidations"] += 1
+                        break
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Remove all cached responses. """
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._size = 0
+        finally:
+            self._lock.release()
+
+    def _remove(self, key):
+        """ Remove a cached response. Should be called with the lock held.
+
+        Args:
+            key (tuple): Key
+        """
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= entry["size"]
@@ -1,8 +1,13 @@
 import operator
+import threading
 import urllib
 
 from .connection import Connection
-from .message import Message
+from .executor import BatchExecutor, TaskGroup, WorkerQueue
+from .identity import IdentityMap
+from .index import RoomIndex
+from .message import CompactMessage, Message
+from .session import SessionCache
 from .user import User
 from .room import Room
 
@@ -12,8 +17,9 @@ class RoomNotFoundException(Exception):
 class Campfire(object):
     """ Campfire API """
     
-    def __init__(self, subdomain, username, password, ssl=False, currentUser=None):
-        """ Initialize.
+    def __init__(self, subdomain, username, password, ssl=False, currentUser=None, cache=False, base_url=None, stream_url=None,
+        session=False, room_index_ttl=300, identity_map=None, compact=False, connection=None):
+        """ Initialize. No request is made until the API is first used.
 
         Args:
             subdomain (str): Campfire subdomain
@@ -23,33 +29,47 @@ class Campfire(object):
         Kwargs:
             ssl (bool): enabled status of SSL
             currentUser (:class:`User`): If specified, don't auto load current user, use this one instead
+            cache (bool or dict): If True, cache GET responses. If a dict, cache them
+                                  using these options for :class:`ResponseCache`
+            base_url (str): If specified, use this API URL instead of the subdomain's (e.g: a local test server)
+            stream_url (str): If specified, use this URL for live streams instead of Campfire's streaming server
+            session (bool or dict): If True, keep the API token and current user in an on disk cache, so
+                                    later instances don't need to authenticate. If a dict, use these options
+                                    for :class:`SessionCache`
+            room_index_ttl (int): Seconds the room names index is used before the room list is fetched again
+            identity_map (dict): Options for the :class:`IdentityMap` instances keeping rooms and users
+                                 (max_size, ttl). By default the last 1000 of each are kept, and never refreshed
+            compact (bool): If True, messages are :class:`CompactMessage` instances, which use much less
+                            memory (for applications keeping many messages around)
+            connection (dict): Options for the :class:`Connection` used by the API (e.g: retry,
+                               rate_limit, pool_size, pool_idle_timeout, compress, metrics, coalesce)
         """
-        self.base_url = "http%s://%s.campfirenow.com" % ("s" if ssl else "", subdomain)
+        self.base_url = base_url or "http%s://%s.campfirenow.com" % ("s" if ssl else "", subdomain)
         self._settings = {
             "subdomain": subdomain,
             "username": username,
             "password": password,
-            "ssl": ssl
+            "ssl": ssl,
+            "cache": cache,
+            "base_url": base_url,
+            "stream_url": stream_url,
+            "session": session,
+            "room_index_ttl": room_index_ttl,
+            "identity_map": identity_map,
+            "compact": compact,
+            "connection": connection
         }
         self._user = currentUser
-        self._users = {}
-        self._rooms = {}
-
-        if not self._user:
-            _connection = Connection(url="%s/users/me" % self.base_url, user=username, password=password)
-            user = _connection.get(key="user")
-            
-        self._connection = Connection(
-            base_url=self.base_url, 
-            user=self._user.token if self._user else user["api_auth_token"], 
-            password="x"
-        )
-
-        if self._user:
-            self._user.set_connection(self._connection)
-        else:
-            self._user = User(self, user["id"], current=True)
-            self._user.token = user["api_auth_token"]
+        self._users = IdentityMap(refresh=lambda user: user._load(), **(identity_map or {}))
+        self._rooms = IdentityMap(refresh=lambda room: room._load(), **(identity_map or {}))
+        self._room_index = RoomIndex(room_index_ttl)
+        self._connection = None
+        self._login_lock = threading.Lock()
+        self._prefetch_queue = None
+        self._prefetch_lock = threading.Lock()
+        self._session = None
+        if session:
+            self._session = SessionCache(**(session if isinstance(session, dict) else {}))
 
     def __copy__(self):
         """ Clone.
@@ -62,17 +82,59 @@ class Campfire(object):
             self._settings["username"],
             self._settings["password"],
             self._settings["ssl"],
-            self._user
+            self._user,
+            self._settings["cache"],
+            self._settings["base_url"],
+            self._settings["stream_url"],
+            self._settings["session"],
+            self._settings["room_index_ttl"],
+            self._settings["identity_map"],
+            self._settings["compact"],
+            self._settings["connection"]
         )
 
     def get_connection(self):
-        """ Get connection
+        """ Get connection. The first call authenticates, unless the current user was
+        given or a stored session is available.
 
         Returns:
             :class:`Connection`. Connection
         """
+        if not self._connection:
+            self._login()
         return self._connection
     
+    def get_deferred(self):
+        """ Get a non blocking interface to this Campfire API.
+
+        Returns:
+            :class:`DeferredCampfire`. Campfire API whose operations return deferreds
+        """
+        from .deferred import DeferredCampfire
+        return DeferredCampfire(self)
+
+    def get_stream_hub(self, error_callback=None, prefetch=False):
+        """ Get a hub to stream many rooms at once, using a single process.
+
+        Kwargs:
+            error_callback (func): Callback to call when an error occurred (parameters: exception, room)
+            prefetch (bool): If True, fetch the user, room and upload of each message in the background
+
+        Returns:
+            :class:`StreamHub`. Hub
+        """
+        # Streaming needs twisted and multiprocessing, only loaded when used
+        from .hub import StreamHub
+        return StreamHub(self, error_callback=error_callback, prefetch=prefetch)
+
+    def get_room_index(self):
+        """ Get the index of rooms by name.
+
+        Returns:
+            :class:`RoomIndex`. Index
+        """
+        return self._room_index
+
     def get_rooms(self, sort=True):
         """ Get rooms list.
 
@@ -82,13 +144,184 @@ class Campfire(object):
         Returns:
             array. List of rooms (each room is a dict)
         """
-        rooms = self._connection.get("rooms")
+        rooms = self.get_connection().get("rooms")
+        self._room_index.update(rooms or [])
         if sort:
             rooms.sort(key=operator.itemgetter("name"))
         return rooms
 
-    def get_room_by_name(self, name):
-        """ Get a room by name.
+    def map(self, func, items, concurrency=None, timeout=None):
+        """ Call a function for each item concurrently, e.g. to join every room:
+
+            campfire.map(lambda room: campfire.get_room(room["id"]).join(), campfire.get_rooms())
+
+        Args:
+            func (func): Function to call (parameters: item)
+            items (iterable): Items
+
+        Kwargs:
+            concurrency (int): Maximum number of simultaneous calls (defaults to the connection pool size)
+            timeout (float): Maximum seconds to wait for each call
+
+        Returns:
+            array. One result per item, in the same order as the items. Each result is a dict
+            with keys: success, data (what the function returned), error (exception raised, if any)
+        """
+        executor = BatchExecutor(
+            concurrency=concurrency or self.get_connection().get_setting("pool_size"),
+            timeout=timeout
+        )
+        return executor.map(func, items)
+
+    def create_message(self, data, prefetch=False):
+        """ Create a message, as a :class:`CompactMessage` if this instance was created with compact=True.
+
+        Args:
+            data (dict): Message data
+
+        Kwargs:
+            prefetch (bool): If True, fetch the user, room and upload of the message in the background
+
+        Returns:
+            :class:`Message` or :class:`CompactMessage`. Message
+        """
+        if self._settings["compact"]:
+            return CompactMessage(self, data, prefetch=prefetch)
+        return Message(self, data, prefetch=prefetch)
+
+    def prefetch(self, messages):
+        """ Fetch the users, rooms and uploads of messages in the background, so they
+        are ready when accessed. Each distinct user and room not loaded yet is fetched
+        once, on a set of threads shared by this instance (as many as the connection
+        pool size.) Accessing a message's user, room or upload before its fetch is
+        done waits for it.
+
+        Args:
+            messages (array): Messages (:class:`Message` or :class:`CompactMessage` instances)
+        """
+        if not messages:
+            return
+
+        concurrency = self.get_connection().get_setting("pool_size")
+        self._prefetch_lock.acquire()
+        try:
+            if self._prefetch_queue is None:
+                self._prefetch_queue = WorkerQueue(concurrency=concurrency)
+        finally:
+            self._prefetch_lock.release()
+
+        # Failed fetches are not raised here, they are attempted again when the message is accessed
+        queue = self._prefetch_queue
+        current_id = self._user.id if self._user else None
+        for message in messages:
+            tasks = []
+            user_id = getattr(message, "user_id", None)
+            if user_id and user_id != current_id and user_id not in self._users:
+                tasks.append(queue.submit(self.get_user, user_id, key=("user", user_id)))
+            room_id = getattr(message, "room_id", None)
+            if room_id and room_id not in self._rooms:
+                tasks.append(queue.submit(self.get_room, room_id, key=("room", room_id)))
+            if room_id and message.is_upload():
+                tasks.append(queue.submit(message._prefetch_upload))
+            message._prefetching = TaskGroup(tasks)
+
+    def build_messages(self, messages, concurrency=None):
+        """ Build messages, first fetching the users and rooms they reference that
+        are not loaded yet concurrently (once per distinct ID), instead of one at a
+        time as each message is accessed.
+
+        Args:
+            messages (array): Messages (each message is a dict)
+
+        Kwargs:
+            concurrency (int): Maximum number of simultaneous requests (defaults to the connection pool size)
+
+        Returns:
+            array. Messages (see :meth:`create_message`)
+        """
+        if not messages:
+            return messages
+
+        current = self._get_current_user()
+        pending = self._get_missing_entities(messages, current)
+        if pending:
+            # Failed fetches are not raised here, they are attempted again when the message is accessed
+            self.map(
+                lambda item: self.get_user(item[1]) if item[0] == "user" else self.get_room(item[1]),
+                pending,
+                concurrency=concurrency
+            )
+        return self._create_messages(messages, current)
+
+    def _get_missing_entities(self, messages, current):
+        """ Get the users and rooms referenced by messages that are not loaded yet.
+
+        Args:
+            messages (array): Messages (each message is a dict)
+            current (:class:`User`): Current user
+
+        Returns:
+            array. Each distinct user and room once, as a tuple (user or room, ID)
+        """
+        user_ids = set([message["user_id"] for message in messages if message.get("user_id")])
+        room_ids = set([message["room_id"] for message in messages if message.get("room_id")])
+        pending = [("user", id) for id in user_ids if id != current.id and id not in self._users]
+        pending += [("room", id) for id in room_ids if id not in self._rooms]
+        return pending
+
+    def _create_messages(self, messages, current):
+        """ Create messages, setting the users and rooms they reference that are loaded.
+
+        Args:
+            messages (array): Messages (each message is a dict)
+            current (:class:`User`): Current user
+
+        Returns:
+            array. Messages (see :meth:`create_message`)
+        """
+        built = []
+        for message in messages:
+            message = self.create_message(message)
+            user_id = getattr(message, "user_id", None)
+            if user_id:
+                user = current if user_id == current.id else self._users.get(user_id, refresh=False)
+                if user is not None:
+                    message.set_user(user)
+            room_id = getattr(message, "room_id", None)
+            if room_id:
+                room = self._rooms.get(room_id, refresh=False)
+                if room is not None:
+                    message.set_room(room)
+            built.append(message)
+        return built
+
+    def build_batch(self, messages, options=True):
+        """ Store messages in a column based batch, without building a :class:`Message` for each.
+
+        Args:
+            messages (iterable): Messages (each message is a dict)
+
+        Kwargs:
+            options (bool or dict): If a dict, options for :class:`MessageBatch`
+
+        Returns:
+            :class:`MessageBatch`. Batch
+        """
+        # NumPy, if installed, is only loaded when batches are used
+        from .batch import MessageBatch
+        return MessageBatch(messages, **(options if isinstance(options, dict) else {}))
+
+    def get_room_by_name(self, name, case_sensitive=True):
+        """ Get a room by name. Names are looked up in the room index, which is
+        only rebuilt when it is stale, or the first time a name is not found in it
+        (the room may have been created or renamed since.) Names still not found
+        are not looked for again until the index is stale or invalidated.
+
+        Args:
+            name (str): Room name
+
+        Kwargs:
+            case_sensitive (bool): If False, ignore case
 
         Returns:
             :class:`Room`. Room
@@ -96,11 +329,33 @@ class Campfire(object):
         Raises:
             RoomNotFoundException
         """
-        rooms = self.get_rooms()
-        for room in rooms or []:
-            if room["name"] == name:
-                return self.get_room(room["id"])
-        raise RoomNotFoundException("Room %s not found" % name)
+        refreshed = False
+        if self._room_index.is_stale():
+            self.get_rooms(sort=False)
+            refreshed = True
+
+        room = self._room_index.get(name, case_sensitive)
+        if not room and not refreshed and not self._room_index.is_missing(name, case_sensitive):
+            self.get_rooms(sort=False)
+            room = self._room_index.get(name, case_sensitive)
+
+        if not room:
+            self._room_index.add_missing(name, case_sensitive)
+            raise RoomNotFoundException("Room %s not found" % name)
+        return self.get_room(room["id"])
+
+    def find_rooms(self, prefix):
+        """ Find rooms whose name starts with a prefix, ignoring case.
+
+        Args:
+            prefix (str): Name prefix
+
+        Returns:
+            array. Rooms (each room is a dict), sorted by name
+        """
+        if self._room_index.is_stale():
+            self.get_rooms(sort=False)
+        return self._room_index.find(prefix)
 
     def get_room(self, id):
         """ Get room.
@@ -108,9 +363,7 @@ class Campfire(object):
         Returns:
             :class:`Room`. Room
         """
-        if id not in self._rooms:
-            self._rooms[id] = Room(self, id)
-        return self._rooms[id]
+        return self._rooms.get(id, lambda: Room(self, id))
 
     def get_user(self, id = None):
         """ Get user.
@@ -118,25 +371,121 @@ class Campfire(object):
         Returns:
             :class:`User`. User
         """
-        if not id:
-            id = self._user.id
+        current = self._get_current_user()
+        if not id or id == current.id:
+            return current
+        return self._users.get(id, lambda: User(self, id))
 
-        if id not in self._users:
-            self._users[id] = self._user if id == self._user.id else User(self, id)
+    def get_identity_map_stats(self):
+        """ Get usage statistics of the maps keeping rooms and users.
 
-        return self._users[id]
+        Returns:
+            dict. Stats for rooms and users (see :meth:`IdentityMap.get_stats`)
+        """
+        return {
+            "rooms": self._rooms.get_stats(),
+            "users": self._users.get_stats()
+        }
 
-    def search(self, terms):
+    def search(self, terms, as_batch=False):
         """ Search transcripts.
 
         Args:
             terms (str): Terms for search
 
+        Kwargs:
+            as_batch (bool or dict): If True, return a :class:`MessageBatch` instead. If a dict,
+                                     use these options for :class:`MessageBatch`
+
         Returns:
             array. Messages
         """
-        messages = self._connection.get("search/%s" % urllib.quote_plus(terms), key="messages")
-        if messages:
-            messages = [Message(self, message) for message in messages]
-        return messages
+        if as_batch:
+            return self.build_batch(
+                self.get_connection().iter_get("search/%s" % urllib.quote_plus(terms), key="messages"),
+                as_batch
+            )
+        messages = self.get_connection().get("search/%s" % urllib.quote_plus(terms), key="messages")
+        return self.build_messages(messages)
+
+    def iter_search(self, terms):
+        """ Search transcripts, decoding messages one at a time as they arrive.
+
+        Args:
+            terms (str): Terms for search
+
+        Returns:
+            generator. Messages
+        """
+        for message in self.get_connection().iter_get("search/%s" % urllib.quote_plus(terms), key="messages"):
+            yield self.create_message(message)
+
+    def _get_current_user(self):
+        """ Get the current user, authenticating if needed.
+
+        Returns:
+            :class:`User`. User
+        """
+        if not self._user or not self._connection:
+            self._login()
+        return self._user
+
+    def _login(self):
+        """ Get the API token (from the current user, the session cache, or by
+        authenticating), and create the connection that uses it. """
+        self._login_lock.acquire()
+        try:
+            if self._connection:
+                return
+
+            token = None
+            data = None
+            if self._user:
+                token = self._user.token
+            elif self._session:
+                session = self._session.get(self._get_session_key())
+                if session:
+                    token, data = session["token"], session["user"]
+
+            if not token:
+                _connection = Connection(
+                    url="%s/users/me" % self.base_url,
+                    user=self._settings["username"],
+                    password=self._settings["password"],
+                    **(self._settings["connection"] or {})
+                )
+                data = _connection.get(key="user")
+                token = data["api_auth_token"]
+                if self._session:
+                    self._session.set(self._get_session_key(), token, data)
+
+            connection = Connection(
+                base_url=self.base_url,
+                user=token,
+                password="x",
+                cache=self._settings["cache"],
+                **(self._settings["connection"] or {})
+            )
+            if self._settings["stream_url"]:
+                connection.set_setting("stream_url", self._settings["stream_url"])
+            if self._session:
+                connection.add_hook("after", self._check_session)
+            self._connection = connection
+
+            if self._user:
+                self._user.set_connection(self._connection)
+            else:
+                user = User(self, data["id"], current=True, data=data)
+                user.token = token
+                self._user = user
+        finally:
+            self._login_lock.release()
+
+    def _get_session_key(self):
+        return SessionCache.key(self.base_url, self._settings["username"])
 
+    def _check_session(self, method, url, status, elapsed, error):
+        """ Connection hook that forgets the stored session when its token is rejected,
+        so the next instance authenticates again. """
+        if status == 401:
+            self._session.delete(self._get_session_key())
@@ -0,0 +1,158 @@
+class ChunkedDecoder(object):
+    """ Incremental decoder of HTTP/1.1 chunked transfer encoded content.
+
+    Data can be fed as it is read from the network: any number of chunks (or
+    parts of a chunk) per read. Chunk data is returned as soon as it arrives,
+    without waiting for the end of its chunk.
+    """
+
+    _STATE_SIZE = 0
+    _STATE_DATA = 1
+    _STATE_DATA_END = 2
+    _STATE_TRAILER = 3
+    _STATE_DONE = 4
+
+    def __init__(self, max_line=4096):
+        """ Initialize.
+
+        Kwargs:
+            max_line (int): Maximum length of a chunk size or trailer line
+        """
+        self._max_line = max_line
+        self._state = self._STATE_SIZE
+        self._remaining = 0
+        self._line = bytearray()
+
+    def is_done(self):
+        """ Tell if the last chunk was received.
+
+        Returns:
+            bool. Success
+        """
+        return self._state == self._STATE_DONE
+
+    def feed(self, data):
+        """ Decode received data.
+
+        Args:
+            data (str or bytearray): Data as received
+
+        Returns:
+            str. Decoded content (may be empty if more data is needed). Anything after
+            the last chunk is ignored
+
+        Raises:
+            ValueError
+        """
+        view = memoryview(data)
+        decoded = bytearray()
+        position = 0
+        end = len(data)
+
+        while position < end:
+            state = self._state
+            if state == self._STATE_DATA:
+                size = min(self._remaining, end - position)
+                decoded += view[position:position + size]
+                position += size
+                self._remaining -= size
+                if not self._remaining:
+                    self._state = self._STATE_DATA_END
+                continue
+
+            if state == self._STATE_DONE:
+                break
+
+            # Chunk data is usually followed right away by its line end
+            if state == self._STATE_DATA_END and not self._line and data[position:position + 2] == "\r\n":
+                position += 2
+                self._state = self._STATE_SIZE
+                continue
+
+            # Every other state reads up to the end of a line
+            index = data.find("\n", position)
+            if index < 0:
+                self._line += view[position:]
+                if len(self._line) > self._max_line:
+                    raise ValueError("Chunk line is longer than %d bytes" % self._max_line)
+                break
+
+            if self._line:
+                self._line += view[position:index]
+                line = str(self._line).strip()
+                self._line = bytearray()
+            else:
+                line = view[position:index].tobytes().strip()
+            position = index + 1
+
+            if state == self._STATE_SIZE:
+                try:
+                    self._remaining = int(line.split(";", 1)[0], 16)
+                except ValueError:
+                    raise ValueError("Invalid chunk size %r" % line)
+                self._state = self._STATE_DATA if self._remaining else self._STATE_TRAILER
+            elif state == self._STATE_DATA_END:
+                if line:
+                    raise ValueError("Chunk data is longer than its size")
+                self._state = self._STATE_SIZE
+            elif not line:
+                self._state = self._STATE_DONE
+
+        return str(decoded)
+
+class LineBuffer(object):
+    """ Splits incoming data into lines, keeping an incomplete last line until
+    the rest of it arrives """
+
+    def __init__(self, delimiter="\r"):
+        """ Initialize.
+
+        Kwargs:
+            delimiter (str): Line delimiter
+        """
+        self._delimiter = delimiter
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """ Add data.
+
+        Args:
+            data (str): Data
+
+        Returns:
+            array. Complete lines, without surrounding whitespace (empty lines are skipped)
+        """
+        if not data:
+            return []
+
+        index = data.rfind(self._delimiter)
+        if index < 0:
+            self._buffer += data
+            return []
+
+        if self._buffer:
+            self._buffer += data[:index]
+            complete = str(self._buffer)
+            self._buffer = bytearray(data[index + 1:])
+        else:
+            complete = data[:index]
+            self._buffer += data[index + 1:]
+
+        lines = []
+        for line in complete.split(self._delimiter):
+            line = line.strip()
+            if line:
+                lines.append(line)
+        return lines
+
+    def get_pending(self):
+        """ Get the incomplete line kept so far.
+
+        Returns:
+            str. Line
+        """
+        return str(self._buffer)
+
+    def clear(self):
+        """ Forget the incomplete line. """
+        self._buffer = bytearray()
@@ -0,0 +1,115 @@
+import zlib
+
+ACCEPT_ENCODING = "gzip, deflate"
+
+class Decompressor(object):
+    """ Incremental decompressor for gzip and deflate encoded content """
+
+    def __init__(self, encoding):
+        """ Initialize.
+
+        Args:
+            encoding (str): Content encoding (gzip, x-gzip or deflate)
+
+        Raises:
+            ValueError
+        """
+        encoding = (encoding or "").strip().lower()
+        if encoding in ("gzip", "x-gzip"):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            raise ValueError("Unsupported content encoding %s" % encoding)
+        self._encoding = encoding
+        self._started = False
+
+    def decompress(self, data):
+        """ Decompress a block of data.
+
+        Args:
+            data (str): Compressed data
+
+        Returns:
+            str. Decompressed data (may be empty if more data is needed)
+
+        Raises:
+            zlib.error
+        """
+        if not self._started and data:
+            self._started = True
+            try:
+                return self._decompressor.decompress(data)
+            except zlib.error:
+                if self._encoding != "deflate":
+                    raise
+                # Some servers send raw deflate data, without the zlib header
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        """ Get any remaining decompressed data.
+
+        Returns:
+            str. Decompressed data
+        """
+        return self._decompressor.flush()
+
+class DecompressingReader(object):
+    """ File like reader that decompresses what it reads """
+
+    def __init__(self, read, encoding):
+        """ Initialize.
+
+        Args:
+            read (func): Function to read compressed data (parameters: maximum bytes to read)
+            encoding (str): Content encoding
+        """
+        self._read = read
+        self._decompressor = Decompressor(encoding)
+        self._done = False
+
+    def read(self, size=2 ** 14):
+        """ Read decompressed data.
+
+        Kwargs:
+            size (int): Maximum compressed bytes to read at a time
+
+        Returns:
+            str. Decompressed data, or an empty string when done
+        """
+        while not self._done:
+            data = self._read(size)
+            if not data:
+                self._done = True
+                return self._decompressor.flush()
+
+            try:
+                data = self._decompressor.decompress(data)
+            except zlib.error as e:
+                raise ValueError("Invalid compressed content: %s" % e)
+            if data:
+                return data
+        return ""
+
+def decompress(data, encoding):
+    """ Decompress data, if encoded.
+
+    Args:
+        data (str): Data
+        encoding (str): Content encoding (if empty or identity, data is returned untouched)
+
+    Returns:
+        str. Decompressed data
+
+    Raises:
+        ValueError
+    """
+    if not encoding or encoding.strip().lower() == "identity":
+        return data
+
+    decompressor = Decompressor(encoding)
+    try:
+        return decompressor.decompress(data) + decompressor.flush()
+    except zlib.error as e:
+        raise ValueError("Invalid %s encoded content: %s" % (encoding, e))
@@ -1,16 +1,25 @@
+import base64
 import cookielib
 import copy
 import httplib
 import json
+import socket
 import string
+import StringIO
+import threading
+import time
 import types
 import urllib
 import urllib2
+import urlparse
 
-from twisted.internet import reactor
-from twisted.protocols import basic
-from twisted.web import client
-from twisted.web import http_headers
+from . import compression
+from . import decoder
+from . import metrics
+from .cache import ResponseCache
+from .executor import BatchExecutor
+from .pool import HTTPConnectionPool, PoolTimeoutError
+from .retry import RetryPolicy, TokenBucket
 
 class ConnectionError(Exception):
     pass
@@ -48,19 +57,33 @@ class RESTRequest(urllib2.Request, object):
         """
         return self._method or urllib2.Request.get_method(self)
 
-class HTTPBasicAuthHandler(urllib2.HTTPBasicAuthHandler, object):
-    maximum_retries = 2
-    _retries = 0
-    def retry_http_basic_auth(self, host, req, realm):
-        self._retries += 1
-        if self._retries == self.maximum_retries:
-            raise urllib2.HTTPError(req.get_full_url(), 401, "basic auth failed", req.headers, None)
-        return super(HTTPBasicAuthHandler, self).retry_http_basic_auth(host, req, realm)
+class CookieResponse(object):
+    """ Adapts a :class:`httplib.HTTPResponse` to what :class:`cookielib.CookieJar` expects """
+
+    def __init__(self, response):
+        self._response = response
+
+    def info(self):
+        return self._response.msg
 
 class Connection(object):
     """ A connection to the Campfire API """
     
-    def __init__(self, url=None, base_url=None, user=None, password=None, authorizations={}, debug=False):
+    MAXIMUM_REDIRECTS = 5
+
+    # Metric names for retry counters
+    METRICS = {
+        "retries": "pyfire_request_retries_total",
+        "retry_wait": "pyfire_request_retry_wait_seconds_total",
+        "failures": "pyfire_request_failures_total",
+        "rate_limited": "pyfire_request_rate_limited_total",
+        "throttled": "pyfire_request_throttled_total",
+        "throttle_wait": "pyfire_request_throttle_wait_seconds_total"
+    }
+
+    def __init__(self, url=None, base_url=None, user=None, password=None, authorizations={}, debug=False,
+        pool_size=4, pool_idle_timeout=60, cache=False, retry=True, rate_limit=None, compress=True, metrics=None,
+        coalesce=True, stream_url="https://streaming.campfirenow.com"):
         """ Initialize.
 
         Kwargs:
@@ -70,6 +93,17 @@ class Connection(object):
             password (str): The password for basic auth
             authorizations (dict): Authorization header to send, indexed by URL
             debug (bool): wether to set debug ON or OFF
+            pool_size (int): Maximum number of persistent connections per host
+            pool_idle_timeout (int): Seconds after which an idle persistent connection is closed
+            cache (bool or dict): If True, cache GET responses. If a dict, cache them
+                                  using these options for :class:`ResponseCache`
+            retry (bool or dict): If True, retry failed idempotent requests. If a dict, retry
+                                  them using these options for :class:`RetryPolicy`
+            rate_limit (float): If specified, maximum number of requests per second
+            compress (bool): If True, ask for compressed (gzip/deflate) responses
+            metrics (:class:`MetricsSink`): If specified, record request metrics in this sink
+            coalesce (bool): If True, identical GET requests issued at the same time share a single request
+            stream_url (str): Base URL for live streams
         """
         self._settings = {
             "url": url,
@@ -77,7 +111,43 @@ class Connection(object):
             "user": user,
             "password": password,
             "authorizations": authorizations or {},
-            "debug": debug
+            "debug": debug,
+            "pool_size": pool_size,
+            "pool_idle_timeout": pool_idle_timeout,
+            "cache": cache,
+            "retry": retry,
+            "rate_limit": rate_limit,
+            "compress": compress,
+            "metrics": metrics,
+            "coalesce": coalesce,
+            "stream_url": stream_url
+        }
+        self._pool = HTTPConnectionPool(
+            max_per_host=pool_size,
+            idle_timeout=pool_idle_timeout,
+            debug=debug
+        )
+        self._cookies = cookielib.CookieJar()
+        self._agent = None
+        self._twisted_pool = None
+        self._cache = None
+        self._retry_policy = None
+        self._rate_limiter = None
+        for name in ("cache", "retry", "rate_limit"):
+            self._apply_setting(name)
+        self._metrics = metrics
+        self._hooks = {"before": [], "after": []}
+        self._stats_lock = threading.Lock()
+        self._inflight_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_deferreds = {}
+        self._stats = {
+            "retries": 0,
+            "retry_wait": 0,
+            "failures": 0,
+            "rate_limited": 0,
+            "throttled": 0,
+            "throttle_wait": 0
         }
 
     @staticmethod
@@ -96,7 +166,16 @@ class Connection(object):
             settings["user"],
             settings["password"],
             authorizations = settings["authorizations"],
-            debug = settings["debug"]
+            debug = settings["debug"],
+            pool_size = settings["pool_size"],
+            pool_idle_timeout = settings["pool_idle_timeout"],
+            cache = settings["cache"],
+            retry = settings["retry"],
+            rate_limit = settings["rate_limit"],
+            compress = settings["compress"],
+            metrics = settings["metrics"],
+            coalesce = settings["coalesce"],
+            stream_url = settings["stream_url"]
         )
 
     def get_settings(self):
@@ -119,13 +198,20 @@ class Connection(object):
         return self._settings[name]
 
     def set_setting(self, name, value):
-        """ Set a setting value.
+        """ Set a setting value. Objects built from a setting (such as the retry
+        policy, the rate limiter, the cache, or the pool) are updated.
 
         Args:
             name (str): Setting name
             value: Setting value
+
+        Raises:
+            ValueError
         """
-        self._settings["name"] = value
+        if name in ("pool_size", "pool_idle_timeout", "compress") and self._agent:
+            raise ValueError("Setting %s can't be changed once the twisted agent is created" % name)
+        self._settings[name] = value
+        self._apply_setting(name)
 
     def set_debug(self, debug):
         """ Enable/disable debug
@@ -133,7 +219,122 @@ class Connection(object):
         Args:
             bool. Debug
         """
-        self._settings["debug"] = debug
+        self.set_setting("debug", debug)
+
+    def _apply_setting(self, name):
+        """ Update what is built from a setting, after it changed.
+
+        Args:
+            name (str): Setting name
+        """
+        value = self._settings[name]
+        if name == "debug":
+            self._pool.set_debug(value)
+        elif name in ("pool_size", "pool_idle_timeout"):
+            self._pool.set_limits(self._settings["pool_size"], self._settings["pool_idle_timeout"])
+        elif name == "cache":
+            self._cache = ResponseCache(**(value if isinstance(value, dict) else {})) if value else None
+        elif name == "retry":
+            self._retry_policy = RetryPolicy(**(value if isinstance(value, dict) else {})) if value else None
+        elif name == "rate_limit":
+            self._rate_limiter = TokenBucket(value) if value else None
+        elif name == "metrics":
+            self._metrics = value
+
+    def get_pool(self):
+        """ Get the pool of persistent connections used by this connection.
+
+        Returns:
+            :class:`HTTPConnectionPool`. Pool
+        """
+        return self._pool
+
+    def get_pool_stats(self):
+        """ Get statistics of the pool of persistent connections.
+
+        Returns:
+            dict. Statistics
+        """
+        return self._pool.get_stats()
+
+    def get_cache(self):
+        """ Get the cache of GET responses.
+
+        Returns:
+            :class:`ResponseCache`. Cache, or None if caching is disabled
+        """
+        return self._cache
+
+    def get_retry_stats(self):
+        """ Get statistics of retried and throttled requests.
+
+        Returns:
+            dict. Statistics (retries, retry_wait, failures, rate_limited, throttled, throttle_wait)
+        """
+        self._stats_lock.acquire()
+        try:
+            return dict(self._stats)
+        finally:
+            self._stats_lock.release()
+
+    def get_metrics(self):
+        """ Get the sink where request metrics are recorded.
+
+        Returns:
+            :class:`MetricsSink`. Sink, or None if metrics are disabled
+        """
+        return self._metrics
+
+    def set_metrics(self, sink):
+        """ Set the sink where request metrics are recorded.
+
+        Args:
+            sink (:class:`MetricsSink`): Sink, or None to disable metrics
+        """
+        self.set_setting("metrics", sink)
+
+    def add_hook(self, when, hook):
+        """ Add a function to be called before or after every request.
+
+        Args:
+            when (str): Either "before" (parameters: method, url, headers), or
+                        "after" (parameters: method, url, status, elapsed seconds, exception)
+            hook (func): Function to call. Before hooks may modify headers
+
+        Returns:
+            :class:`Connection`. Current instance to allow chaining
+        """
+        if hook not in self._hooks[when]:
+            self._hooks[when].append(hook)
+        return self
+
+    def remove_hook(self, when, hook):
+        """ Remove a function added with add_hook.
+
+        Args:
+            when (str): Either "before" or "after"
+            hook (func): Function
+
+        Returns:
+            :class:`Connection`. Current instance to allow chaining
+        """
+        try:
+            self._hooks[when].remove(hook)
+        except ValueError:
+            pass
+        return self
+
+    def close(self):
+        """ Close all idle persistent connections.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired when idle twisted connections are closed,
+            or None if no twisted requests were made (twisted is not loaded by this)
+        """
+        self._pool.clear()
+        if self._twisted_pool:
+            return self._twisted_pool.closeCachedConnections()
+        return None
 
     def delete(self, url=None, post_data={}, parse_data=False, key=None, parameters=None):
         """ Issue a PUT request.
@@ -205,7 +406,110 @@ class Connection(object):
         Raises:
             AuthenticationError, ConnectionError, urllib2.HTTPError, ValueError, Exception
         """
-        return self._fetch("GET", url, post_data=None, parse_data=parse_data, key=key, parameters=parameters)
+        if not self._settings["coalesce"]:
+            return self._fetch("GET", url, post_data=None, parse_data=parse_data, key=key, parameters=parameters)
+
+        # Identical GETs issued at the same time (from other threads) share a single request
+        request_key = self._request_key(url, parse_data, key, parameters)
+        self._inflight_lock.acquire()
+        try:
+            call = self._inflight.get(request_key)
+            leader = call is None
+            if leader:
+                call = self._inflight[request_key] = {"event": threading.Event(), "data": None, "error": None, "waiters": 0}
+            else:
+                call["waiters"] += 1
+        finally:
+            self._inflight_lock.release()
+
+        if not leader:
+            if self._metrics:
+                self._metrics.increment("pyfire_requests_coalesced_total", {"endpoint": metrics.endpoint(url or "")})
+            call["event"].wait()
+            if call["error"]:
+                raise call["error"]
+            return copy.deepcopy(call["data"])
+
+        data = None
+        try:
+            data = self._fetch("GET", url, post_data=None, parse_data=parse_data, key=key, parameters=parameters)
+            return data
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            self._inflight_lock.acquire()
+            try:
+                del self._inflight[request_key]
+                waiters = call["waiters"]
+            finally:
+                self._inflight_lock.release()
+            # No more waiters can join once the call is removed. They copy their own data from a
+            # private copy, since the caller may change what it gets (only made if anyone waits)
+            if waiters and not call["error"]:
+                call["data"] = copy.deepcopy(data)
+            call["event"].set()
+
+    def fetch_many(self, requests, concurrency=None, timeout=None):
+        """ Issue many requests concurrently.
+
+        Args:
+            requests (array): Requests. Each request is a dict with the keys method (GET/POST/PUT/DELETE),
+                              and url, plus optionally: post_data, parse_data, key, parameters
+
+        Kwargs:
+            concurrency (int): Maximum number of simultaneous requests (defaults to the pool size)
+            timeout (float): Maximum seconds to wait for each request. It is also the socket timeout
+                             of each request, so a request that timed out keeps its pooled connection
+                             for at most that long per network operation (and retry) before giving it back
+
+        Returns:
+            array. One result per request, in the same order as the requests. Each result is a dict
+            with keys: success, data (response as returned by get/post/put/delete), error (exception raised, if any)
+        """
+        def fetch(request):
+            request = dict(request)
+            method = request.pop("method", "GET").upper()
+            request.setdefault("parse_data", method == "GET")
+            return self._fetch(method, full_return=(method != "GET"), timeout=timeout, **request)
+
+        executor = BatchExecutor(concurrency=concurrency or self._settings["pool_size"], timeout=timeout)
+        return executor.map(fetch, requests)
+
+    def iter_get(self, url=None, key=None, parameters=None):
+        """ Issue a GET request, and decode the array found under the given key as it arrives,
+        instead of reading and parsing the whole response at once.
+
+        Kwargs:
+            url (str): Destination URL
+            key (string): Key holding the array (defaults to the first segment of the URL)
+            parameters (dict): Additional GET parameters to append to the URL
+
+        Returns:
+            generator. Array elements
+
+        Raises:
+            AuthenticationError, ConnectionError, urllib2.HTTPError, ValueError
+        """
+        headers = self._get_request_headers()
+        uri = self._url(url, parameters)
+        response, release = self._request("GET", uri, headers=headers, stream=True)
+        self._authenticated(headers)
+
+        read = response.read
+        encoding = response.getheader("content-encoding")
+        if encoding and encoding.lower() != "identity":
+            read = compression.DecompressingReader(response.read, encoding).read
+
+        done = False
+        try:
+            for value in decoder.iter_array(read, key or string.split(url, "/")[0]):
+                yield value
+            done = response.read() == ""
+        except (httplib.HTTPException, socket.error) as e:
+            raise ConnectionError("Error while fetching from %s: %s" % (uri, e))
+        finally:
+            release(done)
 
     def get_headers(self):
         """ Get headers.
@@ -269,8 +573,40 @@ class Connection(object):
         Returns:
             reactor. Reactor
         """
+        # Twisted is only loaded when needed, so REST only clients start fast
+        from twisted.internet import reactor
         return reactor
 
+    def get_twisted_agent(self):
+        """ Get the twisted agent shared by all twisted requests issued by this connection.
+
+        The agent keeps persistent connections (up to pool_size per host, closed after
+        being idle for pool_idle_timeout seconds), and builds TLS options only once per host.
+        They are reused by the twisted requests of this connection in the current process
+        (such as the Deferred API.) Uploads and streams run in their own processes, with
+        their own connection and reactor, so they don't share them.
+
+        Returns:
+            :class:`twisted.web.client.Agent`. Agent
+        """
+        from twisted.web import client
+        from .twistedx import policy
+
+        if not self._agent:
+            reactor = self.get_twisted_reactor()
+            try:
+                self._twisted_pool = client.HTTPConnectionPool(reactor, persistent=True)
+                self._twisted_pool.maxPersistentPerHost = self._settings["pool_size"]
+                self._twisted_pool.cachedConnectionTimeout = self._settings["pool_idle_timeout"]
+                self._agent = client.Agent(reactor, policy.CachingPolicyForHTTPS(), pool=self._twisted_pool)
+            except AttributeError:
+                # Twisted < 14.0 has no connection pools or TLS policies
+                self._agent = client.Agent(reactor)
+
+            if self._settings["compress"]:
+                self._agent = client.ContentDecoderAgent(self._agent, [("gzip", client.GzipDecoder)])
+        return self._agent
+
     def build_twisted_request(self, method, url, extra_headers={}, body_producer=None, full_url=False):
         """ Build a request for twisted
 
@@ -286,22 +622,110 @@ class Connection(object):
         Returns:
             tuple. Tuple with two elements: reactor, and request
         """
+        from twisted.python import failure
+        from twisted.web import http_headers
+
         uri = url if full_url else self._url(url)
 
         raw_headers = self.get_headers()
         if extra_headers:
             raw_headers.update(extra_headers)
 
+        started = self._request_started(method, uri, raw_headers)
+
         headers = http_headers.Headers()
         for header in raw_headers:
             headers.addRawHeader(header, raw_headers[header])
 
-        agent = client.Agent(reactor)
-        request = agent.request(method, uri, headers, body_producer)
+        sent = 0
+        if body_producer and isinstance(body_producer.length, (int, long)):
+            sent = body_producer.length
+
+        def finished(result):
+            if isinstance(result, failure.Failure):
+                self._request_finished(method, uri, started, error=result.value, sent=sent)
+            else:
+                received = result.length if isinstance(result.length, (int, long)) else 0
+                self._request_finished(method, uri, started, status=result.code, sent=sent, received=received)
+            return result
+
+        request = self.get_twisted_agent().request(method, uri, headers, body_producer)
+        request.addBoth(finished)
+
+        return (self.get_twisted_reactor(), request)
+
+    def deferred_delete(self, url=None, post_data={}, parse_data=False, key=None, parameters=None):
+        """ Issue a DELETE request without blocking. See :meth:`delete`
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the response (a dict with keys: success, data, info, body)
+        """
+        return self._fetch_deferred("DELETE", url, post_data=post_data, parse_data=parse_data, key=key, parameters=parameters, full_return=True)
+
+    def deferred_put(self, url=None, post_data={}, parse_data=False, key=None, parameters=None):
+        """ Issue a PUT request without blocking. See :meth:`put`
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the response (a dict with keys: success, data, info, body)
+        """
+        return self._fetch_deferred("PUT", url, post_data=post_data, parse_data=parse_data, key=key, parameters=parameters, full_return=True)
 
-        return (reactor, request)
-            
-    def _fetch(self, method, url=None, post_data=None, parse_data=True, key=None, parameters=None, listener=None, full_return=False):
+    def deferred_post(self, url=None, post_data={}, parse_data=False, key=None, parameters=None):
+        """ Issue a POST request without blocking. See :meth:`post`
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the response (a dict with keys: success, data, info, body)
+        """
+        return self._fetch_deferred("POST", url, post_data=post_data, parse_data=parse_data, key=key, parameters=parameters, full_return=True)
+
+    def deferred_get(self, url=None, parse_data=True, key=None, parameters=None):
+        """ Issue a GET request without blocking. See :meth:`get`
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the parsed data
+        """
+        from twisted.internet import defer
+        from twisted.python import failure
+
+        # Errors raised before the request is issued (e.g: by a before hook) fail the deferred
+        if not self._settings["coalesce"]:
+            return defer.maybeDeferred(self._fetch_deferred, "GET", url, post_data=None, parse_data=parse_data, key=key, parameters=parameters)
+
+        request_key = self._request_key(url, parse_data, key, parameters)
+        if request_key in self._inflight_deferreds:
+            if self._metrics:
+                self._metrics.increment("pyfire_requests_coalesced_total", {"endpoint": metrics.endpoint(url or "")})
+            waiting = defer.Deferred()
+            self._inflight_deferreds[request_key].append(waiting)
+            return waiting
+
+        def done(result):
+            for waiting in self._inflight_deferreds.pop(request_key):
+                if isinstance(result, failure.Failure):
+                    waiting.errback(result)
+                else:
+                    waiting.callback(copy.deepcopy(result))
+            return result
+
+        self._inflight_deferreds[request_key] = []
+        request = defer.maybeDeferred(self._fetch_deferred, "GET", url, post_data=None, parse_data=parse_data, key=key, parameters=parameters)
+        return request.addBoth(done)
+
+    def _request_key(self, url, parse_data, key, parameters):
+        """ Build the key identifying identical GET requests.
+
+        Args:
+            url (str): Destination URL
+            parse_data (bool): If true, parse response data
+            key (string): Key to look for when parsing data
+            parameters (dict): Additional GET parameters
+
+        Returns:
+            tuple. Key
+        """
+        return (url, parse_data, key, tuple(sorted((parameters or {}).items())))
+
+    def _fetch(self, method, url=None, post_data=None, parse_data=True, key=None, parameters=None, listener=None, full_return=False, timeout=None):
         """ Issue a request.
 
         Args:
@@ -315,6 +739,7 @@ class Connection(object):
             parameters (dict): Additional GET parameters to append to the URL
             listener (func): callback called when uploading a file
             full_return (bool): If set to True, get a full response (with success, data, info, body)
+            timeout (float): Socket timeout in seconds
 
         Returns:
             dict. Response. If full_return==True, a dict with keys: success, data, info, body, otherwise the parsed data
@@ -322,57 +747,177 @@ class Connection(object):
         Raises:
             AuthenticationError, ConnectionError, urllib2.HTTPError, ValueError
         """
+        headers = self._get_request_headers()
 
-        headers = self.get_headers()
-        headers["Content-Type"] = "application/json"
+        if post_data is not None:
+            post_data = json.dumps(post_data)
 
-        handlers = []
-        debuglevel = int(self._settings["debug"])
-    
-        handlers.append(urllib2.HTTPHandler(debuglevel=debuglevel))
-        if hasattr(httplib, "HTTPS"):
-            handlers.append(urllib2.HTTPSHandler(debuglevel=debuglevel))
+        cache_key = None
+        entry = None
+        if self._cache and method == "GET" and self._cache.get_ttl(url) is not None:
+            cache_key = self._cache.key(url, parameters)
+            entry = self._cache.get(cache_key)
+            if entry and self._cache.is_fresh(entry):
+                return self._result(url, 200, entry["info"], entry["body"], parse_data=parse_data, key=key, full_return=full_return)
+            elif entry:
+                if entry["etag"]:
+                    headers["If-None-Match"] = entry["etag"]
+                if entry["last_modified"]:
+                    headers["If-Modified-Since"] = entry["last_modified"]
+
+        uri = self._url(url, parameters)
+        try:
+            response, body = self._request(method, uri, post_data, headers, timeout=timeout)
+        finally:
+            if self._cache and method != "GET" and url:
+                self._cache.invalidate(url)
+        self._authenticated(headers)
+
+        status, info = response.status, response.msg
+        if entry and status == 304:
+            self._cache.revalidated(cache_key)
+            status, info, body = 200, entry["info"], entry["body"]
+        elif cache_key:
+            self._cache.set(cache_key, body, info, etag=response.getheader("etag"), last_modified=response.getheader("last-modified"))
 
-        handlers.append(urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+        return self._result(url, status, info, body, parse_data=parse_data, key=key, full_return=full_return)
+
+    def _fetch_deferred(self, method, url=None, post_data=None, parse_data=True, key=None, parameters=None, full_return=False):
+        """ Issue a request through twisted, without blocking. See :meth:`_fetch`
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the response. If full_return==True,
+            a dict with keys: success, data, info, body, otherwise the parsed data
+        """
+        from twisted.internet import defer
+        from twisted.internet import task
+        from twisted.web import client
+        from .twistedx import receiver
+
+        headers = self._get_request_headers()
+        uri = self._url(url, parameters)
+
+        def throttle(attempt, waited=0):
+            # Waits for a token of the rate limiter without blocking the reactor
+            delay = self._rate_limiter.try_acquire() if self._rate_limiter else 0
+            if delay:
+                return task.deferLater(self.get_twisted_reactor(), delay, throttle, attempt, waited + delay)
+            self._throttled(waited)
+            return issue(attempt)
+
+        def issue(attempt):
+            body_producer = None
+            if post_data is not None:
+                body_producer = client.FileBodyProducer(StringIO.StringIO(json.dumps(post_data)))
+
+            reactor, request = self.build_twisted_request(method, uri, extra_headers=headers, body_producer=body_producer, full_url=True)
+            request.addCallback(received)
+            request.addCallback(check)
+            request.addErrback(retry, attempt)
+            return request
+
+        def received(response):
+            finished = defer.Deferred()
+            response.deliverBody(receiver.StringReceiver(finished))
+            finished.addCallback(lambda body: (response, body))
+            return finished
+
+        def check(result):
+            response, body = result
+            self._check_status(uri, response.code, response.phrase, response.headers, body)
+            return result
+
+        def retry(failure, attempt):
+            if not self._retry_policy or failure.check(AuthenticationError, ConnectionError, ValueError):
+                return failure
+
+            status = failure.value.code if failure.check(urllib2.HTTPError) else None
+            if not self._retry_policy.should_retry(method, attempt, status):
+                if attempt:
+                    self._count("failures")
+                return failure
+
+            retry_after = self._get_retry_after(failure.value.hdrs) if status else None
+            delay = self._get_retry_delay(attempt, status, retry_after)
+            return task.deferLater(self.get_twisted_reactor(), delay, throttle, attempt + 1)
+
+        def done(result):
+            response, body = result
+            self._authenticated(headers)
+            return self._result(url, response.code, response.headers, body, parse_data=parse_data, key=key, full_return=full_return)
+
+        def failed(failure):
+            if failure.check(AuthenticationError, ConnectionError, urllib2.HTTPError, ValueError):
+                return failure
+            raise ConnectionError("Error while fetching from %s: %s" % (uri, failure.getErrorMessage()))
+
+        request = throttle(0)
+        if self._cache and method != "GET" and url:
+            request.addBoth(self._invalidate, url)
+        request.addCallback(done)
+        request.addErrback(failed)
+        return request
+
+    def _invalidate(self, result, url):
+        """ Invalidate cached responses affected by a modifying request.
+
+        Args:
+            result: Result of the request, passed through
+            url (str): Relative URL that was modified
+
+        Returns:
+            Result of the request
+        """
+        self._cache.invalidate(url)
+        return result
+
+    def _get_request_headers(self):
+        """ Get headers for a REST request, including authorization.
+
+        Returns:
+            dict. Headers
+        """
+        headers = self.get_headers()
+        headers["Content-Type"] = "application/json"
 
         password_url = self._get_password_url()
         if password_url and "Authorization" not in headers:
-            pwd_manager = urllib2.HTTPPasswordMgrWithDefaultRealm()
-            pwd_manager.add_password(None, password_url, self._settings["user"], self._settings["password"])
-            handlers.append(HTTPBasicAuthHandler(pwd_manager))
+            headers["Authorization"] = "Basic %s" % base64.b64encode("%s:%s" % (
+                self._settings["user"],
+                self._settings["password"]
+            ))
+        return headers
 
-        opener = urllib2.build_opener(*handlers)
+    def _authenticated(self, headers):
+        """ Remember the authorization header after a successful request.
 
-        if post_data is not None:
-            post_data = json.dumps(post_data)
+        Args:
+            headers (dict): Headers used for the request
+        """
+        password_url = self._get_password_url()
+        if password_url and password_url not in self._settings["authorizations"]:
+            self._settings["authorizations"][password_url] = headers["Authorization"]
 
-        uri = self._url(url, parameters)
-        request = RESTRequest(uri, method=method, headers=headers)
-        if post_data is not None:
-            request.add_data(post_data)
+    def _result(self, url, status, info, body, parse_data=True, key=None, full_return=False):
+        """ Build the result of a request.
 
-        response = None
+        Args:
+            url (str): Destination URL, as given to the request
+            status (int): Response status code
+            info: Response headers
+            body (str): Response body
 
-        try:
-            response = opener.open(request)
-            body = response.read()
-            if password_url and password_url not in self._settings["authorizations"] and request.has_header("Authorization"):
-                self._settings["authorizations"][password_url] = request.get_header("Authorization")
-        except urllib2.HTTPError as e:
-            if e.code == 401:
-                raise AuthenticationError("Access denied while trying to access %s" % uri)
-            elif e.code == 404:
-                raise ConnectionError("URL not found: %s" % uri)
-            else:
-                raise
-        except urllib2.URLError as e:
-            raise ConnectionError("Error while fetching from %s: %s" % (uri, e))
-        finally:
-            if response:
-                response.close()
+        Kwargs:
+            parse_data (bool): If true, parse response data
+            key (string): If parse_data==True, look for this key when parsing data
+            full_return (bool): If set to True, get a full response (with success, data, info, body)
 
-            opener.close()
+        Returns:
+            dict. Response. If full_return==True, a dict with keys: success, data, info, body, otherwise the parsed data
 
+        Raises:
+            ValueError
+        """
         data = None
         if parse_data:
             if not key:
@@ -381,9 +926,6 @@ class Connection(object):
             data = self.parse(body, key)
 
         if full_return:
-            info = response.info() if response else None
-            status = int(string.split(info["status"])[0]) if (info and "status" in info) else None
-
             return {
                 "success": (status >= 200 and status < 300), 
                 "data": data, 
@@ -393,6 +935,271 @@ class Connection(object):
 
         return data
 
+    def _check_status(self, uri, status, reason, info, body):
+        """ Raise the appropiate error if the response status is not successful.
+
+        Args:
+            uri (str): Full destination URL
+            status (int): Response status code
+            reason (str): Response status message
+            info: Response headers
+            body (str): Response body
+
+        Raises:
+            AuthenticationError, ConnectionError, urllib2.HTTPError
+        """
+        if status == 401:
+            raise AuthenticationError("Access denied while trying to access %s" % uri)
+        elif status == 404:
+            raise ConnectionError("URL not found: %s" % uri)
+        elif status < 200 or status >= 300:
+            raise urllib2.HTTPError(uri, status, reason, info, StringIO.StringIO(body))
+
+    def _request(self, method, uri, post_data=None, headers={}, timeout=None, stream=False):
+        """ Issue a request through the pool of persistent connections,
+        following redirects and keeping cookies between requests.
+
+        Args:
+            method (str): Request method (GET/POST/PUT/DELETE/etc.)
+            uri (str): Full destination URL
+
+        Kwargs:
+            post_data (str): A string of what to POST
+            headers (dict): Request headers
+            timeout (float): Socket timeout in seconds
+            stream (bool): If True, don't read the body of a successful response
+
+        Returns:
+            tuple. Tuple with two elements: response (:class:`httplib.HTTPResponse`), and body.
+            If stream==True, the second element is instead the function to call to release the
+            connection once the body was read (see :meth:`HTTPConnectionPool.urlopen`)
+
+        Raises:
+            AuthenticationError, ConnectionError, urllib2.HTTPError
+        """
+        started = self._request_started(method, uri, headers)
+        status = None
+        error = None
+        received = 0
+        try:
+            response, body, received = self._send(method, uri, post_data, headers, timeout=timeout, stream=stream)
+            status = response.status
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._request_finished(method, uri, started, status=status, error=error, sent=len(post_data or ""), received=received)
+
+        conditional = "If-None-Match" in headers or "If-Modified-Since" in headers
+        if response.status != 304 or not conditional:
+            self._check_status(uri, response.status, response.reason, response.msg, body)
+
+        return (response, body)
+
+    def _send(self, method, uri, post_data=None, headers={}, timeout=None, stream=False):
+        """ Send a request, retrying it and following redirects as needed. See :meth:`_request`
+
+        Returns:
+            tuple. Tuple with three elements: response (:class:`httplib.HTTPResponse`), body (or release
+            function if stream==True), and number of bytes received
+
+        Raises:
+            ConnectionError
+        """
+        redirects = 0
+        attempt = 0
+        while True:
+            request = RESTRequest(uri, method=method, headers=headers)
+            if post_data is not None:
+                request.add_data(post_data)
+            if self._settings["compress"]:
+                request.add_header("Accept-encoding", compression.ACCEPT_ENCODING)
+            self._cookies.add_cookie_header(request)
+
+            if self._rate_limiter:
+                self._throttled(self._rate_limiter.acquire())
+
+            try:
+                response, release = self._pool.urlopen(
+                    method,
+                    uri,
+                    body=post_data,
+                    headers=dict(request.header_items()),
+                    timeout=timeout
+                )
+                body = release
+                received = 0
+                if not stream or response.status < 200 or response.status >= 300:
+                    try:
+                        body = response.read()
+                    except:
+                        release(False)
+                        raise
+                    release()
+                    received = len(body)
+                    body = compression.decompress(body, response.getheader("content-encoding"))
+            except (httplib.HTTPException, socket.error, PoolTimeoutError) as e:
+                if self._retry_policy and self._retry_policy.should_retry(method, attempt):
+                    self._wait_for_retry(attempt)
+                    attempt += 1
+                    continue
+                if attempt:
+                    self._count("failures")
+                raise ConnectionError("Error while fetching from %s: %s" % (uri, e))
+
+            self._cookies.extract_cookies(CookieResponse(response), request)
+
+            if self._retry_policy and response.status in self._retry_policy.statuses:
+                if self._retry_policy.should_retry(method, attempt, response.status):
+                    self._wait_for_retry(attempt, response.status, self._get_retry_after(response.msg))
+                    attempt += 1
+                    continue
+                if attempt:
+                    self._count("failures")
+
+            if response.status in (301, 302, 303, 307) and redirects < self.MAXIMUM_REDIRECTS:
+                location = response.getheader("location")
+                if location:
+                    redirects += 1
+                    uri = urlparse.urljoin(uri, location)
+                    if response.status == 303:
+                        method = "GET"
+                        post_data = None
+                    continue
+
+            break
+
+        return (response, body, received)
+
+    def _request_started(self, method, uri, headers):
+        """ Called before a request is issued, to run hooks and record metrics.
+
+        Args:
+            method (str): Request method
+            uri (str): Full destination URL
+            headers (dict): Request headers (hooks may modify them)
+
+        Returns:
+            float. Time when the request started
+        """
+        for hook in self._hooks["before"]:
+            hook(method, uri, headers)
+
+        if self._metrics:
+            self._metrics.add("pyfire_requests_in_flight", 1, {"endpoint": metrics.endpoint(uri)})
+        return time.time()
+
+    def _request_finished(self, method, uri, started, status=None, error=None, sent=0, received=0):
+        """ Called after a request finished (or failed), to run hooks and record metrics.
+
+        Args:
+            method (str): Request method
+            uri (str): Full destination URL
+            started (float): Time when the request started
+
+        Kwargs:
+            status (int): Response status code, if a response was received
+            error (Exception): Error, if the request failed
+            sent (int): Bytes sent
+            received (int): Bytes received
+        """
+        elapsed = time.time() - started
+
+        if self._metrics:
+            labels = {"method": method, "endpoint": metrics.endpoint(uri)}
+            self._metrics.add("pyfire_requests_in_flight", -1, {"endpoint": labels["endpoint"]})
+            self._metrics.observe("pyfire_request_duration_seconds", elapsed, labels)
+            self._metrics.increment("pyfire_requests_total", dict(labels, status=status or "error"))
+            if sent:
+                self._metrics.increment("pyfire_request_bytes_sent_total", labels, sent)
+            if received:
+                self._metrics.increment("pyfire_response_bytes_received_total", labels, received)
+
+        for hook in self._hooks["after"]:
+            hook(method, uri, status, elapsed, error)
+
+    def _wait_for_retry(self, attempt, status=None, retry_after=None):
+        """ Wait before retrying a request.
+
+        Args:
+            attempt (int): Number of retries already made
+
+        Kwargs:
+            status (int): Response status code of the failed request, if any
+            retry_after (str): Value of the Retry-After header, if any
+        """
+        delay = self._get_retry_delay(attempt, status, retry_after)
+        if delay:
+            time.sleep(delay)
+
+    def _get_retry_delay(self, attempt, status=None, retry_after=None):
+        """ Get how long to wait before retrying a request, counting the retry. When the
+        server rate limited us, the rate limiter is blocked instead (so every request waits.)
+
+        Args:
+            attempt (int): Number of retries already made
+
+        Kwargs:
+            status (int): Response status code of the failed request, if any
+            retry_after (str): Value of the Retry-After header, if any
+
+        Returns:
+            float. Seconds to wait
+        """
+        delay = self._retry_policy.get_delay(attempt, retry_after)
+        if status == 429:
+            self._count("rate_limited")
+            if self._rate_limiter:
+                self._rate_limiter.block(delay)
+                delay = 0
+
+        self._count("retries")
+        self._count("retry_wait", delay)
+        return delay
+
+    def _throttled(self, waited):
+        """ Count the time a request waited for the rate limiter.
+
+        Args:
+            waited (float): Seconds waited
+        """
+        if waited:
+            self._count("throttled")
+            self._count("throttle_wait", waited)
+
+    def _get_retry_after(self, info):
+        """ Get the Retry-After header of a response.
+
+        Args:
+            info: Response headers (from httplib or twisted)
+
+        Returns:
+            str. Header value, or None
+        """
+        if info is None:
+            return None
+        if hasattr(info, "getRawHeaders"):
+            return (info.getRawHeaders("retry-after") or [None])[0]
+        return info.getheader("retry-after")
+
+    def _count(self, name, value=1):
+        """ Increase a retry counter.
+
+        Args:
+            name (str): Counter name
+
+        Kwargs:
+            value (int): Increment
+        """
+        self._stats_lock.acquire()
+        try:
+            self._stats[name] += value
+        finally:
+            self._stats_lock.release()
+
+        if self._metrics:
+            self._metrics.increment(self.METRICS[name], value=value)
+
     def _url(self, url=None, parameters=None):
         """ Build destination URL.
 
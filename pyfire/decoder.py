@@ -0,0 +1,64 @@
+import json
+import re
+
+WHITESPACE = " \t\r\n"
+
+def iter_array(read, key, chunk_size=2 ** 14):
+    """ Incrementally decode the array found under a key of a JSON object, such as
+    the messages of {"messages": [{...}, {...}]}, yielding one element at a time
+    as data arrives, so the whole document is never held in memory.
+
+    Args:
+        read (func): Function to read data (parameters: maximum bytes to read.) Returns an empty string when done
+        key (str): Key holding the array
+
+    Kwargs:
+        chunk_size (int): Bytes to read at a time
+
+    Returns:
+        generator. Array elements
+
+    Raises:
+        ValueError
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"%s"\s*:\s*(\[|null)' % re.escape(key))
+
+    buffer = ""
+    eof = False
+
+    while True:
+        matches = start.search(buffer)
+        if matches:
+            if matches.group(1) == "null":
+                return
+            position = matches.end()
+            break
+        if eof:
+            raise ValueError("Invalid response (key %s not found)" % key)
+        data = read(chunk_size)
+        eof = not data
+        buffer += data
+
+    while True:
+        while position < len(buffer) and (buffer[position] in WHITESPACE or buffer[position] == ","):
+            position += 1
+
+        if position < len(buffer):
+            if buffer[position] == "]":
+                return
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+                yield value
+                continue
+            except ValueError:
+                if eof:
+                    raise
+
+        if eof:
+            raise ValueError("Invalid response (unterminated array %s)" % key)
+
+        data = read(chunk_size)
+        eof = not data
+        buffer = buffer[position:] + data
+        position = 0
@@ -0,0 +1,409 @@
+import operator
+import urllib
+
+from twisted.internet import defer
+
+from .message import BaseMessage, Message
+from .room import Room
+from .user import User
+
+class DeferredCampfire(object):
+    """ Non blocking interface to the Campfire API.
+
+    Every operation returns a :class:`twisted.internet.defer.Deferred`, and
+    requests are issued through the twisted agent of the campfire connection,
+    so the reactor must be running for them to complete. Only creating an
+    instance may block, to authenticate if the campfire instance didn't yet.
+    """
+
+    def __init__(self, campfire):
+        """ Initialize.
+
+        Args:
+            campfire (:class:`Campfire`): Campfire instance
+        """
+        self._campfire = campfire
+        self._connection = campfire.get_connection()
+
+    def get_campfire(self):
+        """ Get campfire instance.
+
+        Returns:
+            :class:`Campfire`. Campfire instance
+        """
+        return self._campfire
+
+    def get_rooms(self, sort=True):
+        """ Get rooms list.
+
+        Kwargs:
+            sort (bool): If True, sort rooms by name
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the list of rooms (each room is a dict)
+        """
+        def received(rooms):
+            self._campfire.get_room_index().update(rooms or [])
+            if sort:
+                rooms.sort(key=operator.itemgetter("name"))
+            return rooms
+
+        return self._connection.deferred_get("rooms").addCallback(received)
+
+    def get_room_by_name(self, name, case_sensitive=True):
+        """ Get a room by name. See :meth:`Campfire.get_room_by_name`
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the :class:`DeferredRoom`,
+            or failed with RoomNotFoundException
+        """
+        from .campfire import RoomNotFoundException
+
+        index = self._campfire.get_room_index()
+        if not index.is_stale():
+            room = index.get(name, case_sensitive)
+            if room:
+                return self.get_room(room["id"])
+            if index.is_missing(name, case_sensitive):
+                return defer.fail(RoomNotFoundException("Room %s not found" % name))
+
+        def received(rooms):
+            room = index.get(name, case_sensitive)
+            if not room:
+                index.add_missing(name, case_sensitive)
+                raise RoomNotFoundException("Room %s not found" % name)
+            return self.get_room(room["id"])
+
+        return self.get_rooms(sort=False).addCallback(received)
+
+    def find_rooms(self, prefix):
+        """ Find rooms whose name starts with a prefix, ignoring case. See :meth:`Campfire.find_rooms`
+
+        Args:
+            prefix (str): Name prefix
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the list of rooms (each room is a dict), sorted by name
+        """
+        index = self._campfire.get_room_index()
+        if not index.is_stale():
+            return defer.succeed(index.find(prefix))
+        return self.get_rooms(sort=False).addCallback(lambda rooms: index.find(prefix))
+
+    def get_room(self, id):
+        """ Get room.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the :class:`DeferredRoom`
+        """
+        room = self._campfire._rooms.get(id, refresh=False)
+        if room is not None:
+            return defer.succeed(DeferredRoom(room))
+
+        def received(data):
+            return DeferredRoom(self._campfire._rooms.setdefault(id, Room(self._campfire, id, data=data)))
+
+        return self._connection.deferred_get("room/%s" % id).addCallback(received)
+
+    def get_user(self, id=None):
+        """ Get user.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the :class:`User`
+        """
+        # The current user is loaded when authenticating, which this instance made sure of
+        current = self._campfire._user
+        if not id or id == current.id:
+            return defer.succeed(current)
+
+        user = self._campfire._users.get(id, refresh=False)
+        if user is not None:
+            return defer.succeed(user)
+
+        def received(data):
+            return self._campfire._users.setdefault(id, User(self._campfire, id, data=data))
+
+        return self._connection.deferred_get("users/%s" % id, key="user").addCallback(received)
+
+    def search(self, terms):
+        """ Search transcripts.
+
+        Args:
+            terms (str): Terms for search
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the list of messages
+        """
+        request = self._connection.deferred_get("search/%s" % urllib.quote_plus(terms), key="messages")
+        return request.addCallback(self.build_messages)
+
+    def highlight(self, message):
+        """ Highlight a message.
+
+        Args:
+            message (:class:`Message` or int): Message, or message ID
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        id = message.id if isinstance(message, BaseMessage) else message
+        return self._connection.deferred_post("messages/%s/star" % id).addCallback(operator.itemgetter("success"))
+
+    def remove_highlight(self, message):
+        """ Remove the highlight of a message.
+
+        Args:
+            message (:class:`Message` or int): Message, or message ID
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        id = message.id if isinstance(message, BaseMessage) else message
+        return self._connection.deferred_delete("messages/%s/star" % id).addCallback(operator.itemgetter("success"))
+
+    def build_messages(self, messages):
+        """ Build messages, making sure the users and rooms they reference are loaded
+        without blocking before creating them.
+
+        Args:
+            messages (array): Messages (each message is a dict)
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the list of :class:`Message`
+        """
+        if not messages:
+            return defer.succeed(messages)
+
+        def build(current):
+            requests = []
+            for kind, id in self._campfire._get_missing_entities(messages, current):
+                requests.append(self.get_user(id) if kind == "user" else self.get_room(id))
+
+            request = defer.gatherResults(requests, consumeErrors=True)
+            request.addCallback(lambda result: self._campfire._create_messages(messages, current))
+            request.addErrback(lambda failure: failure.value.subFailure)
+            return request
+
+        return self.get_user().addCallback(build)
+
+class DeferredRoom(object):
+    """ Non blocking interface to a Campfire room """
+
+    def __init__(self, room):
+        """ Initialize.
+
+        Args:
+            room (:class:`Room`): Room
+        """
+        self._room = room
+        self._campfire = DeferredCampfire(room.get_campfire())
+        self._connection = room.get_connection()
+
+    def __getattr__(self, name):
+        """ Give access to the room data.
+
+        Args:
+            name (str): Property name to look for
+
+        Returns:
+            Value
+
+        Raises:
+            AttributeError
+        """
+        return getattr(self._room, name)
+
+    def get_room(self):
+        """ Get the room.
+
+        Returns:
+            :class:`Room`. Room
+        """
+        return self._room
+
+    def get_uploads(self):
+        """ Get list of recent uploads.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the list of uploads
+        """
+        return self._connection.deferred_get("room/%s/uploads" % self._room.id, key="uploads")
+
+    def get_users(self, sort=True):
+        """ Get list of users in the room.
+
+        Kwargs:
+            sort (bool): If True, sort rooms by name
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the list of users
+        """
+        def received(result):
+            users = self._room.users
+            if sort:
+                users.sort(key=operator.itemgetter("name"))
+            return users
+
+        return self._load().addCallback(received)
+
+    def join(self):
+        """ Join room.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        return self._post("room/%s/join" % self._room.id)
+
+    def leave(self):
+        """ Leave room.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        return self._post("room/%s/leave" % self._room.id)
+
+    def lock(self):
+        """ Lock room.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        return self._post("room/%s/lock" % self._room.id)
+
+    def unlock(self):
+        """ Unlock room.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        return self._post("room/%s/unlock" % self._room.id)
+
+    def recent(self, message_id=None, limit=None):
+        """ Recent messages.
+
+        Kwargs:
+            message_id (int): If specified, return messages since the specified message ID
+            limit (int): If specified, limit the number of messages
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the list of messages
+        """
+        parameters = {}
+        if message_id:
+            parameters["since_message_id"] = message_id
+        if limit:
+            parameters["limit"] = limit
+        request = self._connection.deferred_get("room/%s/recent" % self._room.id, key="messages", parameters=parameters)
+        return request.addCallback(self._campfire.build_messages)
+
+    def transcript(self, for_date=None):
+        """ Recent messages.
+
+        Kwargs:
+            for_date (date): If specified, get the transcript for this specific date
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the list of messages
+        """
+        url = "room/%s/transcript" % self._room.id
+        if for_date:
+            url = "%s/%d/%d/%d" % (url, for_date.year, for_date.month, for_date.day)
+        request = self._connection.deferred_get(url, key="messages")
+        return request.addCallback(self._campfire.build_messages)
+
+    def set_name(self, name):
+        """ Set the room name.
+
+        Args:
+            name (str): Name
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        def renamed(success):
+            if success:
+                self._room.get_campfire().get_room_index().rename(self._room.id, name)
+            return success
+
+        def rename(user):
+            if not user.admin:
+                return False
+            return self._put({"room": {"name": name}}).addCallback(renamed)
+
+        return self._campfire.get_user().addCallback(rename)
+
+    def set_topic(self, topic):
+        """ Set the room topic.
+
+        Args:
+            topic (str): Topic
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        return self._put({"room": {"topic": topic or ''}})
+
+    def speak(self, message):
+        """ Post a message.
+
+        Args:
+            message (:class:`Message` or string): Message
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with the posted :class:`Message`, or False
+        """
+        campfire = self._room.get_campfire()
+        if not isinstance(message, BaseMessage):
+            message = Message(campfire, message)
+
+        def received(result):
+            if result["success"]:
+                return campfire.create_message(result["data"])
+            return result["success"]
+
+        request = self._connection.deferred_post(
+            "room/%s/speak" % self._room.id,
+            {"message": message.get_data()},
+            parse_data=True,
+            key="message"
+        )
+        return request.addCallback(received)
+
+    def _load(self):
+        """ Reload the room data.
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired when the room is reloaded
+        """
+        def received(data):
+            self._room.set_data(data, ["created_at", "updated_at"])
+            return self._room
+
+        return self._connection.deferred_get("room/%s" % self._room.id).addCallback(received)
+
+    def _post(self, url):
+        """ Issue a POST request, and get its success.
+
+        Args:
+            url (str): Destination URL
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        return self._connection.deferred_post(url).addCallback(operator.itemgetter("success"))
+
+    def _put(self, data):
+        """ Update the room, reloading it if the update succeeded.
+
+        Args:
+            data (dict): Data to update
+
+        Returns:
+            :class:`twisted.internet.defer.Deferred`. Fired with success
+        """
+        def received(result):
+            if not result["success"]:
+                return False
+            return self._load().addCallback(lambda room: True)
+
+        return self._connection.deferred_put("room/%s" % self._room.id, data).addCallback(received)
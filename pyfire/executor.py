@@ -0,0 +1,230 @@
+import Queue
+import threading
+import time
+
+from threading import Thread
+
+class TimeoutError(Exception):
+    pass
+
+class BatchExecutor(object):
+    """ Runs a function over many items with a bounded number of threads.
+
+    A call that takes longer than the timeout can't be interrupted: it gets a
+    TimeoutError result, but keeps running in the background until the
+    function returns, holding whatever it uses (such as a pooled connection.)
+    Functions given a timeout should bound their own blocking operations too.
+    """
+
+    def __init__(self, concurrency=8, timeout=None):
+        """ Initialize.
+
+        Kwargs:
+            concurrency (int): Maximum number of items processed at the same time
+            timeout (float): Maximum seconds to wait for each item (None waits forever)
+        """
+        assert concurrency > 0, 'A concurrency of at least 1 is needed'
+        self._concurrency = concurrency
+        self._timeout = timeout
+
+    def map(self, func, items):
+        """ Call a function for each item.
+
+        Args:
+            func (func): Function to call (parameters: item)
+            items (iterable): Items
+
+        Returns:
+            array. One result per item, in the same order as the items. Each result is a dict
+            with keys: success, data (what the function returned), error (exception raised, if any)
+        """
+        items = list(items)
+        results = [None] * len(items)
+
+        pending = Queue.Queue()
+        for index, item in enumerate(items):
+            pending.put((index, item))
+
+        def work():
+            while True:
+                try:
+                    index, item = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                results[index] = self._call(func, item)
+
+        workers = [Thread(target=work) for i in range(min(self._concurrency, len(items)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return results
+
+    def _call(self, func, item):
+        """ Call the function for an item, waiting at most the configured timeout.
+
+        Args:
+            func (func): Function to call (parameters: item)
+            item: Item
+
+        Returns:
+            dict. Result, with keys: success, data, error
+        """
+        result = {"success": False, "data": None, "error": None}
+
+        def call():
+            try:
+                result["data"] = func(item)
+                result["success"] = True
+            except Exception as e:
+                result["error"] = e
+
+        if not self._timeout:
+            call()
+            return result
+
+        # The call can't be interrupted, so it runs on its own thread and is abandoned if it takes too long
+        thread = Thread(target=call)
+        thread.daemon = True
+        thread.start()
+        thread.join(self._timeout)
+        if thread.is_alive():
+            return {
+                "success": False,
+                "data": None,
+                "error": TimeoutError("Timed out after %s seconds" % self._timeout)
+            }
+        return result
+
+class Task(object):
+    """ A call made in the background by a :class:`WorkerQueue` """
+
+    def __init__(self, func, args):
+        self._func = func
+        self._args = args
+        self._done = threading.Event()
+        self.result = {"success": False, "data": None, "error": None}
+
+    def is_done(self):
+        """ Tell if the call finished.
+
+        Returns:
+            bool. Success
+        """
+        return self._done.is_set()
+
+    def join(self, timeout=None):
+        """ Wait for the call to finish.
+
+        Kwargs:
+            timeout (float): Maximum seconds to wait (None waits forever)
+
+        Returns:
+            bool. True if the call finished
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def _run(self):
+        try:
+            self.result["data"] = self._func(*self._args)
+            self.result["success"] = True
+        except Exception as e:
+            self.result["error"] = e
+        finally:
+            self._done.set()
+
+class TaskGroup(object):
+    """ Several :class:`Task` instances waited for together """
+
+    def __init__(self, tasks):
+        self._tasks = list(tasks)
+
+    def is_done(self):
+        """ Tell if all calls finished.
+
+        Returns:
+            bool. Success
+        """
+        return all([task.is_done() for task in self._tasks])
+
+    def join(self, timeout=None):
+        """ Wait for all calls to finish.
+
+        Kwargs:
+            timeout (float): Maximum seconds to wait (None waits forever)
+
+        Returns:
+            bool. True if all calls finished
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        for task in self._tasks:
+            if not task.join(max(0, deadline - time.time()) if deadline is not None else None):
+                return False
+        return True
+
+class WorkerQueue(object):
+    """ Runs calls in the background on a bounded number of threads, which are
+    started when first needed and kept waiting for more calls. Calls given the
+    same key while one is pending are made only once.
+    """
+
+    def __init__(self, concurrency=4):
+        """ Initialize.
+
+        Kwargs:
+            concurrency (int): Maximum number of threads
+        """
+        assert concurrency > 0, 'A concurrency of at least 1 is needed'
+        self._concurrency = concurrency
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """ Queue a call.
+
+        Args:
+            func (func): Function to call
+            args: Arguments for the function
+
+        Kwargs:
+            key: If given and a call with this key is pending, that call's task is returned instead
+
+        Returns:
+            :class:`Task`. Task
+        """
+        key = kwargs.get("key")
+        self._lock.acquire()
+        try:
+            if key is not None and key in self._pending:
+                return self._pending[key]
+
+            task = Task(func, args)
+            if key is not None:
+                self._pending[key] = task
+            self._queue.put((key, task))
+
+            if len(self._workers) < self._concurrency:
+                worker = Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        finally:
+            self._lock.release()
+        return task
+
+    def _work(self):
+        while True:
+            key, task = self._queue.get()
+            task._run()
+            if key is not None:
+                self._lock.acquire()
+                try:
+                    if self._pending.get(key) is task:
+                        del self._pending[key]
+                finally:
+                    self._lock.release()
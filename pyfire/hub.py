@@ -0,0 +1,384 @@
+import time
+
+from multiprocessing import Process, Queue
+from Queue import Empty
+from threading import Lock, Thread
+
+from .connection import Connection
+from .stream import LiveStreamFactory, Stream, connect
+
+class StreamHub(Thread):
+    """ Live streams of many rooms, all received by one separate process running
+    a single reactor, instead of a process (and a thread) per room.
+
+    Every room added gets a :class:`Stream`, used to attach its observers. Those
+    streams are fed by the hub, so they should never be started.
+    """
+
+    STATE_CONNECTING = "connecting"
+    STATE_CONNECTED = "connected"
+    STATE_RECONNECTING = "reconnecting"
+    STATE_FAILED = "failed"
+
+    def __init__(self, campfire, error_callback=None, pause=1, prefetch=False):
+        """ Initialize.
+
+        Args:
+            campfire (:class:`Campfire`): Campfire instance
+
+        Kwargs:
+            error_callback (func): Callback to call when a room fails to stream, or the
+                                   process is killed (parameters: exception, room. Room is
+                                   None if the whole hub failed)
+            pause (int): Longest time in seconds spent waiting for messages before checking
+                         that the streaming process is alive
+            prefetch (bool): If True, the user, room and upload of each message are fetched in
+                             the background, instead of when observers first access them
+        """
+        Thread.__init__(self)
+        self._campfire = campfire
+        self._error_callback = error_callback
+        self._pause = pause
+        self._prefetch = prefetch
+        self._rooms = {}
+        self._lock = Lock()
+        self._commands = Queue()
+        self._events = Queue()
+        self._abort = False
+        self._streaming = False
+
+    def add_room(self, room):
+        """ Start streaming a room (joining it first). Rooms can be added before or
+        after the hub is started.
+
+        Args:
+            room (:class:`Room`): Room
+
+        Returns:
+            :class:`Stream`. Stream of the room, to attach observers to
+        """
+        self._lock.acquire()
+        try:
+            if room.id in self._rooms:
+                return self._rooms[room.id]["stream"]
+        finally:
+            self._lock.release()
+
+        room.join()
+        stream = Stream(room, prefetch=self._prefetch)
+
+        self._lock.acquire()
+        try:
+            if room.id in self._rooms:
+                return self._rooms[room.id]["stream"]
+            self._rooms[room.id] = {"room": room, "stream": stream, "state": self.STATE_CONNECTING}
+            self._commands.put(("add", room.id))
+        finally:
+            self._lock.release()
+        return stream
+
+    def remove_room(self, room):
+        """ Stop streaming a room.
+
+        Args:
+            room (:class:`Room`): Room
+
+        Returns:
+            bool. Success (False if the room was not being streamed)
+        """
+        self._lock.acquire()
+        try:
+            if room.id not in self._rooms:
+                return False
+            del self._rooms[room.id]
+            self._commands.put(("remove", room.id))
+        finally:
+            self._lock.release()
+        return True
+
+    def get_stream(self, room):
+        """ Get the stream of a room.
+
+        Args:
+            room (:class:`Room`): Room
+
+        Returns:
+            :class:`Stream`. Stream, or None if the room is not being streamed
+        """
+        self._lock.acquire()
+        try:
+            if room.id in self._rooms:
+                return self._rooms[room.id]["stream"]
+            return None
+        finally:
+            self._lock.release()
+
+    def get_states(self):
+        """ Get the connection state of every room.
+
+        Returns:
+            dict. State (one of: connecting, connected, reconnecting, failed) indexed by room ID
+        """
+        self._lock.acquire()
+        try:
+            return dict([(id, room["state"]) for id, room in self._rooms.items()])
+        finally:
+            self._lock.release()
+
+    def is_streaming(self):
+        """ Tell if streaming is in progress.
+
+        Returns:
+            bool. Success
+        """
+        return self._streaming
+
+    def stop(self):
+        """ Stop streaming all rooms.
+
+        It is recommended that you call join() after stopping this thread.
+
+        Returns:
+            :class:`StreamHub`. Current instance to allow chaining
+        """
+        self._abort = True
+        try:
+            self._events.put_nowait(None)
+        except (AssertionError, IOError, OSError, ValueError):
+            # Closed by the thread while stopping
+            pass
+        return self
+
+    def run(self):
+        """ Called by the thread, it runs the process.
+
+        NEVER call this method directly. Instead call start() to start the thread.
+
+        To stop, call stop(), and then join()
+        """
+        self._abort = False
+        process = StreamHubProcess(self._campfire.get_connection().get_settings(), self._commands, self._events)
+        process.start()
+        if not process.is_alive():
+            return
+
+        self._streaming = True
+
+        while not self._abort:
+            if not process.is_alive():
+                self._abort = True
+                if self._error_callback:
+                    self._error_callback(Exception("Streaming process was killed"), None)
+                break
+
+            # Blocks until an event arrives, stop() is called, or the pause passes
+            try:
+                event = self._events.get(timeout=self._pause)
+            except Empty:
+                continue
+
+            if event:
+                self._event(*event)
+
+        self._streaming = False
+
+        self._commands.put(("stop", None))
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        self._events.close()
+        self._commands.close()
+
+    def _event(self, name, room_id, *arguments):
+        """ Handle an event sent by the streaming process.
+
+        Args:
+            name (str): Event (one of: messages, state)
+            room_id (int): Room ID
+            arguments: For messages: time they were received, messages, and bytes read. For state:
+                       state, and error (if failed)
+        """
+        self._lock.acquire()
+        try:
+            room = self._rooms.get(room_id)
+            if room and name == "state":
+                room["state"] = arguments[0]
+        finally:
+            self._lock.release()
+
+        if not room:
+            return
+
+        if name == "messages":
+            received_at, messages, received_bytes = arguments
+            room["stream"].incoming(messages, received_at=received_at, received_bytes=received_bytes)
+        elif name == "state" and arguments[0] == self.STATE_FAILED and self._error_callback:
+            self._error_callback(arguments[1], room["room"])
+
+class StreamHubProcess(Process):
+    """ Separate process receiving the live streams of many rooms with a single reactor """
+
+    def __init__(self, settings, commands, events):
+        """ Initialize.
+
+        Args:
+            settings (dict): Settings used to create a :class:`Connection` instance
+            commands (:class:`multiprocessing.Queue`): Queue to get commands from (add, remove, stop)
+            events (:class:`multiprocessing.Queue`): Queue to send messages and connection states to
+        """
+        Process.__init__(self)
+        self._connection = Connection.create_from_settings(settings)
+        self._reactor = self._connection.get_twisted_reactor()
+        self._commands = commands
+        self._events = events
+        self._rooms = {}
+
+    def get_connection(self):
+        """ Get connection
+
+        Returns:
+            :class:`Connection`. Connection
+        """
+        return self._connection
+
+    def send(self, event):
+        """ Send an event to the hub.
+
+        Args:
+            event (tuple): Event
+        """
+        self._events.put_nowait(event)
+
+    def run(self):
+        """ Called by the process, it runs it.
+
+        NEVER call this method directly. Instead call start() to start the separate process.
+        """
+        reader = Thread(target=self._read_commands)
+        reader.daemon = True
+        reader.start()
+        self._reactor.run()
+
+    def _read_commands(self):
+        """ Wait for commands, running them in the reactor """
+        while True:
+            action, room_id = self._commands.get()
+            self._reactor.callFromThread(self._execute, action, room_id)
+            if action == "stop":
+                return
+
+    def _execute(self, action, room_id):
+        """ Run a command. Called in the reactor thread.
+
+        Args:
+            action (str): One of: add, remove, stop
+            room_id (int): Room ID (None for stop)
+        """
+        if action == "add" and room_id not in self._rooms:
+            room = HubRoomStream(self, room_id)
+            self._rooms[room_id] = room
+            connect(self._reactor, self._connection, room.get_factory())
+        elif action == "remove" and room_id in self._rooms:
+            self._rooms.pop(room_id).stop()
+        elif action == "stop":
+            for room in self._rooms.values():
+                room.stop()
+            self._rooms = {}
+            if self._reactor.running:
+                self._reactor.stop()
+
+class HubRoomStream(object):
+    """ Live stream of a room inside a :class:`StreamHubProcess`, receiving what
+    :class:`LiveStreamProtocol` parses """
+
+    def __init__(self, process, room_id):
+        """ Initialize.
+
+        Args:
+            process (:class:`StreamHubProcess`): Process
+            room_id (int): Room ID
+        """
+        self._process = process
+        self._room_id = room_id
+        self._protocol = None
+        self._factory = HubStreamFactory(self)
+
+    def get_room_id(self):
+        """ Get room ID.
+
+        Returns:
+            int. Room ID
+        """
+        return self._room_id
+
+    def get_connection(self):
+        """ Get connection
+
+        Returns:
+            :class:`Connection`. Connection
+        """
+        return self._process.get_connection()
+
+    def get_factory(self):
+        """ Get the factory creating this room's connections.
+
+        Returns:
+            :class:`HubStreamFactory`. Factory
+        """
+        return self._factory
+
+    def set_protocol(self, protocol):
+        """ Set protocol.
+
+        Args:
+            :class:`LiveStreamProtocol`: Protocol
+        """
+        self._protocol = protocol
+
+    def connected(self):
+        """ Callback when a connection is made. """
+        self._process.send(("state", self._room_id, StreamHub.STATE_CONNECTED, None))
+
+    def reconnecting(self):
+        """ Callback when the connection was lost, or could not be made, and will be tried again. """
+        self._process.send(("state", self._room_id, StreamHub.STATE_RECONNECTING, None))
+
+    def disconnected(self, reason):
+        """ Callback when the streaming server refused the stream, which won't be tried again.
+
+        Args:
+            reason (Exception): Exception
+        """
+        self._process.send(("state", self._room_id, StreamHub.STATE_FAILED, reason))
+
+    def received(self, messages, received_bytes=0):
+        """ Called when new messages arrive.
+
+        Args:
+            messages (tuple): Messages
+
+        Kwargs:
+            received_bytes (int): Bytes read from the network since the last messages
+        """
+        if messages:
+            self._process.send(("messages", self._room_id, time.time(), messages, received_bytes))
+
+    def stop(self):
+        """ Stop streaming """
+        self._factory.stopTrying()
+        if self._protocol and self._protocol.transport:
+            self._protocol.transport.loseConnection()
+
+class HubStreamFactory(LiveStreamFactory):
+    """ Live stream factory that tells its room stream when it reconnects """
+
+    def clientConnectionLost(self, connector, reason):
+        if self.continueTrying:
+            self.get_stream().reconnecting()
+        LiveStreamFactory.clientConnectionLost(self, connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        if self.continueTrying:
+            self.get_stream().reconnecting()
+        LiveStreamFactory.clientConnectionFailed(self, connector, reason)
@@ -0,0 +1,189 @@
+import collections
+import threading
+import time
+import weakref
+
+class IdentityMap(object):
+    """ Bounded map of entities (such as rooms or users) by ID, so there is only
+    one instance of each entity.
+
+    The most recently used entities are kept (up to max_size), and evicted ones
+    are still returned for as long as something else references them, so an
+    entity in use is never duplicated.
+    """
+
+    def __init__(self, max_size=1000, ttl=None, refresh=None):
+        """ Initialize.
+
+        Kwargs:
+            max_size (int): Maximum number of entities kept. If 0, entities are only kept while referenced elsewhere
+            ttl (int): Seconds after which an entity is stale, and refreshed when requested (None to never refresh)
+            refresh (func): Function that reloads the data of a stale entity (parameters: entity)
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._refresh = refresh
+        self._entries = collections.OrderedDict()
+        self._weak = weakref.WeakValueDictionary()
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "refreshes": 0
+        }
+
+    def get_stats(self):
+        """ Get usage statistics.
+
+        Returns:
+            dict. Stats, with keys: hits, misses, evictions, refreshes, size (entities kept),
+            referenced (entities alive, including evicted ones still in use)
+        """
+        self._lock.acquire()
+        try:
+            return dict(self._stats, size=len(self._entries), referenced=len(self._weak))
+        finally:
+            self._lock.release()
+
+    def get(self, id, factory=None, refresh=True):
+        """ Get an entity.
+
+        Args:
+            id: Entity ID
+
+        Kwargs:
+            factory (func): If the entity is not in the map, function that creates it (no parameters)
+            refresh (bool): If False, stale entities are returned without being refreshed
+
+        Returns:
+            Entity, or None if not in the map and no factory was given
+        """
+        stale = False
+        self._lock.acquire()
+        try:
+            entity = self._find(id)
+            if entity is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                stale = refresh and self._is_stale(id)
+                if stale:
+                    self._stats["refreshes"] += 1
+                    self._loaded[id] = time.time()
+        finally:
+            self._lock.release()
+
+        if entity is not None:
+            if stale:
+                try:
+                    self._refresh(entity)
+                except:
+                    self._loaded[id] = 0
+                    raise
+            return entity
+
+        if not factory:
+            return None
+
+        # Created without holding the lock, since it may take a request. If another
+        # thread created the same entity meanwhile, that one is kept
+        return self.setdefault(id, factory())
+
+    def setdefault(self, id, entity):
+        """ Add an entity, unless there already is one with this ID.
+
+        Args:
+            id: Entity ID
+            entity: Entity
+
+        Returns:
+            The entity in the map (the existing one, if there was one)
+        """
+        self._lock.acquire()
+        try:
+            existing = self._find(id)
+            if existing is not None:
+                return existing
+            self._weak[id] = entity
+            self._loaded[id] = time.time()
+            self._keep(id, entity)
+            return entity
+        finally:
+            self._lock.release()
+
+    def remove(self, id):
+        """ Remove an entity.
+
+        Args:
+            id: Entity ID
+        """
+        self._lock.acquire()
+        try:
+            self._entries.pop(id, None)
+            self._weak.pop(id, None)
+            self._loaded.pop(id, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Remove all entities. """
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._weak = weakref.WeakValueDictionary()
+            self._loaded = {}
+        finally:
+            self._lock.release()
+
+    def __contains__(self, id):
+        return self._weak.get(id) is not None
+
+    def __len__(self):
+        return len(self._weak)
+
+    def _find(self, id):
+        """ Find an entity, marking it as recently used. Must be called with the lock held.
+
+        Args:
+            id: Entity ID
+
+        Returns:
+            Entity, or None
+        """
+        if id in self._entries:
+            entity = self._entries.pop(id)
+            self._entries[id] = entity
+            return entity
+
+        entity = self._weak.get(id)
+        if entity is None:
+            self._loaded.pop(id, None)
+        else:
+            self._keep(id, entity)
+        return entity
+
+    def _keep(self, id, entity):
+        """ Keep a strong reference to an entity, evicting the least recently used ones
+        if needed. Must be called with the lock held.
+
+        Args:
+            id: Entity ID
+            entity: Entity
+        """
+        if self._max_size:
+            self._entries[id] = entity
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+        # Forget when entities no longer alive were loaded
+        if len(self._loaded) > 2 * max(self._max_size, len(self._weak), 100):
+            for key in [key for key in self._loaded if key not in self._weak]:
+                del self._loaded[key]
+
+    def _is_stale(self, id):
+        if not self._ttl or not self._refresh:
+            return False
+        return time.time() - self._loaded.get(id, 0) > self._ttl
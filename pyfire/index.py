@@ -0,0 +1,148 @@
+import bisect
+import threading
+import time
+
+class RoomIndex(object):
+    """ Index of rooms by name, so rooms can be found without fetching the room list every time """
+
+    def __init__(self, ttl=300):
+        """ Initialize.
+
+        Kwargs:
+            ttl (int): Seconds after which the index is stale and should be rebuilt (None to never expire)
+        """
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._updated = None
+        self._build([])
+
+    def is_stale(self):
+        """ Tell if the index should be rebuilt, because it was never built, it
+        expired, or it was invalidated.
+
+        Returns:
+            bool. Success
+        """
+        if self._updated is None:
+            return True
+        return self._ttl is not None and time.time() - self._updated > self._ttl
+
+    def update(self, rooms):
+        """ Rebuild the index.
+
+        Args:
+            rooms (array): Rooms (each room is a dict with at least keys: id, name)
+        """
+        self._lock.acquire()
+        try:
+            self._build(rooms)
+            self._updated = time.time()
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """ Mark the index as stale, so it is rebuilt on next use. """
+        self._updated = None
+
+    def get(self, name, case_sensitive=True):
+        """ Get a room by name.
+
+        Args:
+            name (str): Room name
+
+        Kwargs:
+            case_sensitive (bool): If False, ignore case (an exact match is still preferred)
+
+        Returns:
+            dict. Room, or None if not found
+        """
+        rooms, names, lower, keys, ids = self._index
+        id = names.get(name)
+        if id is None and not case_sensitive:
+            matches = lower.get(name.lower())
+            if matches:
+                id = matches[0]
+        return rooms.get(id) if id is not None else None
+
+    def is_missing(self, name, case_sensitive=True):
+        """ Tell if a name was not found after the index was last rebuilt (see :meth:`add_missing`),
+        so there is no point in rebuilding it again for that name until it is stale.
+
+        Args:
+            name (str): Room name
+
+        Kwargs:
+            case_sensitive (bool): If False, ignore case
+
+        Returns:
+            bool. Success
+        """
+        return self._get_missing_key(name, case_sensitive) in self._missing
+
+    def add_missing(self, name, case_sensitive=True):
+        """ Remember that a name was not found, until the index is rebuilt.
+
+        Args:
+            name (str): Room name
+
+        Kwargs:
+            case_sensitive (bool): If False, ignore case
+        """
+        self._missing.add(self._get_missing_key(name, case_sensitive))
+
+    def find(self, prefix):
+        """ Get the rooms whose name starts with a prefix, ignoring case.
+
+        Args:
+            prefix (str): Name prefix
+
+        Returns:
+            array. Rooms (each room is a dict), sorted by name
+        """
+        rooms, names, lower, keys, ids = self._index
+        prefix = prefix.lower()
+        found = []
+        index = bisect.bisect_left(keys, prefix)
+        while index < len(keys) and keys[index].startswith(prefix):
+            found.append(rooms[ids[index]])
+            index += 1
+        return found
+
+    def rename(self, id, name):
+        """ Update the name of an indexed room.
+
+        Args:
+            id (int): Room ID
+            name (str): New name
+        """
+        self._lock.acquire()
+        try:
+            if id in self._index[0]:
+                rooms = dict(self._index[0])
+                rooms[id] = dict(rooms[id], name=name)
+                self._build(rooms.values())
+        finally:
+            self._lock.release()
+
+    def _build(self, rooms):
+        """ Build the index structures, replacing the current ones at once so
+        lookups running in other threads always see a consistent index.
+
+        Args:
+            rooms (array): Rooms
+        """
+        by_id = {}
+        names = {}
+        lower = {}
+        for room in rooms:
+            room = dict(room)
+            by_id[room["id"]] = room
+            names.setdefault(room["name"], room["id"])
+            lower.setdefault(room["name"].lower(), []).append(room["id"])
+
+        entries = sorted([(room["name"].lower(), room["id"]) for room in by_id.values()])
+        self._index = (by_id, names, lower, [key for key, id in entries], [id for key, id in entries])
+        self._missing = set()
+
+    def _get_missing_key(self, name, case_sensitive):
+        return (name, True) if case_sensitive else (name.lower(), False)
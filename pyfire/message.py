@@ -1,10 +1,16 @@
+import calendar
+import datetime
 import re
+import time
 import types
 from .entity import CampfireEntity
 
-class Message(CampfireEntity):
-    """ Campfire message """
-    
+class BaseMessage(object):
+    """ Behavior shared by every message representation: type helpers, and the
+    user, room and upload of the message, fetched when first accessed """
+
+    __slots__ = ()
+
     _TYPE_ENTER = "EnterMessage"
     _TYPE_LEAVE = "LeaveMessage"
     _TYPE_KICK = "KickMessage"
@@ -16,67 +22,69 @@ class Message(CampfireEntity):
     _TYPE_TWEET = "TweetMessage"
     _TYPE_UPLOAD = "UploadMessage"
 
-    def __init__(self, campfire, data):
-        """ Initialize.
+    def get_user(self):
+        """ Get the user that wrote this message, fetching it if needed.
+
+        Returns:
+            :class:`User`. User, or None if the message has no user
+        """
+        return self._resolve("user")
+
+    def set_user(self, user):
+        """ Set the user that wrote this message.
 
         Args:
-            campfire (:class:`Campfire`): Campfire instance
-            data (dict or str): If string, message type will be set to either paste or text
+            user (:class:`User`): User
         """
-        dataType = type(data)
-        if dataType == types.StringType or dataType == types.UnicodeType:
-            messageType = self._TYPE_PASTE if data.find("\n") >= 0 else self._TYPE_TEXT
-            if messageType == self._TYPE_TEXT:
-                matches = re.match("^https?://(www\.)?twitter\.com/([^/]+)/status/(\d+)", data)
-                if matches:
-                    messageType = self._TYPE_TWEET
-            data = {
-                "type": messageType,
-                "body": data
-            }
+        self._set_resolved("user", user)
 
-        super(Message, self).__init__(campfire)
+    def get_room(self):
+        """ Get the room this message was posted to, fetching it if needed.
 
-        self.set_data(data, ["created_at"])
-        
-        self.user = None
-        self.room = None
-
-        if "user_id" in data and data["user_id"]:
-            self.user = self._campfire.get_user(data["user_id"])
-        if "room_id" in data and data["room_id"]:
-            self.room = self._campfire.get_room(data["room_id"])
-            if self.is_upload():
-                self.upload = self._connection.get("room/%s/messages/%s/upload" % (self.room.id, self.id), key="upload")
-                if "full_url" in self.upload:
-                    self.upload["url"] = self.upload["full_url"]
-                    del self.upload["full_url"]
+        Returns:
+            :class:`Room`. Room, or None if the message has no room
+        """
+        return self._resolve("room")
 
-        if self.is_tweet():
-            # Tweet formats may be different if the streaming is line, or transcript based (I know, I know...)
-            matches = re.match("(.+)\s+--\s+@([^,]+),\s*(.+)$", self.body)
-            if matches:
-                self.tweet = {
-                    "tweet": matches.group(1),
-                    "user": matches.group(2),
-                    "url": matches.group(3)
-                }
-            else:
-                tweet_data = {}
-                if re.match("^---", self.body):
-                    for line in self.body.split("\n")[1:]:
-                        matches = re.match('^:([^:]+):\s*"?(.+)"?$', line)
-                        if matches:
-                            tweet_data[matches.group(1)] = matches.group(2)
-    
-                if tweet_data and "author_username" in tweet_data and "message" in tweet_data and "id" in tweet_data:
-                    self.tweet = {
-                        "tweet": tweet_data["message"],
-                        "user": tweet_data["author_username"],
-                        "url": "http://twitter.com/%s/status/%s" % (tweet_data["author_username"], tweet_data["id"])
-                    }
-                else:
-                    self.type = self._TYPE_TEXT
+    def set_room(self, room):
+        """ Set the room this message was posted to.
+
+        Args:
+            room (:class:`Room`): Room
+        """
+        self._set_resolved("room", room)
+
+    def get_upload(self):
+        """ Get the uploaded file details, fetching them if needed.
+
+        Returns:
+            dict. Upload (with keys such as: name, url, content_type, byte_size), or None if this is not an upload message
+        """
+        return self._resolve("upload")
+
+    def set_upload(self, upload):
+        """ Set the uploaded file details.
+
+        Args:
+            upload (dict): Upload
+        """
+        self._set_resolved("upload", upload)
+
+    user = property(get_user, set_user)
+    room = property(get_room, set_room)
+    upload = property(get_upload, set_upload)
+
+    def prefetch(self):
+        """ Fetch the user, room and upload of this message in the background
+        (see :meth:`Campfire.prefetch`), so they are ready when accessed. Accessing
+        them before the fetch is done waits for it.
+
+        Returns:
+            :class:`Message`. Current instance to allow chaining
+        """
+        if self._prefetching is None:
+            self._campfire.prefetch([self])
+        return self
 
     def is_by_current_user(self):
         """ Tells if this message was written by the current user.
@@ -84,7 +92,11 @@ class Message(CampfireEntity):
         Returns:
             bool. Success
         """
-        return self.user.id == self._campfire.get_user().id
+        if self._resolved and "user" in self._resolved:
+            user_id = self._resolved["user"].id if self._resolved["user"] else None
+        else:
+            user_id = getattr(self, "user_id", None)
+        return user_id == self._campfire.get_user().id
 
     def is_joining(self):
         """ Tells if this message is a room join message.
@@ -168,7 +180,7 @@ class Message(CampfireEntity):
         Returns:
             bool. Success
         """
-        return self._connection.post("messages/%s/star" % self.id)["success"]
+        return self.get_connection().post("messages/%s/star" % self.id)["success"]
 
     def remove_highlight(self):
         """ Removes the highlight of a message.
@@ -176,4 +188,307 @@ class Message(CampfireEntity):
         Returns:
             bool. Success
         """
-        return self._connection.delete("messages/%s/star" % self.id)["success"]
+        return self.get_connection().delete("messages/%s/star" % self.id)["success"]
+
+    def _resolve(self, name):
+        """ Get the user, room or upload of this message, fetching it the first time.
+
+        Args:
+            name (str): One of: user, room, upload
+
+        Returns:
+            Value
+        """
+        if not self._resolved or name not in self._resolved:
+            if self._prefetching:
+                self._prefetching.join()
+        if not self._resolved or name not in self._resolved:
+            self._set_resolved(name, getattr(self, "_fetch_%s" % name)())
+        return self._resolved[name]
+
+    def _set_resolved(self, name, value):
+        if self._resolved is None:
+            self._resolved = {}
+        self._resolved[name] = value
+
+    def _fetch_user(self):
+        user_id = getattr(self, "user_id", None)
+        if not user_id:
+            return None
+        return self._campfire.get_user(user_id)
+
+    def _fetch_room(self):
+        room_id = getattr(self, "room_id", None)
+        if not room_id:
+            return None
+        return self._campfire.get_room(room_id)
+
+    def _fetch_upload(self):
+        room_id = getattr(self, "room_id", None)
+        if not room_id or not self.is_upload():
+            return None
+        upload = self.get_connection().get("room/%s/messages/%s/upload" % (room_id, self.id), key="upload")
+        if "full_url" in upload:
+            upload["url"] = upload["full_url"]
+            del upload["full_url"]
+        return upload
+
+    def _prefetch_upload(self):
+        """ Fetch the upload in the background. Errors are raised again when the
+        upload is accessed, since it is only set on success.
+        """
+        if not self._resolved or "upload" not in self._resolved:
+            self._set_resolved("upload", self._fetch_upload())
+
+class Message(CampfireEntity, BaseMessage):
+    """ Campfire message """
+
+    def __init__(self, campfire, data, prefetch=False):
+        """ Initialize. No requests are made: the user, room and upload of the message
+        are fetched when first accessed.
+
+        Args:
+            campfire (:class:`Campfire`): Campfire instance
+            data (dict or str): If string, message type will be set to either paste or text
+
+        Kwargs:
+            prefetch (bool): If True, fetch the user, room and upload in the background
+        """
+        dataType = type(data)
+        if dataType == types.StringType or dataType == types.UnicodeType:
+            messageType = self._TYPE_PASTE if data.find("\n") >= 0 else self._TYPE_TEXT
+            if messageType == self._TYPE_TEXT:
+                matches = re.match("^https?://(www\.)?twitter\.com/([^/]+)/status/(\d+)", data)
+                if matches:
+                    messageType = self._TYPE_TWEET
+            data = {
+                "type": messageType,
+                "body": data
+            }
+
+        # Getting the connection may need to authenticate, so it is also done when first needed
+        super(Message, self).__init__(None)
+        self._campfire = campfire
+
+        self.set_data(data, ["created_at"])
+
+        self._resolved = None
+        self._prefetching = None
+
+        if self.is_tweet():
+            self.tweet = _parse_tweet(self.body)
+            if not self.tweet:
+                self.type = self._TYPE_TEXT
+
+        if prefetch:
+            self.prefetch()
+
+    def get_connection(self):
+        """ Get campfire connection.
+
+        Returns:
+            :class:`Connection`. Connection
+        """
+        if self._connection is None and self._campfire:
+            self._connection = self._campfire.get_connection()
+        return self._connection
+
+class CompactMessage(BaseMessage):
+    """ Campfire message using as little memory as possible, for applications
+    keeping many messages around. Fields are stored in slots instead of a dict,
+    message types are shared strings, and the creation time is kept as seconds
+    since the epoch (created_at builds a datetime on each access.)
+
+    It behaves like :class:`Message`, except it does not expose get_data()
+    for modification: changing the returned dict does not change the message.
+    """
+
+    __slots__ = (
+        "_campfire", "_resolved", "_prefetching", "_extra",
+        "id", "type", "body", "user_id", "room_id", "starred", "created_at_epoch"
+    )
+
+    _FIELDS = ("id", "type", "body", "user_id", "room_id", "starred", "created_at")
+
+    _TYPES = dict((name, name) for name in (
+        BaseMessage._TYPE_ENTER,
+        BaseMessage._TYPE_LEAVE,
+        BaseMessage._TYPE_KICK,
+        BaseMessage._TYPE_PASTE,
+        BaseMessage._TYPE_SOUND,
+        BaseMessage._TYPE_TEXT,
+        BaseMessage._TYPE_TIMESTAMP,
+        BaseMessage._TYPE_TOPIC_CHANGE,
+        BaseMessage._TYPE_TWEET,
+        BaseMessage._TYPE_UPLOAD
+    ))
+
+    def __init__(self, campfire, data, prefetch=False):
+        """ Initialize. No requests are made: the user, room and upload of the message
+        are fetched when first accessed.
+
+        Args:
+            campfire (:class:`Campfire`): Campfire instance
+            data (dict): Message data
+
+        Kwargs:
+            prefetch (bool): If True, fetch the user, room and upload in the background
+        """
+        self._campfire = campfire
+        self._resolved = None
+        self._prefetching = None
+
+        get = data.get
+        self.id = get("id")
+        self.type = self._intern(get("type"))
+        self.body = get("body")
+        self.user_id = get("user_id")
+        self.room_id = get("room_id")
+        self.starred = get("starred")
+        self.created_at_epoch = _parse_epoch(get("created_at"))
+
+        extra = [(name, value) for name, value in data.items() if name not in self._FIELDS]
+        self._extra = dict(extra) if extra else None
+
+        if self.type == self._TYPE_TWEET:
+            tweet = _parse_tweet(self.body or "")
+            if tweet:
+                self._set_extra("tweet", tweet)
+            else:
+                self.type = self._TYPE_TEXT
+
+        if prefetch:
+            self.prefetch()
+
+    def __getattr__(self, name):
+        """ Look for attributes not stored in slots in the additional message data.
+
+        Args:
+            name (str): Property name to look for
+
+        Returns:
+            Value
+
+        Raises:
+            AttributeError
+        """
+        if name != "_extra" and self._extra and name in self._extra:
+            return self._extra[name]
+        raise AttributeError("No property named %s" % name)
+
+    @property
+    def created_at(self):
+        """ Creation time (UTC), as a datetime """
+        if self.created_at_epoch is None:
+            return None
+        return datetime.datetime.utcfromtimestamp(self.created_at_epoch)
+
+    def get_campfire(self):
+        """ Get campfire instance.
+
+        Returns:
+            :class:`Campfire`. Campfire instance
+        """
+        return self._campfire
+
+    def get_connection(self):
+        """ Get campfire connection.
+
+        Returns:
+            :class:`Connection`. Connection
+        """
+        return self._campfire.get_connection()
+
+    def get_data(self):
+        """ Get message data, in the same form as :meth:`Message.get_data`
+
+        Returns:
+            dict. Data
+        """
+        data = dict(self._extra or {})
+        data.pop("tweet", None)
+        for name in self._FIELDS:
+            data[name] = getattr(self, name)
+        return data
+
+    def _intern(self, type):
+        """ Get the shared string for a message type.
+
+        Args:
+            type (str): Message type
+
+        Returns:
+            str. Type
+        """
+        if type is None:
+            return None
+        known = self._TYPES.get(type)
+        if known is None:
+            known = self._TYPES.setdefault(type, intern(type.encode("utf-8") if isinstance(type, unicode) else type))
+        return known
+
+    def _set_extra(self, name, value):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[name] = value
+
+def _parse_tweet(body):
+    """ Parse the tweet details out of a tweet message body. Tweet formats may be
+    different if the streaming is line, or transcript based (I know, I know...)
+
+    Args:
+        body (str): Message body
+
+    Returns:
+        dict. Tweet, with keys: tweet, user, url. None if it could not be parsed
+    """
+    matches = re.match("(.+)\s+--\s+@([^,]+),\s*(.+)$", body)
+    if matches:
+        return {
+            "tweet": matches.group(1),
+            "user": matches.group(2),
+            "url": matches.group(3)
+        }
+
+    tweet_data = {}
+    if re.match("^---", body):
+        for line in body.split("\n")[1:]:
+            matches = re.match('^:([^:]+):\s*"?(.+)"?$', line)
+            if matches:
+                tweet_data[matches.group(1)] = matches.group(2)
+
+    if tweet_data and "author_username" in tweet_data and "message" in tweet_data and "id" in tweet_data:
+        return {
+            "tweet": tweet_data["message"],
+            "user": tweet_data["author_username"],
+            "url": "http://twitter.com/%s/status/%s" % (tweet_data["author_username"], tweet_data["id"])
+        }
+    return None
+
+def _parse_epoch(value):
+    """ Parses a datetime string from "YYYY/MM/DD HH:MM:SS +HHMM" format into seconds
+    since the epoch, the same way :meth:`CampfireEntity._parse_datetime` does
+
+    Args:
+        value (str): String
+
+    Returns:
+        int. Seconds since the epoch, or None if there is no value
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+
+    if len(value) >= 19 and value[4] == "/" and value[7] == "/" and value[13] == ":" and value[16] == ":":
+        epoch = calendar.timegm((
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19])
+        ))
+    else:
+        epoch = calendar.timegm(time.strptime(value.strip()[:19], "%Y/%m/%d %H:%M:%S"))
+
+    offset = value[19:].strip()
+    if offset:
+        epoch -= (int(offset) // 100) * 3600
+    return epoch
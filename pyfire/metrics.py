@@ -0,0 +1,214 @@
+import re
+import threading
+import urlparse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def endpoint(url):
+    """ Get the endpoint name for a URL, used to group metrics. Numeric IDs
+    are replaced so every room or user shares the same endpoint.
+
+    Args:
+        url (str): Full or relative URL
+
+    Returns:
+        str. Endpoint (e.g: room/:id/speak)
+    """
+    path = urlparse.urlsplit(url).path.strip("/")
+    if path.endswith(".json"):
+        path = path[:-5]
+    return re.sub(r"(^|/)\d+(?=/|$)", r"\1:id", path)
+
+class MetricsSink(object):
+    """ Receives metrics. This sink discards everything: subclass it to send
+    metrics somewhere else (e.g: statsd) """
+
+    def increment(self, name, labels=None, value=1):
+        """ Increase a counter.
+
+        Args:
+            name (str): Metric name
+
+        Kwargs:
+            labels (dict): Labels
+            value (float): Increment
+        """
+        pass
+
+    def add(self, name, value, labels=None):
+        """ Change a gauge by the given amount.
+
+        Args:
+            name (str): Metric name
+            value (float): Amount (negative to decrease)
+
+        Kwargs:
+            labels (dict): Labels
+        """
+        pass
+
+    def observe(self, name, value, labels=None):
+        """ Add an observation to a histogram.
+
+        Args:
+            name (str): Metric name
+            value (float): Observed value
+
+        Kwargs:
+            labels (dict): Labels
+        """
+        pass
+
+class MetricsRegistry(MetricsSink):
+    """ In memory metrics, which can be exported in Prometheus text format """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """ Initialize.
+
+        Kwargs:
+            buckets (tuple): Upper bounds for histogram buckets
+        """
+        self._buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        self._lock.acquire()
+        try:
+            self._counters[key] = self._counters.get(key, 0) + value
+        finally:
+            self._lock.release()
+
+    def add(self, name, value, labels=None):
+        key = self._key(name, labels)
+        self._lock.acquire()
+        try:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+        finally:
+            self._lock.release()
+
+    def observe(self, name, value, labels=None):
+        key = self._key(name, labels)
+        self._lock.acquire()
+        try:
+            if key not in self._histograms:
+                self._histograms[key] = {
+                    "buckets": [0] * len(self._buckets),
+                    "count": 0,
+                    "sum": 0
+                }
+            histogram = self._histograms[key]
+            for index, bound in enumerate(self._buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+        finally:
+            self._lock.release()
+
+    def get_counter(self, name, labels=None):
+        """ Get the value of a counter.
+
+        Args:
+            name (str): Metric name
+
+        Kwargs:
+            labels (dict): Labels
+
+        Returns:
+            float. Value
+        """
+        return self._counters.get(self._key(name, labels), 0)
+
+    def get_gauge(self, name, labels=None):
+        """ Get the value of a gauge.
+
+        Args:
+            name (str): Metric name
+
+        Kwargs:
+            labels (dict): Labels
+
+        Returns:
+            float. Value
+        """
+        return self._gauges.get(self._key(name, labels), 0)
+
+    def get_histogram(self, name, labels=None):
+        """ Get a histogram.
+
+        Args:
+            name (str): Metric name
+
+        Kwargs:
+            labels (dict): Labels
+
+        Returns:
+            dict. Histogram, with keys: buckets (list of (upper bound, cumulative count)), count, sum.
+            None if nothing was observed
+        """
+        self._lock.acquire()
+        try:
+            histogram = self._histograms.get(self._key(name, labels))
+            if not histogram:
+                return None
+            return {
+                "buckets": zip(self._buckets, histogram["buckets"]),
+                "count": histogram["count"],
+                "sum": histogram["sum"]
+            }
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Discard all metrics. """
+        self._lock.acquire()
+        try:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+        finally:
+            self._lock.release()
+
+    def to_prometheus(self):
+        """ Export metrics in Prometheus text format.
+
+        Returns:
+            str. Metrics
+        """
+        lines = []
+        self._lock.acquire()
+        try:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(set([key[0] for key in metrics])):
+                    lines.append("# TYPE %s %s" % (name, kind))
+                    for key in sorted([key for key in metrics if key[0] == name]):
+                        lines.append("%s%s %s" % (name, self._labels(key[1]), self._number(metrics[key])))
+
+            for name in sorted(set([key[0] for key in self._histograms])):
+                lines.append("# TYPE %s histogram" % name)
+                for key in sorted([key for key in self._histograms if key[0] == name]):
+                    histogram = self._histograms[key]
+                    for bound, count in zip(self._buckets, histogram["buckets"]):
+                        lines.append("%s_bucket%s %d" % (name, self._labels(key[1] + (("le", self._number(bound)),)), count))
+                    lines.append("%s_bucket%s %d" % (name, self._labels(key[1] + (("le", "+Inf"),)), histogram["count"]))
+                    lines.append("%s_sum%s %s" % (name, self._labels(key[1]), self._number(histogram["sum"])))
+                    lines.append("%s_count%s %d" % (name, self._labels(key[1]), histogram["count"]))
+        finally:
+            self._lock.release()
+
+        return "\n".join(lines) + "\n"
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def _labels(self, labels):
+        if not labels:
+            return ""
+        return "{%s}" % ",".join(['%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels])
+
+    def _number(self, value):
+        return repr(value) if isinstance(value, float) else str(value)
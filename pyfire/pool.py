@@ -0,0 +1,372 @@
+import errno
+import httplib
+import select
+import socket
+import threading
+import time
+import urlparse
+
+class PoolTimeoutError(Exception):
+    pass
+
+class HTTPConnectionPool(object):
+    """ A pool of persistent (keep-alive) HTTP/HTTPS connections.
+
+    Connections are kept per host (scheme, host and port), and reused across
+    requests until they are closed by the server, or they stay idle for
+    longer than the idle timeout.
+
+    A request that fails on a reused connection is sent again on a new one
+    only if its method can safely be repeated, and the server is known not
+    to have answered it (it closed or reset the connection before sending
+    any response.) Timeouts are never retried.
+    """
+
+    RETRY_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+    def __init__(self, max_per_host=4, idle_timeout=60, wait_timeout=None, debug=False):
+        """ Initialize.
+
+        Kwargs:
+            max_per_host (int): Maximum number of connections (idle and in use) per host
+            idle_timeout (int): Seconds after which an idle connection is closed
+            wait_timeout (int): Seconds to wait for a free connection (None waits forever)
+            debug (bool): If True, print HTTP traffic to stdout
+        """
+        self._max_per_host = max_per_host
+        self._idle_timeout = idle_timeout
+        self._wait_timeout = wait_timeout
+        self._debug = debug
+        self._lock = threading.Condition()
+        self._idle = {}
+        self._in_use = {}
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "evicted": 0,
+            "discarded": 0,
+            "requests": 0,
+            "waits": 0
+        }
+
+    def get_stats(self):
+        """ Get pool statistics.
+
+        Returns:
+            dict. Statistics (created, reused, evicted, discarded, requests, waits, idle, in_use)
+        """
+        self._lock.acquire()
+        try:
+            stats = dict(self._stats)
+            stats["idle"] = sum([len(connections) for connections in self._idle.values()])
+            stats["in_use"] = sum(self._in_use.values())
+            return stats
+        finally:
+            self._lock.release()
+
+    def set_debug(self, debug):
+        """ Enable/disable debug
+
+        Args:
+            bool. Debug
+        """
+        self._debug = debug
+
+    def set_limits(self, max_per_host, idle_timeout):
+        """ Change the pool limits. Connections over the new limit are closed when they are released.
+
+        Args:
+            max_per_host (int): Maximum number of connections (idle and in use) per host
+            idle_timeout (int): Seconds after which an idle connection is closed
+        """
+        self._lock.acquire()
+        try:
+            self._max_per_host = max_per_host
+            self._idle_timeout = idle_timeout
+            self._evict()
+            for key in self._idle:
+                while self._idle[key] and len(self._idle[key]) + self._in_use.get(key, 0) > max_per_host:
+                    connection, last_used = self._idle[key].pop(0)
+                    connection.close()
+                    self._stats["evicted"] += 1
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def request(self, method, url, body=None, headers={}, timeout=None):
+        """ Issue a request, reusing a pooled connection if one is available.
+
+        The response body is read completely, so the connection can go back to the pool.
+
+        Args:
+            method (str): Request method (GET/POST/PUT/DELETE/etc.)
+            url (str): Full URL
+
+        Kwargs:
+            body (str): Request body
+            headers (dict): Request headers
+            timeout (float): Socket timeout in seconds
+
+        Returns:
+            tuple. Tuple with two elements: response (:class:`httplib.HTTPResponse`), and body
+
+        Raises:
+            PoolTimeoutError, httplib.HTTPException, socket.error
+        """
+        response, release = self.urlopen(method, url, body=body, headers=headers, timeout=timeout)
+        try:
+            body = response.read()
+        except:
+            release(False)
+            raise
+        release()
+        return (response, body)
+
+    def urlopen(self, method, url, body=None, headers={}, timeout=None):
+        """ Issue a request, and return the response without reading its body.
+
+        The caller is responsible for calling the returned release function once the
+        body was read (or with False as argument, if the connection can't be reused.)
+
+        Args:
+            method (str): Request method (GET/POST/PUT/DELETE/etc.)
+            url (str): Full URL
+
+        Kwargs:
+            body (str): Request body
+            headers (dict): Request headers
+            timeout (float): Socket timeout in seconds, for this request only
+
+        Returns:
+            tuple. Tuple with two elements: response (:class:`httplib.HTTPResponse`), and release function
+
+        Raises:
+            PoolTimeoutError, httplib.HTTPException, socket.error
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?%s" % parts.query
+
+        connection, reused = self._acquire(key)
+        while True:
+            sent = False
+            try:
+                if timeout is not None:
+                    self._set_timeout(connection, timeout)
+                connection.request(method, path, body, headers)
+                sent = True
+                response = connection.getresponse()
+                break
+            except socket.timeout:
+                self._discard(key, connection)
+                raise
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error) as e:
+                self._discard(key, connection)
+                if not reused or method.upper() not in self.RETRY_METHODS or not self._is_unanswered(e, sent):
+                    raise
+                # The server closed a kept-alive connection, retry on a fresh one
+                connection, reused = self._acquire(key, fresh=True)
+            except:
+                self._discard(key, connection)
+                raise
+
+        self._lock.acquire()
+        try:
+            self._stats["requests"] += 1
+        finally:
+            self._lock.release()
+
+        def release(reusable=True):
+            if reusable and not response.will_close and response.isclosed():
+                if timeout is not None:
+                    # Later requests on this connection get the default timeout back
+                    self._set_timeout(connection, socket._GLOBAL_DEFAULT_TIMEOUT)
+                self._release(key, connection)
+            else:
+                self._discard(key, connection)
+
+        return (response, release)
+
+    def clear(self):
+        """ Close all idle connections. """
+        self._lock.acquire()
+        try:
+            for key in self._idle:
+                for connection, last_used in self._idle[key]:
+                    connection.close()
+            self._idle = {}
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def _acquire(self, key, fresh=False):
+        """ Get a connection for the given host, waiting for one to be available
+        if the maximum number of connections for that host was reached.
+
+        Args:
+            key (tuple): Host key (scheme, host, port)
+
+        Kwargs:
+            fresh (bool): If True, don't reuse an idle connection
+
+        Returns:
+            tuple. Tuple with two elements: connection, and wether it was reused
+
+        Raises:
+            PoolTimeoutError
+        """
+        self._lock.acquire()
+        try:
+            self._evict()
+            started = time.time()
+            while True:
+                idle = self._idle.get(key, [])
+                if idle and not fresh:
+                    connection, last_used = idle.pop()
+                    if self._is_dropped(connection):
+                        connection.close()
+                        self._stats["evicted"] += 1
+                        continue
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    self._stats["reused"] += 1
+                    return (connection, True)
+
+                # A fresh connection only replaces an idle one if the host has no room for both
+                if idle and fresh and len(idle) + self._in_use.get(key, 0) >= self._max_per_host:
+                    connection, last_used = idle.pop(0)
+                    connection.close()
+                    self._stats["evicted"] += 1
+
+                if len(idle) + self._in_use.get(key, 0) < self._max_per_host:
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    self._stats["created"] += 1
+                    break
+
+                self._stats["waits"] += 1
+                if self._wait_timeout is None:
+                    self._lock.wait()
+                else:
+                    remaining = self._wait_timeout - (time.time() - started)
+                    if remaining <= 0:
+                        raise PoolTimeoutError("No connection available for %s://%s" % (key[0], key[1]))
+                    self._lock.wait(remaining)
+        finally:
+            self._lock.release()
+
+        return (self._connect(key), False)
+
+    def _connect(self, key):
+        """ Create a new connection.
+
+        Args:
+            key (tuple): Host key (scheme, host, port)
+
+        Returns:
+            :class:`httplib.HTTPConnection`. Connection
+        """
+        scheme, host, port = key
+        if scheme == "https":
+            connection = httplib.HTTPSConnection(host, port)
+        else:
+            connection = httplib.HTTPConnection(host, port)
+        connection.set_debuglevel(int(self._debug))
+        return connection
+
+    def _set_timeout(self, connection, timeout):
+        """ Set the socket timeout of a connection.
+
+        Args:
+            connection (:class:`httplib.HTTPConnection`): Connection
+            timeout (float): Timeout in seconds (socket._GLOBAL_DEFAULT_TIMEOUT for the default one)
+        """
+        connection.timeout = timeout
+        if connection.sock:
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            connection.sock.settimeout(timeout)
+
+    def _release(self, key, connection):
+        """ Return a connection to the pool.
+
+        Args:
+            key (tuple): Host key (scheme, host, port)
+            connection (:class:`httplib.HTTPConnection`): Connection
+        """
+        self._lock.acquire()
+        try:
+            self._in_use[key] -= 1
+            self._idle.setdefault(key, []).append((connection, time.time()))
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def _discard(self, key, connection):
+        """ Close a connection that can not be reused.
+
+        Args:
+            key (tuple): Host key (scheme, host, port)
+            connection (:class:`httplib.HTTPConnection`): Connection
+        """
+        connection.close()
+        self._lock.acquire()
+        try:
+            self._in_use[key] -= 1
+            self._stats["discarded"] += 1
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def _is_dropped(self, connection):
+        """ Tell if the server closed an idle connection (it is readable when
+        nothing should be received on it.)
+
+        Args:
+            connection (:class:`httplib.HTTPConnection`): Connection
+
+        Returns:
+            bool. Success
+        """
+        if not connection.sock:
+            return False
+        try:
+            readable = select.select([connection.sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return True
+        return bool(readable)
+
+    def _is_unanswered(self, error, sent):
+        """ Tell if a request that failed on a reused connection was surely not
+        answered by the server, so it can be sent again.
+
+        Args:
+            error (Exception): Error
+            sent (bool): If the request was completely sent
+
+        Returns:
+            bool. Success
+        """
+        if not sent:
+            return True
+        if isinstance(error, httplib.BadStatusLine):
+            # Raised with an empty line (or, since Python 2.7.12, an explanation of it) when
+            # the connection was closed before any response byte
+            return error.line in ("", "''") or error.line.startswith("No status line received")
+        return getattr(error, "errno", None) in (errno.ECONNRESET, errno.EPIPE)
+
+    def _evict(self):
+        """ Close connections that have been idle for too long. Should be called with the lock held. """
+        if not self._idle_timeout:
+            return
+
+        limit = time.time() - self._idle_timeout
+        for key in self._idle:
+            connections = []
+            for connection, last_used in self._idle[key]:
+                if last_used < limit:
+                    connection.close()
+                    self._stats["evicted"] += 1
+                else:
+                    connections.append((connection, last_used))
+            self._idle[key] = connections
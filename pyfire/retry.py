@@ -0,0 +1,153 @@
+import email.utils
+import random
+import threading
+import time
+
+class RetryPolicy(object):
+    """ Decides when a failed request should be retried, and how long to wait before doing so """
+
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30, jitter=True, statuses=None, methods=None):
+        """ Initialize.
+
+        Kwargs:
+            max_retries (int): Maximum number of retries for a request
+            backoff (float): Base delay in seconds, doubled on each retry
+            max_backoff (float): Maximum delay in seconds between retries
+            jitter (bool): If True, randomize delays so clients don't retry at the same time
+            statuses (tuple): Response status codes that should be retried
+            methods (tuple): Request methods that are safe to retry
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = statuses or self.RETRY_STATUSES
+        self.methods = methods or self.IDEMPOTENT_METHODS
+
+    def should_retry(self, method, attempt, status=None):
+        """ Tell if a request should be retried.
+
+        Args:
+            method (str): Request method
+            attempt (int): Number of retries already made
+
+        Kwargs:
+            status (int): Response status code, or None if the request failed without a response
+
+        Returns:
+            bool. Success
+        """
+        if attempt >= self.max_retries or method.upper() not in self.methods:
+            return False
+        return status is None or status in self.statuses
+
+    def get_delay(self, attempt, retry_after=None):
+        """ Get how long to wait before retrying.
+
+        Args:
+            attempt (int): Number of retries already made
+
+        Kwargs:
+            retry_after (str): Value of the Retry-After header, if any
+
+        Returns:
+            float. Seconds
+        """
+        delay = self.parse_retry_after(retry_after)
+        if delay is not None:
+            return min(delay, self.max_backoff)
+
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    @staticmethod
+    def parse_retry_after(value):
+        """ Parses a Retry-After header, given either in seconds or as an HTTP date.
+
+        Args:
+            value (str): Header value
+
+        Returns:
+            float. Seconds to wait, or None if value is not valid
+        """
+        if not value:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        date = email.utils.parsedate_tz(value)
+        if not date:
+            return None
+        return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+class TokenBucket(object):
+    """ Client side rate limiter shared by all threads using a connection """
+
+    def __init__(self, rate, burst=None):
+        """ Initialize.
+
+        Args:
+            rate (float): Requests per second
+
+        Kwargs:
+            burst (int): Maximum requests allowed in a burst (defaults to rate)
+        """
+        assert rate > 0, 'A rate greater than 0 is needed'
+        self._rate = float(rate)
+        self._capacity = float(burst or max(1, rate))
+        self._tokens = self._capacity
+        self._updated = time.time()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Take a token, waiting for one to be available.
+
+        Returns:
+            float. Seconds waited
+        """
+        waited = 0
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    def try_acquire(self):
+        """ Take a token if one is available, without waiting.
+
+        Returns:
+            float. 0 if a token was taken, otherwise seconds to wait before trying again
+        """
+        self._lock.acquire()
+        try:
+            now = time.time()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if now >= self._blocked_until and self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return max(self._blocked_until - now, (1 - self._tokens) / self._rate)
+        finally:
+            self._lock.release()
+
+    def block(self, seconds):
+        """ Stop handing out tokens for a while, e.g. when the server asks us to slow down.
+
+        Args:
+            seconds (float): Seconds
+        """
+        self._lock.acquire()
+        try:
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+        finally:
+            self._lock.release()
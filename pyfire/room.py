@@ -4,22 +4,26 @@ from threading import Thread
 
 from .connection import Connection
 from .entity import CampfireEntity
-from .message import Message
-from .stream import Stream
-from .upload import Upload
+from .message import BaseMessage, Message
 
 class Room(CampfireEntity):
     """ Campfire room """
     
-    def __init__(self, campfire, id):
+    def __init__(self, campfire, id, data=None):
         """ Initialize.
 
         Args:
             campfire (:class:`Campfire`): Campfire instance
             password (str): Room ID
+
+        Kwargs:
+            data (dict): Room data, if already fetched
         """
         super(Room, self).__init__(campfire)
-        self._load(id)
+        if data:
+            self.set_data(data, ["created_at", "updated_at"])
+        else:
+            self._load(id)
 
     def _load(self, id=None):
         self.set_data(
@@ -27,18 +31,33 @@ class Room(CampfireEntity):
             ["created_at", "updated_at"]
         )
 
-    def get_stream(self, error_callback=None, live=True):
+    def get_deferred(self):
+        """ Get a non blocking interface to this room.
+
+        Returns:
+            :class:`DeferredRoom`. Room whose operations return deferreds
+        """
+        from .deferred import DeferredRoom
+        return DeferredRoom(self)
+
+    def get_stream(self, error_callback=None, live=True, prefetch=False, transport=False):
         """ Get room stream to listen for messages.
 
         Kwargs:
             error_callback (func): Callback to call when an error occurred (parameters: exception)
             live (bool): If True, issue a live stream, otherwise an offline stream
+            prefetch (bool): If True, fetch the user, room and upload of each message in the background
+            transport (bool or dict): If True, send raw messages from the streaming process through a
+                                      :class:`PipeTransport` (if a dict, options for the transport)
 
         Returns:
             :class:`Stream`. Stream
         """
+        # Streaming needs twisted and multiprocessing, only loaded when used
+        from .stream import Stream
+
         self.join()
-        return Stream(self, error_callback=error_callback, live=live)
+        return Stream(self, error_callback=error_callback, live=live, prefetch=prefetch, transport=transport)
 
     def get_uploads(self):
         """ Get list of recent uploads.
@@ -86,12 +105,14 @@ class Room(CampfireEntity):
         """
         return self._connection.post("room/%s/lock" % self.id)["success"]
 
-    def recent(self, message_id=None, limit=None):
+    def recent(self, message_id=None, limit=None, as_batch=False):
         """ Recent messages.
 
         Kwargs:
             message_id (int): If specified, return messages since the specified message ID
             limit (int): If specified, limit the number of messages
+            as_batch (bool or dict): If True, return a :class:`MessageBatch` instead. If a dict,
+                                     use these options for :class:`MessageBatch`
 
         Returns:
             array. Messages
@@ -101,10 +122,31 @@ class Room(CampfireEntity):
             parameters["since_message_id"] = message_id
         if limit:
             parameters["limit"] = limit
+        if as_batch:
+            return self._campfire.build_batch(
+                self._connection.iter_get("room/%s/recent" % self.id, key="messages", parameters=parameters),
+                as_batch
+            )
         messages = self._connection.get("room/%s/recent" % self.id, key="messages", parameters=parameters)
-        if messages:
-            messages = [Message(self._campfire, message) for message in messages]
-        return messages
+        return self._campfire.build_messages(messages)
+
+    def iter_recent(self, message_id=None, limit=None):
+        """ Recent messages, decoded one at a time as they arrive.
+
+        Kwargs:
+            message_id (int): If specified, return messages since the specified message ID
+            limit (int): If specified, limit the number of messages
+
+        Returns:
+            generator. Messages
+        """
+        parameters = {}
+        if message_id:
+            parameters["since_message_id"] = message_id
+        if limit:
+            parameters["limit"] = limit
+        for message in self._connection.iter_get("room/%s/recent" % self.id, key="messages", parameters=parameters):
+            yield self._campfire.create_message(message)
 
     def set_name(self, name):
         """ Set the room name.
@@ -120,6 +162,7 @@ class Room(CampfireEntity):
 
         result = self._connection.put("room/%s" % self.id, {"room": {"name": name}})
         if result["success"]:
+            self._campfire.get_room_index().rename(self.id, name)
             self._load()
         return result["success"]
 
@@ -150,7 +193,7 @@ class Room(CampfireEntity):
             bool. Success
         """
         campfire = self.get_campfire()
-        if not isinstance(message, Message):
+        if not isinstance(message, BaseMessage):
             message = Message(campfire, message)
 
         result = self._connection.post(
@@ -161,14 +204,16 @@ class Room(CampfireEntity):
         )
 
         if result["success"]:
-            return Message(campfire, result["data"])
+            return campfire.create_message(result["data"])
         return result["success"]
 
-    def transcript(self, for_date=None):
+    def transcript(self, for_date=None, as_batch=False):
         """ Recent messages.
 
         Kwargs:
             for_date (date): If specified, get the transcript for this specific date
+            as_batch (bool or dict): If True, return a :class:`MessageBatch` instead. If a dict,
+                                     use these options for :class:`MessageBatch`
 
         Returns:
             array. Messages
@@ -176,10 +221,26 @@ class Room(CampfireEntity):
         url = "room/%s/transcript" % self.id
         if for_date:
             url = "%s/%d/%d/%d" % (url, for_date.year, for_date.month, for_date.day)
+        if as_batch:
+            return self._campfire.build_batch(self._connection.iter_get(url, key="messages"), as_batch)
         messages = self._connection.get(url, key="messages")
-        if messages:
-            messages = [Message(self._campfire, message) for message in messages]
-        return messages
+        return self._campfire.build_messages(messages)
+
+    def iter_transcript(self, for_date=None):
+        """ Transcript messages, decoded one at a time as they arrive, so large
+        transcripts are never held in memory at once.
+
+        Kwargs:
+            for_date (date): If specified, get the transcript for this specific date
+
+        Returns:
+            generator. Messages
+        """
+        url = "room/%s/transcript" % self.id
+        if for_date:
+            url = "%s/%d/%d/%d" % (url, for_date.year, for_date.month, for_date.day)
+        for message in self._connection.iter_get(url, key="messages"):
+            yield self._campfire.create_message(message)
 
     def unlock(self):
         """ Unlock room.
@@ -204,6 +265,8 @@ class Room(CampfireEntity):
         Returns:
             :class:`Upload`. Upload thread
         """
+        from .upload import Upload
+
         return Upload(
             self,
             {"upload": path},
@@ -0,0 +1,144 @@
+import errno
+import json
+import os
+import tempfile
+import threading
+import time
+
+class SessionCache(object):
+    """ On disk cache of API tokens and current user data, so short lived processes
+    don't have to authenticate with Campfire every time they start.
+
+    The cache file holds API tokens, so it is only readable by its owner. Passwords
+    are never stored.
+    """
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600):
+        """ Initialize.
+
+        Kwargs:
+            path (str): Cache file (defaults to ~/.pyfire/sessions.json)
+            ttl (int): Seconds a session is kept
+        """
+        self._path = path or os.path.join(os.path.expanduser("~"), ".pyfire", "sessions.json")
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    def get_path(self):
+        """ Get the cache file.
+
+        Returns:
+            str. Path
+        """
+        return self._path
+
+    @staticmethod
+    def key(base_url, username):
+        """ Get the key identifying a session.
+
+        Args:
+            base_url (str): Campfire URL
+            username (str): User
+
+        Returns:
+            str. Key
+        """
+        return "%s@%s" % (username, base_url)
+
+    def get(self, key):
+        """ Get a session, if it exists and has not expired.
+
+        Args:
+            key (str): Session key
+
+        Returns:
+            dict. Session, with keys: token, user (current user data), expires. None if there is none
+        """
+        self._lock.acquire()
+        try:
+            session = self._load().get(key)
+        finally:
+            self._lock.release()
+
+        if not session or session.get("expires", 0) <= time.time():
+            return None
+        return session
+
+    def set(self, key, token, user):
+        """ Store a session.
+
+        Args:
+            key (str): Session key
+            token (str): API token
+            user (dict): Current user data
+        """
+        self._lock.acquire()
+        try:
+            sessions = self._load()
+            now = time.time()
+            for name in [name for name in sessions if sessions[name].get("expires", 0) <= now]:
+                del sessions[name]
+            sessions[key] = {
+                "token": token,
+                "user": user,
+                "expires": now + self._ttl
+            }
+            self._save(sessions)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        """ Remove a session, e.g. when its token is no longer valid.
+
+        Args:
+            key (str): Session key
+        """
+        self._lock.acquire()
+        try:
+            sessions = self._load()
+            if key in sessions:
+                del sessions[key]
+                self._save(sessions)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """ Remove all sessions. """
+        self._lock.acquire()
+        try:
+            if os.path.exists(self._path):
+                os.remove(self._path)
+        finally:
+            self._lock.release()
+
+    def _load(self):
+        try:
+            with open(self._path) as handle:
+                data = json.load(handle)
+        except (IOError, OSError, ValueError):
+            return {}
+        return data.get("sessions", {}) if isinstance(data, dict) else {}
+
+    def _save(self, sessions):
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory, 0o700)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        # Written to a private temporary file and renamed, so other processes
+        # never see a partial file, and the file is never readable by others
+        handle, path = tempfile.mkstemp(dir=directory or None, prefix=".sessions")
+        try:
+            try:
+                os.write(handle, json.dumps({"sessions": sessions}))
+            finally:
+                os.close(handle)
+            os.chmod(path, 0o600)
+            os.rename(path, self._path)
+        except (IOError, OSError):
+            if os.path.exists(path):
+                os.remove(path)
+            raise
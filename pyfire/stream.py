@@ -1,5 +1,9 @@
+import collections
+import json
 import re
 import time
+import urllib2
+import urlparse
 
 from threading import Thread
 from multiprocessing import Process, Queue
@@ -10,13 +14,15 @@ from twisted.internet import protocol
 from twisted.internet import ssl
 from twisted.protocols import basic
 
-from .connection import Connection
-from .message import Message
+from . import chunked
+from . import compression
+from .connection import Connection, ConnectionError
+from .transport import PipeTransport
 
 class Stream(Thread):
     """ A live stream to a room in a separate thread """
 
-    def __init__(self, room, live=True, error_callback=None, pause=None, use_process=True):
+    def __init__(self, room, live=True, error_callback=None, pause=None, use_process=True, prefetch=False, transport=False):
         """ Initialize.
 
         Args:
@@ -25,9 +31,16 @@ class Stream(Thread):
         Kwargs:
             live (bool): If True, issue a live stream, otherwise an offline stream
             error_callback (func): A callback to call when an error occurs
-            pause (int): Pause in seconds between requests (if live==False), or pause
-                         between queue checks
+            pause (int): Pause in seconds between requests (if live==False). Messages are
+                         delivered as soon as they arrive, this is also the longest time spent
+                         waiting for them before checking that the streaming process is alive
             use_process (bool): If True, use a separate process to fetch the messages
+            prefetch (bool): If True, the user, room and upload of each message are fetched in
+                             the background, instead of when observers first access them
+            transport (bool or dict): If True, the separate process sends raw messages through a
+                                      :class:`PipeTransport`, and they are only parsed by this thread
+                                      (if there are observers.) If a dict, options for the transport
+                                      (max_depth, overflow)
 
         Raises:
             AssertionError
@@ -37,16 +50,24 @@ class Stream(Thread):
                 pause = 1
             assert pause > 0, 'A pause of at least 1 second is needed'
         elif pause is None:
-            pause = 0.25
+            pause = 1
 
         Thread.__init__(self)
 
         self._room = room
         self._live = live
         self._observers = []
+        self._batch_observers = []
+        self._stats = {"messages": 0, "decode_seconds": 0}
+        self._delivery = collections.deque(maxlen=1000)
+        self._queue = None
+        self._transport = None
+        self._transport_options = transport
+        self._dropped = 0
         self._error_callback = error_callback
         self._pause = pause
         self._use_process = use_process
+        self._prefetch = prefetch
         self._streaming = False
 
     def attach(self, observer):
@@ -77,17 +98,114 @@ class Stream(Thread):
             pass
         return self
 
-    def incoming(self, messages):
-        """ Called when incoming messages arrive.
+    def attach_batch(self, observer):
+        """ Attach an observer that gets all messages that arrived together at once.
+
+        Args:
+            observer (func): A function to be called when new messages arrive (parameters: messages,
+                             a list of :class:`Message`)
+
+        Returns:
+            :class:`Stream`. Current instance to allow chaining
+        """
+        if not observer in self._batch_observers:
+            self._batch_observers.append(observer)
+        return self
+
+    def detach_batch(self, observer):
+        """ Detach a batch observer.
+
+        Args:
+            observer (func): The observer function already attached
+
+        Returns:
+            :class:`Stream`. Current instance to allow chaining
+        """
+        try:
+            self._batch_observers.remove(observer)
+        except ValueError:
+            pass
+        return self
+
+    def get_stats(self):
+        """ Get statistics about the messages delivered to observers.
+
+        Returns:
+            dict. Stats, with keys: messages (messages decoded), decode_seconds (total time
+            spent building messages), decode_seconds_per_message, delivery_median and
+            delivery_p99 (seconds from the streaming process receiving messages to
+            observers getting them, over the last 1000 deliveries. None if unknown), queue_depth
+            (deliveries sent by the streaming process and not yet received. None if unknown),
+            dropped (messages dropped by the transport because it was full)
+        """
+        stats = dict(self._stats)
+        stats["queue_depth"] = None
+        stats["dropped"] = 0
+        transport = self._transport
+        queue = self._queue
+        if transport:
+            transport_stats = transport.get_stats()
+            stats["queue_depth"] = transport_stats["queue_depth"]
+            stats["dropped"] = transport_stats["dropped"]
+        elif queue:
+            try:
+                stats["queue_depth"] = queue.qsize()
+            except NotImplementedError:
+                # Not available on every platform (e.g: Mac OS X)
+                pass
+
+        stats["decode_seconds_per_message"] = stats["decode_seconds"] / stats["messages"] if stats["messages"] else 0
+        delivery = sorted(self._delivery)
+        stats["delivery_median"] = delivery[len(delivery) // 2] if delivery else None
+        stats["delivery_p99"] = delivery[min(len(delivery) - 1, int(len(delivery) * 0.99))] if delivery else None
+        return stats
+
+    def incoming(self, messages, received_at=None, parse=False, received_bytes=0):
+        """ Called when incoming messages arrive. Each message is built once, and
+        the same :class:`Message` is given to every observer.
 
         Args:
-            messages (tuple): Messages (each message is a dict)
+            messages (tuple): Messages (each message is a dict, or a JSON string if parse is True)
+
+        Kwargs:
+            received_at (float): When the streaming process got the messages (seconds since the epoch)
+            parse (bool): If True, messages are raw, and only parsed if there are observers
+            received_bytes (int): Bytes the streaming process read from the network since its last messages
         """
-        if self._observers:
-            campfire = self._room.get_campfire()
-            for message in messages:
-                for observer in self._observers:
-                    observer(Message(campfire, message))
+        metrics = self._room.get_campfire().get_connection().get_metrics()
+        if metrics:
+            metrics.increment("pyfire_stream_messages_total", {"room": self._room.id}, len(messages))
+            if received_bytes:
+                metrics.increment("pyfire_stream_bytes_received_total", {"room": self._room.id}, received_bytes)
+
+        if not self._observers and not self._batch_observers:
+            return
+
+        campfire = self._room.get_campfire()
+        started = time.time()
+        if parse:
+            messages = parse_lines(campfire.get_connection(), messages)
+        messages = [campfire.create_message(message) for message in messages]
+        if self._prefetch:
+            campfire.prefetch(messages)
+        elapsed = time.time() - started
+
+        self._stats["messages"] += len(messages)
+        self._stats["decode_seconds"] += elapsed
+        if metrics:
+            metrics.increment("pyfire_stream_decode_seconds_total", {"room": self._room.id}, elapsed)
+
+        if received_at is not None:
+            delivery = max(0, time.time() - received_at)
+            self._delivery.append(delivery)
+            if metrics:
+                metrics.observe("pyfire_stream_delivery_seconds", delivery, {"room": self._room.id})
+
+        for message in messages:
+            for observer in self._observers:
+                observer(message)
+        for observer in self._batch_observers:
+            observer(messages)
 
     def is_streaming(self):
         """ Tell if streaming is in progress.
@@ -106,6 +224,18 @@ class Stream(Thread):
             :class:`Stream`. Current instance to allow chaining
         """
         self._abort = True
+
+        # Wake up the thread if it is waiting for messages
+        transport = self._transport
+        queue = self._queue
+        if transport:
+            transport.wake()
+        elif queue:
+            try:
+                queue.put_nowait(None)
+            except (AssertionError, IOError, OSError, ValueError):
+                # Closed by the thread while stopping
+                pass
         return self
 
     def run(self):
@@ -130,12 +260,21 @@ class Stream(Thread):
         if not self._use_process:
             process.set_callback(self.incoming)
 
+        queue = None
+        transport = None
         if self._use_process:
-            queue = Queue()
-            process.set_queue(queue)
+            if self._transport_options:
+                options = self._transport_options
+                transport = PipeTransport(**(options if isinstance(options, dict) else {}))
+                process.set_transport(transport)
+            else:
+                queue = Queue()
+                process.set_queue(queue)
             process.start()
             if not process.is_alive():
                 return
+            self._queue = queue
+            self._transport = transport
 
         self._streaming = True
 
@@ -145,18 +284,26 @@ class Stream(Thread):
                     self._abort = True
                     break
 
-                try:
-                    incoming = queue.get_nowait()
-                    if isinstance(incoming, list):
-                        self.incoming(incoming)
-                    elif isinstance(incoming, Exception):
-                        self._abort = True
-                        if self._error_callback:
-                            self._error_callback(incoming, self._room)
-
-                except Empty:
-                    time.sleep(self._pause)
-                    pass
+                # Blocks until messages arrive, stop() is called, or the pause passes
+                if transport:
+                    incoming = transport.receive(self._pause)
+                    self._count_dropped(transport)
+                else:
+                    try:
+                        incoming = queue.get(timeout=self._pause)
+                    except Empty:
+                        continue
+
+                if isinstance(incoming, tuple):
+                    if transport:
+                        received_bytes = transport.take_received_bytes()
+                    else:
+                        received_bytes = incoming[2]
+                    self.incoming(incoming[1], received_at=incoming[0], parse=transport is not None, received_bytes=received_bytes)
+                elif isinstance(incoming, Exception):
+                    self._abort = True
+                    if self._error_callback:
+                        self._error_callback(incoming, self._room)
             else:
                 process.fetch()
                 time.sleep(self._pause)
@@ -166,11 +313,29 @@ class Stream(Thread):
             self._error_callback(Exception("Streaming process was killed"), self._room)
 
         if self._use_process:
-            queue.close()
+            self._queue = None
+            self._transport = None
+            if queue:
+                queue.close()
             if process.is_alive():
                 process.stop()
                 process.terminate()
             process.join()
+            if transport:
+                transport.close()
+
+    def _count_dropped(self, transport):
+        """ Report messages dropped by the transport since last checked.
+
+        Args:
+            transport (:class:`PipeTransport`): Transport
+        """
+        dropped = transport.get_stats()["dropped"]
+        if dropped > self._dropped:
+            metrics = self._room.get_campfire().get_connection().get_metrics()
+            if metrics:
+                metrics.increment("pyfire_stream_dropped_total", {"room": self._room.id}, dropped - self._dropped)
+            self._dropped = dropped
 
 class StreamProcess(Process):
     """ Separate process implementation to get messages """
@@ -190,6 +355,7 @@ class StreamProcess(Process):
         self._room_id = room_id
         self._callback = None
         self._queue = None
+        self._transport = None
         self._connection = Connection.create_from_settings(settings)
         self._last_message_id = None
 
@@ -217,6 +383,14 @@ class StreamProcess(Process):
         """
         self._queue = queue
 
+    def set_transport(self, transport):
+        """ Set the transport to send raw messages to another process, instead of a queue.
+
+        Args:
+            transport (:class:`PipeTransport`): Transport
+        """
+        self._transport = transport
+
     def run(self):
         """ Called by the process, it runs it.
 
@@ -225,7 +399,7 @@ class StreamProcess(Process):
 
         To stop, call terminate()
         """
-        if not self._queue:
+        if not self._queue and not self._transport:
             raise Exception("No queue available to send messages")
 
         while True:
@@ -239,12 +413,15 @@ class StreamProcess(Process):
                 messages = self._connection.get("room/%s/recent" % self._room_id, key="messages", parameters={
                     "limit": 1
                 })
+                if not messages:
+                    return
                 self._last_message_id = messages[-1]["id"]
 
             messages = self._connection.get("room/%s/recent" % self._room_id, key="messages", parameters={
                 "since_message_id": self._last_message_id
             })
-        except:
+        except (ConnectionError, urllib2.HTTPError, ValueError):
+            # Transient failures were already retried by the connection, try again on next poll
             messages = []
 
         if messages:
@@ -255,19 +432,38 @@ class StreamProcess(Process):
     def stop(self):
         pass
 
-    def received(self, messages):
+    def received(self, messages, received_bytes=0):
         """ Called when new messages arrive.
 
         Args:
             messages (tuple): Messages
+
+        Kwargs:
+            received_bytes (int): Bytes read from the network since the last messages (live streams only)
         """
         if messages:
-            if self._queue:
-                self._queue.put_nowait(messages)
+            if self._transport:
+                self._transport.send([json.dumps(message) for message in messages], time.time(), received_bytes)
+            elif self._queue:
+                self._queue.put_nowait((time.time(), messages, received_bytes))
 
             if self._callback:
                 self._callback(messages)
 
+    def received_lines(self, lines, received_bytes=0):
+        """ Called when new raw messages arrive.
+
+        Args:
+            lines (list): Messages (each message is a JSON string)
+
+        Kwargs:
+            received_bytes (int): Bytes read from the network since the last messages
+        """
+        if self._transport:
+            self._transport.send(lines, time.time(), received_bytes)
+        else:
+            self.received(parse_lines(self._connection, lines), received_bytes)
+
 class LiveStreamProcess(StreamProcess):
     """ Separate process implementation to get messages """
 
@@ -306,11 +502,13 @@ class LiveStreamProcess(StreamProcess):
 
         To stop, call terminate()
         """
-        if not self._queue:
+        if not self._queue and not self._transport:
             raise Exception("No queue available to send messages")
 
         factory = LiveStreamFactory(self)
-        self._reactor.connectSSL("streaming.campfirenow.com", 443, factory, ssl.ClientContextFactory())
+        if self._transport:
+            factory.protocol = RawLiveStreamProtocol
+        connect(self._reactor, self._connection, factory)
         self._reactor.run()
 
     def stop(self):
@@ -333,93 +531,135 @@ class LiveStreamProcess(StreamProcess):
         Args:
             reason (Exception): Exception
         """
-        self._queue.put(reason)
+        if self._transport:
+            self._transport.send_error(reason)
+        else:
+            self._queue.put(reason)
 
 class LiveStreamProtocol(basic.LineReceiver):
     """ Protocol for live stream """
 
     delimiter = "\r\n"
 
+    # If True, messages are given to the stream without being parsed
+    raw = False
+
     def __init__(self):
         """ Constructor. """
-        self._in_header = True
         self._headers = []
-        self._len_expected = None
-        self._buffer = ""
+        self._decoder = None
+        self._decompressor = None
+        self._lines = chunked.LineBuffer("\r")
+        self._received_bytes = 0
 
     def connectionMade(self):
         """ Called when a connection is made, and used to send out headers """
 
+        connection = self.factory.get_stream().get_connection()
+        url = urlparse.urlsplit(connection.get_setting("stream_url"))
+
         headers = [
-            "GET %s HTTP/1.1" % ("/room/%s/live.json" % self.factory.get_stream().get_room_id())
+            "GET %s HTTP/1.1" % ("%s/room/%s/live.json" % (url.path.rstrip("/"), self.factory.get_stream().get_room_id()))
         ]
 
-        connection_headers = self.factory.get_stream().get_connection().get_headers()
+        connection_headers = connection.get_headers()
         for header in connection_headers:
             headers.append("%s: %s" % (header, connection_headers[header]))
 
-        headers.append("Host: streaming.campfirenow.com")
+        if connection.get_setting("compress"):
+            headers.append("Accept-Encoding: %s" % compression.ACCEPT_ENCODING)
+
+        headers.append("Host: %s" % url.netloc)
 
         self.transport.write("\r\n".join(headers) + "\r\n\r\n")
         self.factory.get_stream().set_protocol(self)
 
+    def dataReceived(self, data):
+        """ Callback issued by twisted when data arrives. Received bytes are given
+        to the stream with the next messages, since metrics are recorded by the
+        process that gets them.
+
+        Args:
+            data (str): Incoming data
+        """
+        self._received_bytes += len(data)
+        basic.LineReceiver.dataReceived(self, data)
+
     def lineReceived(self, line):
-        """ Callback issued by twisted when new line arrives.
+        """ Callback issued by twisted when new line arrives. Only used for headers,
+        the body is received in raw mode.
 
         Args:
             line (str): Incoming line
         """
-        while self._in_header:
-            if line:
-                self._headers.append(line)
-            else:
-                http, status, message = self._headers[0].split(" ", 2)
-                status = int(status)
-                if status == 200:
-                    self.factory.get_stream().connected()
-                else:
-                    self.factory.continueTrying = 0
-                    self.transport.loseConnection()
-                    self.factory.get_stream().disconnected(RuntimeError(status, message))
-                    return
-
-                self._in_header = False
-            break
-        else:
-            try:
-                self._len_expected = int(line, 16)
-                self.setRawMode()
-            except:
-                pass
+        if line:
+            self._headers.append(line)
+            return
+
+        http, status, message = self._headers[0].split(" ", 2)
+        status = int(status)
+        if status != 200:
+            self.factory.continueTrying = 0
+            self.transport.loseConnection()
+            self.factory.get_stream().disconnected(RuntimeError(status, message))
+            return
+
+        for header in self._headers[1:]:
+            name, value = header.split(":", 1)
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == "content-encoding" and value != "identity":
+                self._decompressor = compression.Decompressor(value)
+            elif name == "transfer-encoding" and value == "chunked":
+                self._decoder = chunked.ChunkedDecoder()
+
+        self.factory.get_stream().connected()
+        self.setRawMode()
 
     def rawDataReceived(self, data):
-        """ Process data.
+        """ Process data. Every message completed by this data is parsed (unless
+        the protocol is raw), and they are all given to the stream at once.
 
         Args:
             data (str): Incoming data
         """
-        if self._len_expected is not None:
-            data, extra = data[:self._len_expected], data[self._len_expected:]
-            self._len_expected -= len(data)
-        else:
-            extra = ""
-
-        self._buffer += data
-        if self._len_expected == 0:
-            data = self._buffer.strip()
-            if data:
-                lines = data.split("\r")
-                for line in lines:
-                    try:
-                        message = self.factory.get_stream().get_connection().parse(line)
-                        if message:
-                            self.factory.get_stream().received([message])
-                    except ValueError:
-                        pass
+        if self._decoder:
+            data = self._decoder.feed(data)
+        if self._decompressor and data:
+            data = self._decompressor.decompress(data)
+
+        connection = self.factory.get_stream().get_connection()
+        lines = self._lines.feed(data)
+        messages = [] if self.raw else parse_lines(connection, lines)
+
+        # Messages are delimited by a carriage return, but one not followed by
+        # it yet is delivered right away if it is complete. Telling requires
+        # parsing it, which raw protocols leave to the consumer, so they wait
+        pending = "" if self.raw else self._lines.get_pending().strip()
+        if pending.endswith("}"):
+            try:
+                message = connection.parse(pending)
+            except ValueError:
+                message = None
+            if message:
+                messages.append(message)
+                self._lines.clear()
+
+        if self.raw:
+            if lines:
+                self.factory.get_stream().received_lines(lines, self._take_received_bytes())
+        elif messages:
+            self.factory.get_stream().received(messages, self._take_received_bytes())
 
-            self._buffer = ""
-            self._len_expected = None
-            self.setLineMode(extra)
+    def _take_received_bytes(self):
+        received_bytes, self._received_bytes = self._received_bytes, 0
+        return received_bytes
+
+class RawLiveStreamProtocol(LiveStreamProtocol):
+    """ Protocol for live stream that gives the stream raw messages, to be
+    parsed by whoever gets them from a :class:`PipeTransport` """
+
+    raw = True
 
 class LiveStreamFactory(protocol.ReconnectingClientFactory):
     maxDelay = 120
@@ -440,3 +680,37 @@ class LiveStreamFactory(protocol.ReconnectingClientFactory):
             stream (:class:`LiveStreamProcess`): process receiving messages
         """
         return self._stream
+
+def connect(reactor, connection, factory):
+    """ Connect a live stream factory to the streaming server.
+
+    Args:
+        reactor (reactor): Twisted reactor
+        connection (:class:`Connection`): Connection, whose stream_url setting tells where to connect
+        factory (:class:`LiveStreamFactory`): Factory
+    """
+    url = urlparse.urlsplit(connection.get_setting("stream_url"))
+    if url.scheme == "https":
+        reactor.connectSSL(url.hostname, url.port or 443, factory, ssl.ClientContextFactory())
+    else:
+        reactor.connectTCP(url.hostname, url.port or 80, factory)
+
+def parse_lines(connection, lines):
+    """ Parse raw messages, skipping invalid ones.
+
+    Args:
+        connection (:class:`Connection`): Connection
+        lines (list): Messages (each message is a JSON string)
+
+    Returns:
+        list. Messages (each message is a dict)
+    """
+    messages = []
+    for line in lines:
+        try:
+            message = connection.parse(line)
+        except ValueError:
+            continue
+        if message:
+            messages.append(message)
+    return messages
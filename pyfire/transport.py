@@ -0,0 +1,183 @@
+import pickle
+import struct
+
+from multiprocessing import BoundedSemaphore, Lock, Pipe, Value
+
+class PipeTransport(object):
+    """ Carries live stream messages from the streaming process to the stream
+    thread, as an alternative to a :class:`multiprocessing.Queue` of parsed messages.
+
+    The streaming process sends the raw JSON line of every message, with all
+    lines received together written as one frame, and they are only parsed
+    by the stream thread (nothing is pickled). At most max_depth frames can be
+    waiting in the pipe: when it is full, the streaming process waits (which
+    stops it from reading the network) or, if overflow is "drop", the
+    messages are dropped and counted.
+    """
+
+    OVERFLOW_BLOCK = "block"
+    OVERFLOW_DROP = "drop"
+
+    _FRAME_MESSAGES = "M"
+    _FRAME_ERROR = "E"
+    _FRAME_WAKE = "W"
+    _TIME = struct.Struct("!d")
+
+    def __init__(self, max_depth=1000, overflow="block"):
+        """ Initialize. Must be created before the streaming process is started.
+
+        Kwargs:
+            max_depth (int): Maximum number of frames waiting to be received
+            overflow (str): What to do when max_depth frames are waiting (one of: block, drop)
+
+        Raises:
+            AssertionError
+        """
+        assert max_depth > 0, "A depth of at least 1 frame is needed"
+        assert overflow in (self.OVERFLOW_BLOCK, self.OVERFLOW_DROP), "Invalid overflow %r" % overflow
+
+        self._max_depth = max_depth
+        self._overflow = overflow
+        self._reader, self._writer = Pipe(duplex=False)
+        self._write_lock = Lock()
+        self._space = BoundedSemaphore(max_depth)
+        self._depth = Value("i", 0)
+        self._dropped = Value("i", 0)
+        self._received_bytes = Value("l", 0)
+
+    def get_stats(self):
+        """ Get transport statistics.
+
+        Returns:
+            dict. Stats, with keys: queue_depth (frames waiting to be received), max_depth,
+            dropped (messages dropped because the pipe was full)
+        """
+        return {
+            "queue_depth": self._depth.value,
+            "max_depth": self._max_depth,
+            "dropped": self._dropped.value
+        }
+
+    def send(self, lines, received_at, received_bytes=0):
+        """ Send messages. Called by the streaming process.
+
+        Args:
+            lines (list): Raw messages (each message is a JSON string with no carriage returns)
+            received_at (float): When the messages were received (seconds since the epoch)
+
+        Kwargs:
+            received_bytes (int): Bytes read from the network for these messages (counted
+                                  even if they are dropped, see :meth:`take_received_bytes`)
+
+        Returns:
+            bool. Success (False if the messages were dropped)
+        """
+        if received_bytes:
+            self._received_bytes.get_lock().acquire()
+            try:
+                self._received_bytes.value += received_bytes
+            finally:
+                self._received_bytes.get_lock().release()
+
+        if not lines:
+            return True
+
+        if not self._space.acquire(self._overflow == self.OVERFLOW_BLOCK):
+            self._dropped.get_lock().acquire()
+            try:
+                self._dropped.value += len(lines)
+            finally:
+                self._dropped.get_lock().release()
+            return False
+
+        self._depth.get_lock().acquire()
+        try:
+            self._depth.value += 1
+        finally:
+            self._depth.get_lock().release()
+
+        self._write(self._FRAME_MESSAGES + self._TIME.pack(received_at) + "\r".join(lines))
+        return True
+
+    def take_received_bytes(self):
+        """ Get the bytes counted by send() since last called, and reset the count.
+        Called by the stream thread.
+
+        Returns:
+            int. Bytes
+        """
+        self._received_bytes.get_lock().acquire()
+        try:
+            received_bytes, self._received_bytes.value = self._received_bytes.value, 0
+        finally:
+            self._received_bytes.get_lock().release()
+        return received_bytes
+
+    def send_error(self, error):
+        """ Send an error that stopped streaming. Called by the streaming process.
+
+        Args:
+            error (Exception): Exception
+        """
+        self._write(self._FRAME_ERROR + pickle.dumps(error, pickle.HIGHEST_PROTOCOL))
+
+    def wake(self):
+        """ Make a pending receive() return right away. Called by the stream thread
+        (or any other thread of its process.)
+        """
+        # Gives up if a dead streaming process left the lock taken, receive() returns on its timeout then
+        if not self._write_lock.acquire(True, 1):
+            return
+        try:
+            self._writer.send_bytes(self._FRAME_WAKE)
+        except (IOError, OSError, ValueError):
+            # Closed by the thread while stopping
+            pass
+        finally:
+            self._write_lock.release()
+
+    def receive(self, timeout=None):
+        """ Wait for messages or an error. Called by the stream thread.
+
+        Kwargs:
+            timeout (float): Longest time in seconds to wait (None to wait until something arrives)
+
+        Returns:
+            tuple (when messages were received, list of raw messages), Exception if
+            streaming failed, or None if nothing arrived or wake() was called
+        """
+        if not self._reader.poll(timeout):
+            return None
+
+        frame = self._reader.recv_bytes()
+        kind = frame[:1]
+        if kind == self._FRAME_MESSAGES:
+            self._depth.get_lock().acquire()
+            try:
+                self._depth.value -= 1
+            finally:
+                self._depth.get_lock().release()
+            self._space.release()
+
+            size = self._TIME.size
+            return self._TIME.unpack(frame[1:size + 1])[0], frame[size + 1:].split("\r")
+        elif kind == self._FRAME_ERROR:
+            return pickle.loads(frame[1:])
+        return None
+
+    def close(self):
+        """ Close the pipe. """
+        self._reader.close()
+        self._writer.close()
+
+    def _write(self, frame):
+        """ Write a frame, so frames written by different processes never interleave.
+
+        Args:
+            frame (str): Frame
+        """
+        self._write_lock.acquire()
+        try:
+            self._writer.send_bytes(frame)
+        finally:
+            self._write_lock.release()
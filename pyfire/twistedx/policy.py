@@ -0,0 +1,36 @@
+from twisted.web import client
+from twisted.web import iweb
+from zope.interface import implements
+
+class CachingPolicyForHTTPS:
+    """ A TLS policy that builds the client TLS options for each host only once.
+
+    Building them involves creating a new OpenSSL context (and loading the
+    trusted certificates), which is expensive to do for every connection.
+    """
+
+    implements(iweb.IPolicyForHTTPS)
+
+    def __init__(self, policy=None):
+        """ Initialize.
+
+        Kwargs:
+            policy: Policy whose TLS options are cached (defaults to :class:`twisted.web.client.BrowserLikePolicyForHTTPS`)
+        """
+        self._policy = policy or client.BrowserLikePolicyForHTTPS()
+        self._creators = {}
+
+    def creatorForNetloc(self, hostname, port):
+        """ Get the TLS options for a host.
+
+        Args:
+            hostname (str): Host name
+            port (int): Port
+
+        Returns:
+            TLS options (provider of :class:`twisted.internet.interfaces.IOpenSSLClientConnectionCreator`)
+        """
+        key = (hostname, port)
+        if key not in self._creators:
+            self._creators[key] = self._policy.creatorForNetloc(hostname, port)
+        return self._creators[key]
@@ -1,5 +1,6 @@
 from twisted.internet import protocol
 from twisted.web import client
+from twisted.web import http
 
 class StringReceiver(protocol.Protocol):
     buffer = ""
@@ -11,7 +12,7 @@ class StringReceiver(protocol.Protocol):
         self.buffer += data
 
     def connectionLost(self, reason):
-        if self._deferred and reason.check(client.ResponseDone):
+        if self._deferred and reason.check(client.ResponseDone, http.PotentialDataLoss):
             self._deferred.callback(self.buffer)
-        else:
-            self._deferred.errback(self.buffer)
+        elif self._deferred:
+            self._deferred.errback(reason)
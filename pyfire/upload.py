@@ -29,6 +29,7 @@ class Upload(Thread):
         Thread.__init__(self)
 
         self._connection_settings = room.get_campfire().get_connection().get_settings()
+        self._metrics = room.get_campfire().get_connection().get_metrics()
         self._room = room
         self._files = files
         self._data = data
@@ -74,6 +75,8 @@ class Upload(Thread):
             return
 
         self._uploading = True
+        started = time.time()
+        sent = 0
 
         done = False
         while not self._abort and not done:
@@ -100,17 +103,25 @@ class Upload(Thread):
                 time.sleep(0.5)
 
         self._uploading = False
+        if self._metrics:
+            self._metrics.increment("pyfire_uploads_total", {"status": "finished" if done else "failed"})
+            self._metrics.increment("pyfire_upload_bytes_sent_total", value=sent)
+            self._metrics.observe("pyfire_upload_duration_seconds", time.time() - started)
+
         if self._abort and not process.is_alive() and self._error_callback:
             self._error_callback(Exception("Upload process was killed"), self._room)
 
         queue.close()
+        if done:
+            # The process finishes by itself once the response arrives
+            process.join(5)
         if process.is_alive():
-            queue.close()
             process.terminate()
         process.join()
 
 class UploadProcess(Process):
-    """ Separate process implementation to upload files """
+    """ Separate process implementation to upload files. Each upload uses its own
+    connection (and twisted reactor), so connections are not reused across uploads. """
     
     def __init__(self, settings, room, queue, files):
         """ Initialize.
@@ -195,7 +206,7 @@ class UploadProcess(Process):
         self._reactor.stop()
         self._queue.put(None)
 
-    def _response_error(self, data):
+    def _response_error(self, error):
         self._reactor.stop()
         self._queue.put_nowait(error)
 
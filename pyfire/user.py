@@ -3,7 +3,7 @@ from .entity import CampfireEntity
 class User(CampfireEntity):
     """ Campfire user """
     
-    def __init__(self, campfire, id, current=False):
+    def __init__(self, campfire, id, current=False, data=None):
         """ Initialize.
 
         Args:
@@ -12,7 +12,14 @@ class User(CampfireEntity):
 
         Kwargs:
             current (bool): Wether user is current user, or not
+            data (dict): User data, if already fetched
         """
         super(User, self).__init__(campfire)
-        self.set_data(self._connection.get("users/%s" % id, key="user"))
+        if data:
+            self.set_data(data)
+        else:
+            self._load(id)
         self.current = current
+
+    def _load(self, id=None):
+        self.set_data(self._connection.get("users/%s" % (id or self.id), key="user"))
@@ -1,4 +1,34 @@
-import unittest, sys, os
+import unittest, sys, os, copy, datetime, httplib, json, shutil, socket, stat, StringIO, tempfile, threading, time, urllib2, urlparse, zlib
+
+from twisted.internet import defer, error, task
+from twisted.python import failure
+from twisted.test import proto_helpers
+from twisted.web import client, http_headers
+
+from benchmarks import corpus
+from benchmarks import micro
+from benchmarks import startup
+from benchmarks.fakeserver import FakeCampfireServer
+from pyfire import chunked
+from pyfire import decoder
+import pyfire.batch
+import pyfire.connection
+from pyfire.batch import MessageBatch
+from pyfire import metrics
+from pyfire.campfire import Campfire, RoomNotFoundException
+from pyfire.connection import AuthenticationError, Connection, ConnectionError
+from pyfire.deferred import DeferredRoom
+from pyfire.message import CompactMessage, Message
+from pyfire.stream import LiveStreamProtocol, RawLiveStreamProtocol, Stream
+from pyfire.transport import PipeTransport
+from pyfire.cache import ResponseCache
+from pyfire.executor import BatchExecutor, TimeoutError
+from pyfire.identity import IdentityMap
+from pyfire.index import RoomIndex
+from pyfire.pool import HTTPConnectionPool
+from pyfire.retry import RetryPolicy, TokenBucket
+from pyfire.session import SessionCache
+from pyfire.twistedx.policy import CachingPolicyForHTTPS
 
 class TestPyFire(unittest.TestCase):
     """
@@ -12,3 +42,1282 @@ class TestPyFire(unittest.TestCase):
 
     def testSanity(self):
         self.assertEqual(0, 0)
+
+class TestBatchExecutor(unittest.TestCase):
+    """
+
+    A test class for the batch executor
+
+    """
+
+    def testResultsInOrder(self):
+        def func(item):
+            time.sleep(0.01 * (5 - item))
+            if item == 3:
+                raise ValueError(item)
+            return item * 2
+
+        results = BatchExecutor(concurrency=3).map(func, range(5))
+        self.assertEqual([result["data"] for result in results], [0, 2, 4, None, 8])
+        self.assertEqual([result["success"] for result in results], [True, True, True, False, True])
+        self.assertTrue(isinstance(results[3]["error"], ValueError))
+
+    def testTimeout(self):
+        results = BatchExecutor(concurrency=2, timeout=0.05).map(time.sleep, [0, 1])
+        self.assertTrue(results[0]["success"])
+        self.assertTrue(isinstance(results[1]["error"], TimeoutError))
+
+class TestResponseCache(unittest.TestCase):
+    """
+
+    A test class for the response cache
+
+    """
+
+    def testExpiration(self):
+        cache = ResponseCache(ttls=[("^rooms$", 60), ("^users/", 0)])
+        self.assertEqual(cache.get_ttl("room/1/recent"), None)
+
+        cache.set(cache.key("rooms"), "[]")
+        cache.set(cache.key("users/1"), "{}", etag="v1")
+        self.assertTrue(cache.is_fresh(cache.get(cache.key("rooms"))))
+        self.assertFalse(cache.is_fresh(cache.get(cache.key("users/1"))))
+        self.assertEqual(cache.get(cache.key("users/1"))["etag"], "v1")
+
+    def testLeastRecentlyUsedEviction(self):
+        cache = ResponseCache(ttls=[("^users/", 60)], max_size=40)
+        for id in range(3):
+            cache.set(cache.key("users/%d" % id), "x" * 5)
+        cache.get(cache.key("users/0"))
+        cache.set(cache.key("users/3"), "x" * 5)
+
+        self.assertNotEqual(cache.get(cache.key("users/0")), None)
+        self.assertEqual(cache.get(cache.key("users/1")), None)
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+    def testInvalidation(self):
+        cache = ResponseCache(ttls=[("^room", 60)])
+        for url in ["rooms", "room/1", "room/1/uploads", "room/12"]:
+            cache.set(cache.key(url), "{}")
+        cache.invalidate("room/1/join")
+
+        self.assertEqual(cache.get(cache.key("rooms")), None)
+        self.assertEqual(cache.get(cache.key("room/1")), None)
+        self.assertEqual(cache.get(cache.key("room/1/uploads")), None)
+        self.assertNotEqual(cache.get(cache.key("room/12")), None)
+
+class TestRetryPolicy(unittest.TestCase):
+    """
+
+    A test class for the retry policy and rate limiter
+
+    """
+
+    def testShouldRetry(self):
+        policy = RetryPolicy(max_retries=2)
+        self.assertTrue(policy.should_retry("GET", 0, 503))
+        self.assertTrue(policy.should_retry("PUT", 1))
+        self.assertFalse(policy.should_retry("GET", 2, 503))
+        self.assertFalse(policy.should_retry("GET", 0, 400))
+        self.assertFalse(policy.should_retry("POST", 0, 503))
+
+    def testDelay(self):
+        policy = RetryPolicy(backoff=1, max_backoff=5, jitter=False)
+        self.assertEqual([policy.get_delay(attempt) for attempt in range(4)], [1, 2, 4, 5])
+        self.assertEqual(policy.get_delay(0, "3"), 3)
+        self.assertEqual(policy.get_delay(0, "Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+
+    def testTokenBucket(self):
+        bucket = TokenBucket(100, burst=2)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertTrue(bucket.acquire() > 0)
+
+        bucket = TokenBucket(100, burst=1)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertTrue(0 < bucket.try_acquire() <= 0.01)
+
+class KeepAliveServer(object):
+    """
+
+    HTTP/1.1 server answering at most per_connection requests on each
+    connection, and closing it without answering when the next one arrives
+
+    """
+
+    def __init__(self, per_connection=None, delay=0):
+        self.per_connection = per_connection
+        self.delay = delay
+        self.requests = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(5)
+        self._socket.settimeout(0.05)
+        self._running = True
+        self.url = "http://127.0.0.1:%d" % self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self._socket.close()
+
+    def _accept(self):
+        while self._running:
+            try:
+                client, address = self._socket.accept()
+            except socket.timeout:
+                continue
+            client.settimeout(None)
+            thread = threading.Thread(target=self._serve, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, client):
+        reader = client.makefile("rb")
+        answered = 0
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    return
+                length = 0
+                header = reader.readline()
+                while header.strip():
+                    if header.lower().startswith("content-length:"):
+                        length = int(header.split(":", 1)[1])
+                    header = reader.readline()
+                if length:
+                    reader.read(length)
+                self.requests.append(line.split()[0])
+
+                if self.per_connection is not None and answered >= self.per_connection:
+                    return
+                time.sleep(self.delay)
+                client.sendall("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}")
+                answered += 1
+        except socket.error:
+            pass
+        finally:
+            reader.close()
+            client.close()
+
+class TestHTTPConnectionPool(unittest.TestCase):
+    """
+
+    A test class for the pool of persistent connections
+
+    """
+
+    def start(self, **kwargs):
+        self.server = KeepAliveServer(**kwargs)
+        return self.server
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testReuse(self):
+        server = self.start()
+        pool = HTTPConnectionPool()
+        for i in range(3):
+            response, body = pool.request("GET", server.url + "/rooms.json")
+            self.assertEqual(body, "{}")
+        stats = pool.get_stats()
+        self.assertEqual((stats["created"], stats["reused"], stats["requests"]), (1, 2, 3))
+        self.assertEqual((stats["idle"], stats["in_use"]), (1, 0))
+
+    def testPoolStats(self):
+        server = self.start()
+        connection = Connection(base_url=server.url, user="x", password="x", retry=False)
+        connection.get("rooms")
+        connection.get("rooms")
+        stats = connection.get_pool_stats()
+        self.assertEqual((stats["created"], stats["reused"], stats["idle"]), (1, 1, 1))
+
+    def testIdleEviction(self):
+        server = self.start()
+        pool = HTTPConnectionPool(idle_timeout=0.1)
+        pool.request("GET", server.url + "/")
+        time.sleep(0.2)
+        pool.request("GET", server.url + "/")
+        stats = pool.get_stats()
+        self.assertEqual((stats["created"], stats["reused"], stats["evicted"]), (2, 0, 1))
+
+    def testStaleConnectionRetry(self):
+        server = self.start(per_connection=1)
+        pool = HTTPConnectionPool()
+        self.assertEqual(pool.request("GET", server.url + "/")[1], "{}")
+        self.assertEqual(pool.request("GET", server.url + "/")[1], "{}")
+        # The second request was sent on the kept-alive connection, and again on a new one
+        self.assertEqual(server.requests, ["GET", "GET", "GET"])
+        stats = pool.get_stats()
+        self.assertEqual((stats["created"], stats["reused"], stats["discarded"]), (2, 1, 1))
+
+    def testFreshConnectionKeepsIdle(self):
+        server = self.start()
+        pool = HTTPConnectionPool(max_per_host=3)
+        parts = urlparse.urlsplit(server.url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        connections = [pool._acquire(key)[0] for i in range(2)]
+        for connection in connections:
+            pool._release(key, connection)
+
+        # There is room for a new connection, so idle ones are kept
+        connection, reused = pool._acquire(key, fresh=True)
+        self.assertFalse(reused)
+        stats = pool.get_stats()
+        self.assertEqual((stats["evicted"], stats["idle"], stats["in_use"]), (0, 2, 1))
+
+        # Without room, the oldest idle one is replaced
+        pool._acquire(key, fresh=True)
+        stats = pool.get_stats()
+        self.assertEqual((stats["evicted"], stats["idle"], stats["in_use"]), (1, 1, 2))
+
+    def testNoRetryForPost(self):
+        server = self.start(per_connection=1)
+        pool = HTTPConnectionPool()
+        pool.request("GET", server.url + "/")
+        self.assertRaises(httplib.BadStatusLine, pool.request, "POST", server.url + "/", body="{}")
+        self.assertEqual(server.requests, ["GET", "POST"])
+
+    def testTimeoutIsPerRequest(self):
+        server = self.start()
+        pool = HTTPConnectionPool()
+        pool.request("GET", server.url + "/", timeout=0.1)
+        server.delay = 0.3
+        # Reuses the connection, which no longer has the previous request's timeout
+        self.assertEqual(pool.request("GET", server.url + "/")[1], "{}")
+        self.assertEqual(pool.get_stats()["reused"], 1)
+
+    def testNoRetryOnTimeout(self):
+        server = self.start(delay=0.3)
+        pool = HTTPConnectionPool()
+        pool.request("GET", server.url + "/")
+        self.assertRaises(socket.timeout, pool.request, "GET", server.url + "/", timeout=0.05)
+        time.sleep(0.4)
+        self.assertEqual(server.requests, ["GET", "GET"])
+        self.assertEqual(pool.get_stats()["in_use"], 0)
+
+class TestDecoder(unittest.TestCase):
+    """
+
+    A test class for the incremental JSON decoder
+
+    """
+
+    def testIterArray(self):
+        messages = [{"id": id, "body": u"caf\xe9 \"%d\" ]" % id} for id in range(50)]
+        text = json.dumps({"messages": messages})
+        for chunk_size in [1, 7, 4096]:
+            self.assertEqual(list(decoder.iter_array(StringIO.StringIO(text).read, "messages", chunk_size)), messages)
+
+    def testIterArrayEmpty(self):
+        self.assertEqual(list(decoder.iter_array(StringIO.StringIO('{"messages": []}').read, "messages")), [])
+        self.assertEqual(list(decoder.iter_array(StringIO.StringIO('{"messages": null}').read, "messages")), [])
+
+    def testIterArrayInvalid(self):
+        self.assertRaises(ValueError, list, decoder.iter_array(StringIO.StringIO('{"rooms": []}').read, "messages"))
+        self.assertRaises(ValueError, list, decoder.iter_array(StringIO.StringIO('{"messages": [{"id": 1}').read, "messages"))
+
+class TestChunkedDecoder(unittest.TestCase):
+    """
+
+    A test class for the chunked transfer decoder
+
+    """
+
+    def setUp(self):
+        self.data = "5\r\nHello\r\n1;name=value\r\n \r\nc\r\nworld\r\nagain\r\n0\r\nTrailer: yes\r\n\r\nextra"
+
+    def testWholeAndSplit(self):
+        decoder = chunked.ChunkedDecoder()
+        self.assertEqual(decoder.feed(self.data), "Hello world\r\nagain")
+        self.assertTrue(decoder.is_done())
+
+        for size in (1, 2, 3, 7):
+            decoder = chunked.ChunkedDecoder()
+            decoded = "".join([decoder.feed(bytearray(self.data[start:start + size])) for start in range(0, len(self.data), size)])
+            self.assertEqual(decoded, "Hello world\r\nagain")
+            self.assertTrue(decoder.is_done())
+
+    def testInvalid(self):
+        self.assertRaises(ValueError, chunked.ChunkedDecoder().feed, "zz\r\n")
+        self.assertRaises(ValueError, chunked.ChunkedDecoder().feed, "1\r\nab\r\n")
+        self.assertRaises(ValueError, chunked.ChunkedDecoder(max_line=10).feed, "1" * 20)
+
+    def testLineBuffer(self):
+        lines = chunked.LineBuffer()
+        self.assertEqual(lines.feed("one\rtw"), ["one"])
+        self.assertEqual(lines.feed("o"), [])
+        self.assertEqual(lines.get_pending(), "two")
+        self.assertEqual(lines.feed("\r \rthree\r"), ["two", "three"])
+        self.assertEqual(lines.get_pending(), "")
+
+class FakeStream(object):
+    """
+
+    Receives what a live stream protocol parses
+
+    """
+
+    def __init__(self, compress=True):
+        self.messages = []
+        self.lines = []
+        self.received_bytes = 0
+        self._connection = Connection(base_url="http://localhost", user="x", password="x", compress=compress)
+
+    def get_room_id(self):
+        return 1
+
+    def get_connection(self):
+        return self._connection
+
+    def set_protocol(self, protocol):
+        pass
+
+    def connected(self):
+        pass
+
+    def received(self, messages, received_bytes=0):
+        self.messages.extend(messages)
+        self.received_bytes += received_bytes
+
+    def received_lines(self, lines, received_bytes=0):
+        self.lines.extend(lines)
+        self.received_bytes += received_bytes
+
+class FakeFactory(object):
+    def __init__(self, stream):
+        self._stream = stream
+
+    def get_stream(self):
+        return self._stream
+
+class TestLiveStreamProtocol(unittest.TestCase):
+    """
+
+    A test class for the live stream protocol
+
+    """
+
+    def connect(self, compress=True, raw=False):
+        stream = FakeStream(compress)
+        protocol = RawLiveStreamProtocol() if raw else LiveStreamProtocol()
+        protocol.factory = FakeFactory(stream)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        return (protocol, transport, stream)
+
+    def chunk(self, data):
+        return "%x\r\n%s\r\n" % (len(data), data)
+
+    def testPlain(self):
+        protocol, transport, stream = self.connect(compress=False)
+        self.assertFalse("Accept-Encoding" in transport.value())
+
+        data = ["HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n", self.chunk(" "), self.chunk('{"id": 1}\r{"id": 2}\r')]
+        for chunk in data:
+            protocol.dataReceived(chunk)
+        self.assertEqual(stream.messages, [{"id": 1}, {"id": 2}])
+        # Headers and keep alives are counted with the next messages
+        self.assertEqual(stream.received_bytes, len("".join(data)))
+
+    def testSplitReads(self):
+        protocol, transport, stream = self.connect(compress=False)
+        data = "".join([self.chunk(json.dumps({"id": id}) + "\r") for id in range(20)])
+        data = "HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" + self.chunk(" ") + data
+        for start in range(0, len(data), 7):
+            protocol.dataReceived(data[start:start + 7])
+        self.assertEqual(stream.messages, [{"id": id} for id in range(20)])
+
+    def testRaw(self):
+        protocol, transport, stream = self.connect(compress=False, raw=True)
+        protocol.dataReceived("HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+        protocol.dataReceived(self.chunk(" "))
+        protocol.dataReceived(self.chunk('{"id": 1}\r{"id": 2}\r{"id": 3}'))
+        # Messages not followed by a carriage return are not parsed to tell if they are complete
+        self.assertEqual(stream.lines, ['{"id": 1}', '{"id": 2}'])
+        protocol.dataReceived(self.chunk('\r'))
+        self.assertEqual(stream.lines, ['{"id": 1}', '{"id": 2}', '{"id": 3}'])
+        self.assertEqual(stream.messages, [])
+        self.assertTrue(stream.received_bytes > 0)
+
+    def testCompressed(self):
+        protocol, transport, stream = self.connect()
+        self.assertTrue("Accept-Encoding: gzip, deflate" in transport.value())
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = "".join([json.dumps({"id": id}) + "\r" for id in range(20)])
+        protocol.dataReceived("HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for start in range(0, len(data), 25):
+            protocol.dataReceived(self.chunk(compressor.compress(data[start:start + 25]) + compressor.flush(zlib.Z_SYNC_FLUSH)))
+        self.assertEqual(stream.messages, [{"id": id} for id in range(20)])
+
+class TestPipeTransport(unittest.TestCase):
+    """
+
+    A test class for the transport between streaming processes and streams
+
+    """
+
+    def testSendReceive(self):
+        transport = PipeTransport()
+        self.assertTrue(transport.send(['{"id": 1}', '{"id": 2}'], 1300024800.5))
+        self.assertTrue(transport.send(['{"id": 3}'], 1300024801))
+        self.assertEqual(transport.get_stats()["queue_depth"], 2)
+
+        self.assertEqual(transport.receive(1), (1300024800.5, ['{"id": 1}', '{"id": 2}']))
+        self.assertEqual(transport.receive(1), (1300024801, ['{"id": 3}']))
+        self.assertEqual(transport.receive(0), None)
+        self.assertEqual(transport.get_stats(), {"queue_depth": 0, "max_depth": 1000, "dropped": 0})
+        transport.close()
+
+    def testDrop(self):
+        transport = PipeTransport(max_depth=2, overflow="drop")
+        self.assertTrue(transport.send(["1"], 0))
+        self.assertTrue(transport.send(["2"], 0))
+        self.assertFalse(transport.send(["3", "4"], 0, 10))
+        self.assertEqual(transport.get_stats()["dropped"], 2)
+        self.assertEqual(transport.take_received_bytes(), 10)
+        self.assertEqual(transport.take_received_bytes(), 0)
+
+        self.assertEqual(transport.receive(1)[1], ["1"])
+        self.assertTrue(transport.send(["5"], 0))
+        self.assertEqual(transport.receive(1)[1], ["2"])
+        self.assertEqual(transport.receive(1)[1], ["5"])
+        transport.close()
+
+    def testErrorAndWake(self):
+        transport = PipeTransport()
+        transport.send_error(RuntimeError(401, "Unauthorized"))
+        error = transport.receive(1)
+        self.assertTrue(isinstance(error, RuntimeError))
+        self.assertEqual(error.args, (401, "Unauthorized"))
+
+        threading.Timer(0.1, transport.wake).start()
+        started = time.time()
+        self.assertEqual(transport.receive(5), None)
+        self.assertTrue(time.time() - started < 1)
+        transport.close()
+
+class TestMetrics(unittest.TestCase):
+    """
+
+    A test class for the metrics registry
+
+    """
+
+    def testEndpoint(self):
+        self.assertEqual(metrics.endpoint("https://x.campfirenow.com/room/123/speak.json"), "room/:id/speak")
+        self.assertEqual(metrics.endpoint("users/5.json?a=1"), "users/:id")
+        self.assertEqual(metrics.endpoint("rooms.json"), "rooms")
+
+    def testRegistry(self):
+        registry = metrics.MetricsRegistry(buckets=(0.1, 1))
+        registry.increment("requests_total", {"status": 200})
+        registry.increment("requests_total", {"status": 200}, 2)
+        registry.add("in_flight", 1)
+        registry.observe("duration_seconds", 0.5)
+        registry.observe("duration_seconds", 2)
+
+        self.assertEqual(registry.get_counter("requests_total", {"status": 200}), 3)
+        self.assertEqual(registry.get_gauge("in_flight"), 1)
+        self.assertEqual(registry.get_histogram("duration_seconds")["buckets"], [(0.1, 0), (1, 1)])
+
+        text = registry.to_prometheus()
+        self.assertTrue('requests_total{status="200"} 3' in text)
+        self.assertTrue('duration_seconds_bucket{le="+Inf"} 2' in text)
+        self.assertTrue('duration_seconds_sum 2.5' in text)
+
+class StubResponse(object):
+    """
+
+    Twisted response with a body that is delivered right away
+
+    """
+
+    def __init__(self, code, headers, body, lost=False):
+        self.code = code
+        self.phrase = httplib.responses.get(code, "")
+        self.headers = http_headers.Headers(dict([(name, [value]) for name, value in headers.items()]))
+        self.length = len(body)
+        self._body = body
+        self._lost = lost
+
+    def deliverBody(self, protocol):
+        protocol.dataReceived(self._body)
+        reason = error.ConnectionLost() if self._lost else client.ResponseDone()
+        protocol.connectionLost(failure.Failure(reason))
+
+class BlockingAgent(object):
+    """
+
+    Twisted agent issuing each request right away (blocking), so deferred
+    APIs can be tested without running the reactor. Responses given in
+    answers (lists of :class:`StubResponse` by method and path) are used
+    before asking the server
+
+    """
+
+    def __init__(self, answers=None):
+        self.answers = answers or {}
+        self.requests = []
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        url = urlparse.urlsplit(uri)
+        self.requests.append((method, url.path))
+        if self.answers.get((method, url.path)):
+            return defer.succeed(self.answers[(method, url.path)].pop(0))
+
+        body = bodyProducer._inputFile.read() if bodyProducer else None
+        connection = httplib.HTTPConnection(url.hostname, url.port)
+        try:
+            connection.request(method, url.path + ("?" + url.query if url.query else ""), body,
+                dict([(name, values[0]) for name, values in headers.getAllRawHeaders()]))
+            response = connection.getresponse()
+            return defer.succeed(StubResponse(response.status, dict(response.getheaders()), response.read()))
+        finally:
+            connection.close()
+
+class TestDeferred(unittest.TestCase):
+    """
+
+    A test class for the non blocking API, run against a local fake Campfire server
+
+    """
+
+    def setUp(self):
+        self.server = FakeCampfireServer(history=5).start()
+        self.campfire = Campfire("test", "user", "password", base_url=self.server.url, stream_url=self.server.url)
+        self.agent = BlockingAgent()
+        self.clock = task.Clock()
+        connection = self.campfire.get_connection()
+        connection._agent = self.agent
+        connection.get_twisted_reactor = lambda: self.clock
+        self.deferred = self.campfire.get_deferred()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def succeeded(self, deferred):
+        results = []
+        deferred.addBoth(results.append)
+        self.assertEqual(len(results), 1)
+        if isinstance(results[0], failure.Failure):
+            results[0].raiseException()
+        return results[0]
+
+    def failed(self, deferred):
+        results = []
+        deferred.addBoth(results.append)
+        self.assertEqual(len(results), 1)
+        self.assertTrue(isinstance(results[0], failure.Failure))
+        return results[0]
+
+    def testRooms(self):
+        self.assertEqual([room["name"] for room in self.succeeded(self.deferred.get_rooms())], ["Room 1", "Room 2", "Room 3"])
+
+        room = self.succeeded(self.deferred.get_room_by_name("Room 2"))
+        self.assertTrue(isinstance(room, DeferredRoom))
+        self.assertEqual((room.id, room.name), (2, "Room 2"))
+        self.assertTrue(room.get_room() is self.campfire.get_room(2))
+        self.assertTrue(self.failed(self.deferred.get_room_by_name("Missing")).check(RoomNotFoundException))
+        requests = len(self.agent.requests)
+        self.assertTrue(self.failed(self.deferred.get_room_by_name("Missing")).check(RoomNotFoundException))
+        self.assertEqual(len(self.agent.requests), requests)
+
+    def testFindRoomsAndHighlight(self):
+        self.assertEqual([room["id"] for room in self.succeeded(self.deferred.find_rooms("room"))], [1, 2, 3])
+        requests = len(self.agent.requests)
+        self.assertEqual([room["id"] for room in self.succeeded(self.deferred.find_rooms("ROOM 2"))], [2])
+        self.assertEqual(len(self.agent.requests), requests)
+
+        self.agent.answers[("POST", "/messages/5/star.json")] = [StubResponse(200, {}, "")]
+        self.agent.answers[("DELETE", "/messages/5/star.json")] = [StubResponse(200, {}, "")]
+        self.assertTrue(self.succeeded(self.deferred.highlight(5)))
+        self.assertTrue(self.succeeded(self.deferred.remove_highlight(Message(self.campfire, {"id": 5, "type": "TextMessage"}))))
+
+    def testRequestErrorBeforeIssued(self):
+        def fail(method, url, headers):
+            raise RuntimeError("Hook failed")
+
+        connection = self.campfire.get_connection()
+        connection.add_hook("before", fail)
+        self.assertTrue(self.failed(self.deferred.get_rooms()).check(RuntimeError))
+        connection.remove_hook("before", fail)
+        # The failed request is no longer in flight, so it is not waited for
+        self.assertEqual(len(self.succeeded(self.deferred.get_rooms())), 3)
+
+    def testSpeakAndRecent(self):
+        room = self.succeeded(self.deferred.get_room(1))
+        message = self.succeeded(room.speak("Hello deferred"))
+        self.assertEqual(message.body, "Hello deferred")
+
+        messages = self.succeeded(room.recent(limit=3))
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(messages[-1].body, "Hello deferred")
+        requests = len(self.agent.requests)
+        server_requests = self.server.get_stats()["requests"]
+        # Users and rooms were loaded, and set, while building the messages
+        self.assertEqual(messages[0].user.id, self.server.get_messages(1)[-3]["user_id"])
+        self.assertTrue(all([message.room is room.get_room() for message in messages]))
+        self.assertEqual(len(self.agent.requests), requests)
+        self.assertEqual(self.server.get_stats()["requests"], server_requests)
+
+    def testErrors(self):
+        self.agent.answers[("GET", "/rooms.json")] = [StubResponse(401, {}, "")]
+        self.assertTrue(self.failed(self.deferred.get_rooms()).check(AuthenticationError))
+
+        self.assertTrue(self.failed(self.deferred.get_room(99)).check(ConnectionError))
+
+        room = self.succeeded(self.deferred.get_room(1))
+        self.agent.answers[("POST", "/room/1/join.json")] = [StubResponse(500, {}, "Server error")]
+        result = self.failed(room.join())
+        self.assertTrue(result.check(urllib2.HTTPError))
+        self.assertEqual(result.value.code, 500)
+
+    def testConnectionLost(self):
+        room = self.succeeded(self.deferred.get_room(1))
+        self.agent.answers[("POST", "/room/1/join.json")] = [StubResponse(200, {}, "{", lost=True)]
+        self.assertTrue(self.failed(room.join()).check(ConnectionError))
+
+        # GET requests are retried
+        self.agent.answers[("GET", "/rooms.json")] = [StubResponse(200, {}, '{"rooms": [', lost=True)]
+        rooms = self.deferred.get_rooms()
+        self.clock.advance(60)
+        self.assertEqual(len(self.succeeded(rooms)), 3)
+        self.assertEqual(self.campfire.get_connection().get_retry_stats()["retries"], 1)
+
+    def testRateLimited(self):
+        connection = Connection(base_url=self.server.url, user="user", password="password", rate_limit=100)
+        connection._agent = self.agent
+        connection.get_twisted_reactor = lambda: self.clock
+        self.agent.answers[("GET", "/rooms.json")] = [StubResponse(429, {"Retry-After": "0.05"}, "")]
+
+        results = []
+        connection.deferred_get("rooms").addBoth(results.append)
+        started = time.time()
+        while not results and time.time() - started < 5:
+            self.clock.advance(0.01)
+            time.sleep(0.01)
+
+        self.assertEqual(len(results[0]), 3)
+        stats = connection.get_retry_stats()
+        self.assertEqual((stats["rate_limited"], stats["retries"], stats["throttled"]), (1, 1, 1))
+        # The retry waited for the rate limiter, which the 429 blocked
+        self.assertTrue(stats["throttle_wait"] > 0.02)
+
+class CountingPolicy(object):
+    def __init__(self):
+        self.calls = []
+
+    def creatorForNetloc(self, hostname, port):
+        self.calls.append((hostname, port))
+        return object()
+
+class TestTwistedAgent(unittest.TestCase):
+    """
+
+    A test class for the twisted agent shared by a connection
+
+    """
+
+    def testPersistentPool(self):
+        connection = Connection(base_url="http://localhost", user="x", password="x", pool_size=3, pool_idle_timeout=30, compress=False)
+        connection.get_twisted_reactor = lambda: task.Clock()
+        agent = connection.get_twisted_agent()
+        self.assertTrue(connection.get_twisted_agent() is agent)
+
+        pool = connection._twisted_pool
+        self.assertTrue(pool.persistent)
+        self.assertEqual((pool.maxPersistentPerHost, pool.cachedConnectionTimeout), (3, 30))
+
+        results = []
+        connection.close().addCallback(results.append)
+        self.assertEqual(len(results), 1)
+
+    def testCloseWithoutAgent(self):
+        self.assertEqual(Connection(base_url="http://localhost", user="x", password="x").close(), None)
+
+    def testCachingPolicy(self):
+        wrapped = CountingPolicy()
+        policy = CachingPolicyForHTTPS(wrapped)
+        creator = policy.creatorForNetloc("example.com", 443)
+        self.assertTrue(policy.creatorForNetloc("example.com", 443) is creator)
+        self.assertFalse(policy.creatorForNetloc("example.org", 443) is creator)
+        self.assertEqual(wrapped.calls, [("example.com", 443), ("example.org", 443)])
+
+class TestEndToEnd(unittest.TestCase):
+    """
+
+    A test class running pyfire against a local fake Campfire server
+
+    """
+
+    def setUp(self):
+        self.server = FakeCampfireServer(history=20, stream_messages=5).start()
+        self.campfire = Campfire("test", "user", "password", base_url=self.server.url, stream_url=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testRest(self):
+        self.assertEqual(self.campfire.get_user().id, 1)
+        self.assertEqual([room["name"] for room in self.campfire.get_rooms()], ["Room 1", "Room 2", "Room 3"])
+
+        room = self.campfire.get_room_by_name("Room 2")
+        self.assertEqual(len(room.recent(limit=5)), 5)
+        self.assertEqual(len(room.transcript()), 20)
+        self.assertEqual(len(list(room.iter_transcript())), 20)
+
+        message = room.speak("Hello world")
+        self.assertEqual(message.body, "Hello world")
+        self.assertEqual(message.user.id, 1)
+        self.assertEqual([found.id for found in self.campfire.search("hello")], [message.id])
+
+    def testRoomByName(self):
+        self.campfire.get_user()
+        requests = self.server.get_stats()["requests"]
+        self.assertEqual(self.campfire.get_room_by_name("Room 2").id, 2)
+        self.assertEqual(self.campfire.get_room_by_name("room 3", case_sensitive=False).id, 3)
+        self.assertEqual([room["id"] for room in self.campfire.find_rooms("room")], [1, 2, 3])
+        # rooms and room/2, room/3
+        self.assertEqual(self.server.get_stats()["requests"], requests + 3)
+
+        self.campfire.get_room(2).set_name("Renamed")
+        self.assertEqual(self.campfire.get_room_by_name("Renamed").id, 2)
+
+        requests = self.server.get_stats()["requests"]
+        for i in range(3):
+            self.assertRaises(RoomNotFoundException, self.campfire.get_room_by_name, "Missing")
+        # rooms, only for the first miss
+        self.assertEqual(self.server.get_stats()["requests"], requests + 1)
+
+        self.campfire.get_room_index().invalidate()
+        self.assertRaises(RoomNotFoundException, self.campfire.get_room_by_name, "Missing")
+        self.assertEqual(self.server.get_stats()["requests"], requests + 2)
+
+    def concurrently(self, func, count=4):
+        results = [None] * count
+        start = threading.Event()
+
+        def call(index):
+            start.wait()
+            results[index] = func()
+
+        threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join(10)
+        return results
+
+    def testCoalescing(self):
+        self.campfire.get_user()
+        self.server.latency = 0.2
+        connection = self.campfire.get_connection()
+
+        requests = self.server.get_stats()["requests"]
+        results = self.concurrently(lambda: connection.get("room/2"))
+        self.assertEqual(self.server.get_stats()["requests"], requests + 1)
+        self.assertTrue(all([result == results[0] for result in results]))
+        self.assertEqual(len(set([id(result) for result in results])), len(results))
+
+        requests = self.server.get_stats()["requests"]
+        rooms = self.concurrently(lambda: self.campfire.get_room(3))
+        self.assertEqual(self.server.get_stats()["requests"], requests + 1)
+        self.assertTrue(all([room is rooms[0] for room in rooms]))
+        self.assertTrue(isinstance(rooms[0].created_at, datetime.datetime))
+
+    def testConnectionOptions(self):
+        registry = metrics.MetricsRegistry()
+        campfire = Campfire("test", "user", "password", base_url=self.server.url,
+            connection={"retry": {"max_retries": 1}, "rate_limit": 100, "pool_size": 2, "metrics": registry})
+        connection = campfire.get_connection()
+        self.assertEqual((connection.get_setting("pool_size"), connection.get_metrics()), (2, registry))
+        self.assertEqual(connection._retry_policy.max_retries, 1)
+        self.assertTrue(connection._rate_limiter is not None)
+        self.assertEqual(copy.copy(campfire)._settings["connection"]["rate_limit"], 100)
+
+        connection.set_setting("retry", False)
+        connection.set_setting("rate_limit", None)
+        connection.set_setting("pool_size", 1)
+        self.assertEqual((connection._retry_policy, connection._rate_limiter), (None, None))
+        self.assertEqual(connection.get_pool()._max_per_host, 1)
+
+        connection.get_twisted_reactor = lambda: task.Clock()
+        connection.get_twisted_agent()
+        self.assertRaises(ValueError, connection.set_setting, "pool_size", 4)
+
+    def testCoalescingWithoutWaiters(self):
+        connection = self.campfire.get_connection()
+        copies = []
+
+        class CountingCopy(object):
+            @staticmethod
+            def deepcopy(value):
+                copies.append(value)
+                return copy.deepcopy(value)
+
+        pyfire.connection.copy = CountingCopy
+        try:
+            self.assertEqual(connection.get("room/2")["id"], 2)
+        finally:
+            pyfire.connection.copy = copy
+        self.assertEqual(copies, [])
+
+    def testLazyMessage(self):
+        self.server.add_upload(1, 2, "file.txt", 10)
+        data = dict(self.server.get_messages(1)[-1])
+        del data["upload"]
+
+        requests = self.server.get_stats()["requests"]
+        message = Message(self.campfire, dict(data))
+        self.assertTrue(message.is_upload())
+        self.assertEqual(message.body, "file.txt")
+        self.assertEqual(self.server.get_stats()["requests"], requests)
+
+        self.assertEqual(message.upload["url"], "http://example.com/uploads/%d/file.txt" % data["id"])
+        self.assertEqual(message.user.id, 2)
+        self.assertEqual(message.room.id, 1)
+        self.assertFalse(message.is_by_current_user())
+
+        message = Message(self.campfire, dict(data), prefetch=True)
+        message._prefetching.join(10)
+        requests = self.server.get_stats()["requests"]
+        self.assertEqual((message.user.id, message.room.id, message.upload["name"]), (2, 1, "file.txt"))
+        self.assertEqual(self.server.get_stats()["requests"], requests)
+
+    def testPrefetchMessages(self):
+        data = self.campfire.get_connection().get("room/2/transcript", key="messages")
+        user_ids = set([message["user_id"] for message in data if message.get("user_id")]) - set([1])
+        requests = self.server.get_stats()["requests"]
+
+        messages = [self.campfire.create_message(dict(message)) for message in data * 3]
+        self.campfire.prefetch(messages)
+        self.assertTrue(len(self.campfire._prefetch_queue._workers) <= self.campfire.get_connection().get_setting("pool_size"))
+        for message in messages:
+            self.assertTrue(message._prefetching.join(10))
+        # Each distinct user other than the current one, and the room
+        self.assertEqual(self.server.get_stats()["requests"], requests + len(user_ids) + 1)
+
+        requests = self.server.get_stats()["requests"]
+        self.assertEqual(set([message.user.id for message in messages]) - set([1]), user_ids)
+        self.assertTrue(all([message.room.id == 2 for message in messages]))
+        self.assertEqual(self.server.get_stats()["requests"], requests)
+
+    def testBuildMessages(self):
+        room = self.campfire.get_room(2)
+        requests = self.server.get_stats()["requests"]
+        messages = room.transcript()
+        users = set([message.get_data()["user_id"] for message in messages]) - set([1])
+        # transcript, and each distinct user other than the current one
+        self.assertEqual(self.server.get_stats()["requests"], requests + 1 + len(users))
+
+        requests = self.server.get_stats()["requests"]
+        self.assertEqual(set([message.user.id for message in messages]) - set([1]), users)
+        self.assertTrue(all([message.room is room for message in messages]))
+        self.assertEqual(self.server.get_stats()["requests"], requests)
+
+    def testBatch(self):
+        room = self.campfire.get_room(2)
+        requests = self.server.get_stats()["requests"]
+        batch = room.transcript(as_batch=True)
+        self.assertEqual(len(batch), 20)
+        self.assertEqual(batch.get_bodies(), None)
+        self.assertEqual(self.server.get_stats()["requests"], requests + 1)
+        self.assertEqual(len(room.recent(limit=5, as_batch={"bodies": True}).get_bodies()), 5)
+
+    def testStreamDecodesOnce(self):
+        received = []
+        batches = []
+        stream = self.campfire.get_room(1).get_stream()
+        stream.attach(received.append).attach(lambda message: received.append(message))
+        stream.attach_batch(batches.append)
+
+        data = self.server.get_messages(1)[-3:]
+        stream.incoming([dict(message) for message in data])
+        self.assertEqual(len(received), 6)
+        self.assertTrue(received[0] is received[1])
+        self.assertEqual([message.id for message in batches[0]], [message["id"] for message in data])
+        self.assertTrue(batches[0][0] is received[0])
+        self.assertEqual(stream.get_stats()["messages"], 3)
+
+    def wait(self, condition, timeout=10):
+        started = time.time()
+        while not condition() and time.time() - started < timeout:
+            time.sleep(0.05)
+        return condition()
+
+    def testStreamHub(self):
+        received = {}
+        registry = metrics.MetricsRegistry()
+        self.campfire.get_connection().set_metrics(registry)
+        hub = self.campfire.get_stream_hub()
+        for id in (1, 2):
+            hub.add_room(self.campfire.get_room(id)).attach(lambda message, id=id: received.setdefault(id, []).append(message.body))
+        hub.start()
+        try:
+            self.assertTrue(self.wait(lambda: hub.get_states() == {1: "connected", 2: "connected"}))
+            self.assertEqual(self.server.get_stats()["streams"], 2)
+
+            hub.add_room(self.campfire.get_room(3)).attach(lambda message: received.setdefault(3, []).append(message.body))
+            self.assertTrue(hub.remove_room(self.campfire.get_room(1)))
+            self.assertTrue(self.wait(lambda: hub.get_states() == {2: "connected", 3: "connected"}))
+
+            for id in (1, 2, 3):
+                self.campfire.get_room(id).speak("Message %d" % id)
+            self.assertTrue(self.wait(lambda: len(received.get(2, [])) + len(received.get(3, [])) >= 12))
+        finally:
+            hub.stop().join()
+
+        # 5 messages sent by the server when each stream starts, and the one spoken
+        self.assertEqual(received[2][-1], "Message 2")
+        self.assertEqual(received[3][-1], "Message 3")
+        self.assertFalse("Message 1" in received.get(1, []))
+        self.assertTrue(registry.get_counter("pyfire_stream_bytes_received_total", {"room": 2}) > 0)
+
+    def testLiveStream(self):
+        received = []
+        done = threading.Event()
+
+        def incoming(message):
+            received.append(message)
+            if len(received) == 6:
+                done.set()
+
+        registry = metrics.MetricsRegistry()
+        self.campfire.get_connection().set_metrics(registry)
+        room = self.campfire.get_room(1)
+        # A pause much longer than the join below, which only ends in time if stop() wakes the stream up
+        stream = Stream(room, pause=120)
+        stream.attach(incoming).start()
+        while self.server.get_stats()["streams"] < 1 and not done.is_set():
+            time.sleep(0.05)
+        room.speak("Live message")
+        done.wait(10)
+        stream.stop().join(30)
+
+        self.assertFalse(stream.is_alive())
+        # Counted by this process, with the messages the streaming process sent
+        self.assertTrue(registry.get_counter("pyfire_stream_bytes_received_total", {"room": 1}) > 0)
+        stats = stream.get_stats()
+        self.assertTrue(stats["delivery_median"] is not None and 0 <= stats["delivery_median"] < 10)
+        self.assertEqual(len(received), 6)
+        self.assertEqual(received[-1].body, "Live message")
+        self.assertEqual(received[0].room.id, 1)
+
+    def testLiveStreamTransport(self):
+        received = []
+        registry = metrics.MetricsRegistry()
+        self.campfire.get_connection().set_metrics(registry)
+        room = self.campfire.get_room(1)
+        stream = Stream(room, pause=120, transport={"max_depth": 10})
+        stream.attach(received.append).start()
+        try:
+            self.assertTrue(self.wait(lambda: self.server.get_stats()["streams"] >= 1))
+            room.speak("Live message")
+            self.assertTrue(self.wait(lambda: len(received) >= 6))
+            stats = stream.get_stats()
+        finally:
+            stream.stop().join(30)
+
+        self.assertFalse(stream.is_alive())
+        self.assertTrue(registry.get_counter("pyfire_stream_bytes_received_total", {"room": 1}) > 0)
+        self.assertEqual((stats["queue_depth"], stats["dropped"]), (0, 0))
+        self.assertEqual(len(received), 6)
+        self.assertEqual(received[-1].body, "Live message")
+        self.assertEqual(received[0].room.id, 1)
+
+class Entity(object):
+    def __init__(self, id):
+        self.id = id
+        self.loads = 0
+
+class TestIdentityMap(unittest.TestCase):
+    """
+
+    A test class for the identity map
+
+    """
+
+    def testEviction(self):
+        entities = IdentityMap(max_size=2)
+        first = entities.get(1, lambda: Entity(1))
+        entities.get(2, lambda: Entity(2))
+        entities.get(1)
+        entities.get(3, lambda: Entity(3))
+        self.assertEqual(entities.get_stats()["evictions"], 1)
+        self.assertEqual(entities.get_stats()["size"], 2)
+
+        # 2 was least recently used, and nothing else references it
+        self.assertEqual(entities.get(2), None)
+        self.assertTrue(entities.get(1) is first)
+
+    def testCanonicalWhileReferenced(self):
+        entities = IdentityMap(max_size=1)
+        first = entities.get(1, lambda: Entity(1))
+        entities.get(2, lambda: Entity(2))
+        self.assertTrue(entities.get(1, lambda: Entity(1)) is first)
+        self.assertTrue(entities.setdefault(1, Entity(1)) is first)
+
+        entities = IdentityMap(max_size=0)
+        entity = entities.get(1, lambda: Entity(1))
+        self.assertTrue(entities.get(1) is entity)
+        del entity
+        self.assertEqual(entities.get(1), None)
+
+    def testRefresh(self):
+        def refresh(entity):
+            entity.loads += 1
+
+        entities = IdentityMap(ttl=0.05, refresh=refresh)
+        entity = entities.get(1, lambda: Entity(1))
+        entities.get(1)
+        self.assertEqual(entity.loads, 0)
+        time.sleep(0.1)
+        self.assertTrue(entities.get(1, refresh=False) is entity)
+        self.assertEqual(entity.loads, 0)
+        self.assertTrue(entities.get(1) is entity)
+        self.assertEqual(entity.loads, 1)
+
+        stats = entities.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["refreshes"]), (3, 1, 1))
+
+class TestCompactMessage(unittest.TestCase):
+    """
+
+    A test class for the compact message representation
+
+    """
+
+    def setUp(self):
+        self.campfire = micro.StubCampfire()
+
+    def testSameAsMessage(self):
+        for data in corpus.messages(200):
+            message = Message(self.campfire, dict(data))
+            compact = CompactMessage(self.campfire, dict(data))
+            self.assertEqual(compact.get_data(), message.get_data())
+            self.assertEqual(compact.created_at, message.created_at)
+            self.assertEqual(compact.is_text(), message.is_text())
+            self.assertEqual(compact.user.id, message.user.id)
+            if message.is_tweet():
+                self.assertEqual(compact.tweet, message.tweet)
+
+    def testCompact(self):
+        data = {"id": 1, "type": u"TextMessage", "body": "Hi", "user_id": 2, "room_id": 3,
+            "starred": False, "created_at": "2011/03/13 11:00:00 -0300", "private": True}
+        first = CompactMessage(self.campfire, dict(data))
+        second = CompactMessage(self.campfire, dict(data))
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertTrue(first.type is second.type)
+        self.assertEqual(first.created_at_epoch, 1300024800)
+        self.assertEqual(first.created_at, datetime.datetime(2011, 3, 13, 14, 0, 0))
+        self.assertEqual(first.private, True)
+        self.assertRaises(AttributeError, getattr, first, "missing")
+
+class TestMessageBatch(unittest.TestCase):
+    """
+
+    A test class for column based message batches
+
+    """
+
+    def setUp(self):
+        self.messages = corpus.messages(500)
+        self.batch = MessageBatch(self.messages, bodies=True)
+
+    def testColumns(self):
+        self.assertEqual(len(self.batch), 500)
+        self.assertEqual(list(self.batch.get_column("id")), [message["id"] for message in self.messages])
+        self.assertEqual(self.batch[-1]["body"], self.messages[-1]["body"])
+        self.assertEqual(self.batch[0]["created_at"], Message(None, dict(self.messages[0])).created_at)
+
+    def testFilter(self):
+        since = Message(None, dict(self.messages[100])).created_at
+        expected = [message["id"] for message in self.messages[100:]
+            if message["type"] == "TextMessage" and message["user_id"] in (1, 2, 3)]
+        found = self.batch.filter(types=["TextMessage"], user_ids=[1, 2, 3], since=since)
+        self.assertEqual(list(found.get_column("id")), expected)
+        self.assertEqual(len(self.batch.filter(types=["NoSuchMessage"])), 0)
+
+        counts = self.batch.count_by("type")
+        self.assertEqual(sum(counts.values()), 500)
+        self.assertEqual(counts["TextMessage"], len([message for message in self.messages if message["type"] == "TextMessage"]))
+
+    def testSlice(self):
+        view = self.batch[10:20]
+        self.assertTrue(view._columns is self.batch._columns)
+        self.assertEqual([message["id"] for message in view], [message["id"] for message in self.messages[10:20]])
+        self.assertEqual(view.get_bodies(), [message["body"] for message in self.messages[10:20]])
+        self.assertRaises(ValueError, view.append, self.messages[0])
+
+        joined = MessageBatch.concatenate([view, self.batch[-5:]])
+        self.assertEqual(list(joined.get_column("id")), [message["id"] for message in self.messages[10:20] + self.messages[-5:]])
+
+    def assertColumnCopies(self):
+        for batch in (self.batch, self.batch[10:20]):
+            ids = list(batch.get_column("id"))
+            column = batch.get_column("id")
+            column[0] = -1
+            self.assertEqual(list(batch.get_column("id")), ids)
+            self.assertEqual(batch[0]["id"], ids[0])
+
+    def testColumnCopiesWithoutNumpy(self):
+        numpy, pyfire.batch.numpy = pyfire.batch.numpy, None
+        try:
+            self.assertColumnCopies()
+        finally:
+            pyfire.batch.numpy = numpy
+
+    @unittest.skipIf(pyfire.batch.numpy is None, "NumPy is not installed")
+    def testColumnCopiesWithNumpy(self):
+        self.assertColumnCopies()
+
+    def testManyTypes(self):
+        names = ["CustomMessage%d" % index for index in range(300)]
+        batch = MessageBatch([{"id": index + 1, "type": name} for index, name in enumerate(names)])
+        self.assertEqual([message["type"] for message in batch], names)
+        self.assertEqual(batch.count_by("type")[names[-1]], 1)
+
+class TestRoomIndex(unittest.TestCase):
+    """
+
+    A test class for the room names index
+
+    """
+
+    def setUp(self):
+        self.index = RoomIndex(ttl=60)
+        self.index.update([
+            {"id": 1, "name": "Development"},
+            {"id": 2, "name": "Design"},
+            {"id": 3, "name": "Support"}
+        ])
+
+    def testGet(self):
+        self.assertEqual(self.index.get("Design")["id"], 2)
+        self.assertEqual(self.index.get("design"), None)
+        self.assertEqual(self.index.get("design", case_sensitive=False)["id"], 2)
+        self.assertEqual(self.index.get("Sales"), None)
+
+    def testFind(self):
+        self.assertEqual([room["id"] for room in self.index.find("de")], [2, 1])
+        self.assertEqual([room["id"] for room in self.index.find("SUP")], [3])
+        self.assertEqual(self.index.find("x"), [])
+        self.assertEqual(len(self.index.find("")), 3)
+
+    def testRename(self):
+        self.index.rename(2, "UX")
+        self.assertEqual(self.index.get("Design"), None)
+        self.assertEqual(self.index.get("UX")["id"], 2)
+        self.assertEqual([room["id"] for room in self.index.find("u")], [2])
+
+    def testMissing(self):
+        self.index.add_missing("Sales")
+        self.index.add_missing("MARKETING", case_sensitive=False)
+        self.assertTrue(self.index.is_missing("Sales"))
+        self.assertFalse(self.index.is_missing("sales"))
+        self.assertTrue(self.index.is_missing("marketing", case_sensitive=False))
+        self.index.update([{"id": 4, "name": "Sales"}])
+        self.assertFalse(self.index.is_missing("Sales"))
+
+    def testStale(self):
+        self.assertTrue(RoomIndex().is_stale())
+        self.assertFalse(self.index.is_stale())
+        self.index.invalidate()
+        self.assertTrue(self.index.is_stale())
+
+class TestSession(unittest.TestCase):
+    """
+
+    A test class for lazy authentication and the session cache
+
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "pyfire", "sessions.json")
+        self.server = FakeCampfireServer(history=0).start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def campfire(self, session=None):
+        return Campfire("test", "user", "password", base_url=self.server.url, session=session)
+
+    def testCache(self):
+        cache = SessionCache(self.path, ttl=60)
+        self.assertEqual(cache.get("key"), None)
+        cache.set("key", "token", {"id": 1})
+        self.assertEqual(cache.get("key")["token"], "token")
+        self.assertEqual(SessionCache(self.path).get("key")["user"], {"id": 1})
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode), 0o700)
+
+        cache.delete("key")
+        self.assertEqual(cache.get("key"), None)
+
+        SessionCache(self.path, ttl=-1).set("key", "token", {"id": 1})
+        self.assertEqual(cache.get("key"), None)
+
+    def testLazy(self):
+        campfire = self.campfire()
+        self.assertEqual(self.server.get_stats()["requests"], 0)
+        self.assertEqual(campfire.get_user().id, 1)
+        self.assertEqual(self.server.get_stats()["requests"], 1)
+
+    def testWarmStart(self):
+        self.campfire(session={"path": self.path}).get_rooms()
+        self.assertEqual(self.server.get_stats()["requests"], 2)
+
+        campfire = self.campfire(session={"path": self.path})
+        self.assertEqual(campfire.get_user().name, "User 1")
+        self.assertEqual(self.server.get_stats()["requests"], 2)
+        campfire.get_rooms()
+        self.assertEqual(self.server.get_stats()["requests"], 3)
+
+class TestMicroBenchmarks(unittest.TestCase):
+    """
+
+    A test class for the micro benchmark harness
+
+    """
+
+    def testRun(self):
+        results = micro.run(size=50, repeat=1)
+        self.assertEqual(sorted(results.keys()), sorted([name for name, benchmark in micro.BENCHMARKS]))
+        for result in results.values():
+            self.assertTrue(result["per_item_us"] > 0)
+
+    def testCompare(self):
+        results = {
+            "fast": {"per_item_us": 1.0},
+            "slow": {"per_item_us": 2.0},
+            "new": {"per_item_us": 3.0}
+        }
+        regressions = micro.compare(results, {"fast": 1.0, "slow": 1.0}, threshold=0.25)
+        self.assertEqual(regressions, {"slow": 2.0})
+        self.assertEqual(micro.compare(results, None), {})
+
+class TestStartup(unittest.TestCase):
+    """
+
+    A test class for the dependencies loaded when importing pyfire
+
+    """
+
+    def testImportIsLight(self):
+        result = startup.measure("import pyfire")
+        self.assertEqual(startup.heavy_modules(result["modules"]), [])
+        self.assertFalse("pyfire.stream" in result["modules"])
+        self.assertFalse("pyfire.upload" in result["modules"])
+
+    def testCloseIsLight(self):
+        result = startup.measure("import pyfire.connection; pyfire.connection.Connection(base_url='http://localhost').close()")
+        self.assertEqual(startup.heavy_modules(result["modules"]), [])
@@ -1,8 +1,7 @@
 import unittest, sys, os, xmlrunner
 sys.path.append('pyfire')
-from pyfire_test import TestPyFire
+import pyfire_test
 
 if __name__ == '__main__':
-    testSuite = unittest.TestLoader().loadTestsFromTestCase(TestPyFire)
+    testSuite = unittest.TestLoader().loadTestsFromModule(pyfire_test)
     xmlrunner.XMLTestRunner(output='reports').run(testSuite)
-    